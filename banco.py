@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime, timezone
+
+# ==========================================================
+# Banco de questões
+# A planilha é compilada (python banco.py build) num artefato SQLite com as
+# questões e os índices já prontos. Na inicialização só o artefato é lido;
+# pandas/openpyxl só entram se o artefato não existir ou estiver desatualizado
+# (hash da planilha diferente do gravado no artefato).
+# ==========================================================
+XLSX_PATH = os.getenv("BANCO_XLSX", "perguntascho2026.xlsx")
+ARTEFATO_PATH = os.getenv("BANCO_ARTEFATO", "perguntascho2026.banco.sqlite")
+
+FORMATO = "1"
+
+
+LETRAS = ("A", "B", "C", "D")
+
+
+def _extract_letter(value) -> str:
+    s = str(value).strip().upper()
+    m = re.search(r"\b([ABCD])\b", s)
+    return m.group(1) if m else ""
+
+
+class Question:
+    """
+    Questão imutável e compacta. Tema/subtema/qid são internados, então todas
+    as questões (e as filas das sessões, que guardam só qids) compartilham as
+    mesmas strings.
+    """
+
+    __slots__ = ("qid", "tema", "subtema", "pergunta", "opcoes", "correta", "explicacao")
+
+    def __init__(self, qid: str, tema: str, subtema: str, pergunta: str, opcoes: tuple, correta: str, explicacao: str):
+        object.__setattr__(self, "qid", sys.intern(qid))
+        object.__setattr__(self, "tema", sys.intern(tema))
+        object.__setattr__(self, "subtema", sys.intern(subtema))
+        object.__setattr__(self, "pergunta", pergunta)
+        object.__setattr__(self, "opcoes", opcoes)        # textos originais de A, B, C, D
+        object.__setattr__(self, "correta", correta)      # letra original correta ("" se ausente)
+        object.__setattr__(self, "explicacao", explicacao)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Question é imutável.")
+
+    def __delattr__(self, name):
+        raise AttributeError("Question é imutável.")
+
+    def __repr__(self):
+        return f"Question(qid={self.qid!r}, tema={self.tema!r}, subtema={self.subtema!r})"
+
+    @classmethod
+    def from_row(cls, qid: str, row: dict) -> "Question":
+        return cls(
+            qid=str(qid).strip(),
+            tema=str(row.get("Tema", "")),
+            subtema=str(row.get("Subtema", "")),
+            pergunta=str(row.get("Pergunta", "")),
+            opcoes=tuple(str(row.get(f"Opção {letra}", "")) for letra in LETRAS),
+            correta=_extract_letter(row.get("Resposta Correta", "")),
+            explicacao=str(row.get("Explicação", "") or "").strip(),
+        )
+
+
+class Banco:
+    """
+    Questões ({qid: Question}) e índices prontos para o quiz. Um Banco é um
+    snapshot: nunca é alterado depois de montado; uma recarga gera outro.
+    versao = início do sha256 da planilha de origem.
+    """
+
+    __slots__ = (
+        "questions_by_id", "temas", "tema_to_qids", "tema_to_subtemas", "subtema_to_qids", "fonte", "versao"
+    )
+
+    def __init__(self, questions_by_id, temas, tema_to_qids, tema_to_subtemas, subtema_to_qids, fonte, versao=""):
+        self.questions_by_id = questions_by_id
+        self.temas = temas
+        self.tema_to_qids = tema_to_qids
+        self.tema_to_subtemas = tema_to_subtemas
+        self.subtema_to_qids = subtema_to_qids
+        self.fonte = fonte
+        self.versao = versao
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 16), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _plain(v):
+    # numpy -> tipos nativos (para JSON)
+    return v.item() if hasattr(v, "item") else v
+
+
+def _ler_xlsx(path: str):
+    """
+    Carga e normalização da planilha (mesmas regras de sempre).
+    Retorna (linhas, temas, tema_to_qids, tema_to_subtemas, subtema_to_qids),
+    com linhas = [(qid, {coluna: valor}), ...].
+    """
+    import pandas as pd
+
+    df = pd.read_excel(path)
+    df.columns = df.columns.str.strip()
+
+    if "ID" not in df.columns:
+        raise RuntimeError("Coluna 'ID' não encontrada no Excel.")
+
+    df["ID"] = df["ID"].astype(str).str.strip()
+    df["Tema"] = df["Tema"].astype(str).str.strip()
+    df["Subtema"] = df["Subtema"].astype(str).str.strip()
+
+    linhas = [
+        (str(r["ID"]), {k: _plain(v) for k, v in r.dropna().to_dict().items()})
+        for _, r in df.iterrows()
+    ]
+
+    temas = sorted(df["Tema"].dropna().unique().tolist())
+    tema_to_qids = {
+        tema: [str(q) for q in df[df["Tema"] == tema]["ID"].astype(str).str.strip().tolist()]
+        for tema in temas
+    }
+    tema_to_subtemas = {
+        tema: sorted(df[df["Tema"] == tema]["Subtema"].dropna().unique().tolist())
+        for tema in temas
+    }
+    subtema_to_qids = {}
+    for tema in temas:
+        for sub in tema_to_subtemas[tema]:
+            subtema_to_qids[(tema, sub)] = [
+                str(q)
+                for q in df[(df["Tema"] == tema) & (df["Subtema"] == sub)]["ID"].astype(str).str.strip().tolist()
+            ]
+
+    return linhas, temas, tema_to_qids, tema_to_subtemas, subtema_to_qids
+
+
+def _montar(linhas, temas, tema_to_qids, tema_to_subtemas, subtema_to_qids, fonte, versao="") -> Banco:
+    questions_by_id = {}
+    for qid, r in linhas:
+        q = Question.from_row(qid, r)
+        questions_by_id[q.qid] = q
+
+    def _qids(lista):
+        # as listas de índice apontam para as mesmas strings das questões
+        return tuple(sys.intern(str(x).strip()) for x in lista)
+
+    tema_to_qids = {t: _qids(v) for t, v in tema_to_qids.items()}
+    subtema_to_qids = {k: _qids(v) for k, v in subtema_to_qids.items()}
+    return Banco(questions_by_id, temas, tema_to_qids, tema_to_subtemas, subtema_to_qids, fonte, versao)
+
+
+def compilar(xlsx_path: str = XLSX_PATH, artefato_path: str = ARTEFATO_PATH) -> str:
+    """
+    Gera o artefato a partir da planilha. Escreve num arquivo temporário e
+    troca no fim, para nunca deixar um artefato pela metade.
+    """
+    linhas, temas, tema_to_qids, tema_to_subtemas, subtema_to_qids = _ler_xlsx(xlsx_path)
+
+    tmp = artefato_path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute("CREATE TABLE meta (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        conn.execute("CREATE TABLE questoes (pos INTEGER PRIMARY KEY, qid TEXT NOT NULL, dados TEXT NOT NULL)")
+        conn.executemany(
+            "INSERT INTO questoes (pos, qid, dados) VALUES (?, ?, ?)",
+            [(i, qid, json.dumps(r, ensure_ascii=False)) for i, (qid, r) in enumerate(linhas)],
+        )
+        indices = {
+            "temas": temas,
+            "tema_to_qids": tema_to_qids,
+            "tema_to_subtemas": tema_to_subtemas,
+            "subtema_to_qids": [[t, s, qids] for (t, s), qids in subtema_to_qids.items()],
+        }
+        conn.executemany(
+            "INSERT INTO meta (chave, valor) VALUES (?, ?)",
+            [
+                ("formato", FORMATO),
+                ("fonte_sha256", _sha256(xlsx_path)),
+                ("fonte_nome", os.path.basename(xlsx_path)),
+                ("compilado_em", datetime.now(timezone.utc).isoformat()),
+                ("indices", json.dumps(indices, ensure_ascii=False)),
+            ],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp, artefato_path)
+    return artefato_path
+
+
+def _artefato_valido(xlsx_path: str, artefato_path: str) -> bool:
+    if not os.path.exists(artefato_path):
+        return False
+    try:
+        conn = sqlite3.connect(f"file:{artefato_path}?mode=ro", uri=True)
+        try:
+            meta = dict(conn.execute("SELECT chave, valor FROM meta WHERE chave IN ('formato', 'fonte_sha256')"))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return False
+    if meta.get("formato") != FORMATO:
+        return False
+    if not os.path.exists(xlsx_path):
+        # só o artefato foi publicado: confia nele
+        return True
+    return meta.get("fonte_sha256") == _sha256(xlsx_path)
+
+
+def _ler_artefato(artefato_path: str) -> Banco:
+    conn = sqlite3.connect(f"file:{artefato_path}?mode=ro", uri=True)
+    try:
+        linhas = [(qid, json.loads(d)) for qid, d in conn.execute("SELECT qid, dados FROM questoes ORDER BY pos")]
+        meta = dict(conn.execute("SELECT chave, valor FROM meta WHERE chave IN ('indices', 'fonte_sha256')"))
+    finally:
+        conn.close()
+
+    idx = json.loads(meta["indices"])
+    subtema_to_qids = {(t, s): qids for t, s, qids in idx["subtema_to_qids"]}
+    return _montar(
+        linhas, idx["temas"], idx["tema_to_qids"], idx["tema_to_subtemas"], subtema_to_qids, "artefato",
+        meta.get("fonte_sha256", "")[:12],
+    )
+
+
+def carregar(xlsx_path: str = XLSX_PATH, artefato_path: str = ARTEFATO_PATH) -> Banco:
+    if _artefato_valido(xlsx_path, artefato_path):
+        return _ler_artefato(artefato_path)
+    return _montar(*_ler_xlsx(xlsx_path), "xlsx", _sha256(xlsx_path)[:12])
+
+
+def atualizar(xlsx_path: str = XLSX_PATH, artefato_path: str = ARTEFATO_PATH) -> Banco:
+    """
+    Recarga com o bot no ar: se a planilha mudou, recompila o artefato (a
+    próxima inicialização já sai rápida) e devolve um snapshot novo.
+    """
+    if not _artefato_valido(xlsx_path, artefato_path):
+        compilar(xlsx_path, artefato_path)
+    return _ler_artefato(artefato_path)
+
+
+def assinatura_fontes(xlsx_path: str = XLSX_PATH, artefato_path: str = ARTEFATO_PATH) -> tuple:
+    """
+    (mtime, tamanho) da planilha e do artefato, para o vigia detectar troca de arquivo barato.
+    """
+    out = []
+    for path in (xlsx_path, artefato_path):
+        try:
+            st = os.stat(path)
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "build":
+        print(f"Artefato gerado: {compilar()}")
+    elif cmd == "check":
+        ok = _artefato_valido(XLSX_PATH, ARTEFATO_PATH)
+        print("Artefato em dia." if ok else "Artefato ausente ou desatualizado (rode: python banco.py build).")
+        sys.exit(0 if ok else 1)
+    else:
+        print("Uso: python banco.py build | check")
+        sys.exit(2)
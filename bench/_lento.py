@@ -0,0 +1,61 @@
+"""
+Latência de rede simulada para os benchmarks: envolve a conexão libsql e
+soma uma ida e volta a cada execute/commit.
+"""
+import time
+
+
+class SlowCursor:
+    def __init__(self, cur, delay: float):
+        self._cur = cur
+        self._delay = delay
+
+    def execute(self, sql, params=()):
+        time.sleep(self._delay)
+        return self._cur.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class SlowConn:
+    def __init__(self, conn, delay: float):
+        self._conn = conn
+        self._delay = delay
+
+    def cursor(self):
+        return SlowCursor(self._conn.cursor(), self._delay)
+
+    def commit(self):
+        time.sleep(self._delay)
+        return self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+_ESCRITAS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class SlowWritesCursor(SlowCursor):
+    """
+    Réplica embarcada: leituras saem do arquivo local, só as escritas
+    vão até o primário.
+    """
+
+    def execute(self, sql, params=()):
+        if sql.lstrip().upper().startswith(_ESCRITAS):
+            time.sleep(self._delay)
+        return self._cur.execute(sql, params)
+
+
+class SlowWritesConn(SlowConn):
+    def cursor(self):
+        return SlowWritesCursor(self._conn.cursor(), self._delay)
+
+
+def percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
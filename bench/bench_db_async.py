@@ -0,0 +1,147 @@
+"""
+Benchmark: caminho bloqueante (db_turso direto no event loop) x db_async.
+
+Cada "update" simulado faz o que um RESP faz: get_sent_correct + record_answer
+e depois um envio ao Telegram (simulado com asyncio.sleep). Além da vazão,
+mede o atraso do event loop: no caminho bloqueante todo chat espera o Turso.
+
+Uso (banco local descartável, latência de rede simulada):
+    TURSO_URL=file:/tmp/bench.db TURSO_AUTH_TOKEN=x \\
+        python bench/bench_db_async.py --updates 500 --latency-ms 30 --send-ms 80
+
+No arquivo local db_turso serializa as escritas (_WRITE_LOCK) e a latência
+simulada ficaria dentro desse lock: nenhuma escrita se sobreporia e o pool
+não teria o que ganhar. No Turso remoto não há esse lock (quem ordena é o
+servidor), então, para medir o que vale lá, cada conexão do pool grava na
+sua própria cópia do arquivo e o lock é tirado. Os dados ficam espalhados
+entre as cópias, o que não importa para vazão; --um-arquivo volta ao
+arquivo único (escritas em fila, como no bot em modo local).
+"""
+import argparse
+import asyncio
+import glob
+import itertools
+import os
+import shutil
+import sys
+import time
+from contextlib import nullcontext
+
+import libsql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db_turso  # noqa: E402
+import db_async  # noqa: E402
+from _lento import SlowConn  # noqa: E402
+
+
+def _arquivo_base() -> str:
+    if db_turso.DB_MODE == "local":
+        return db_turso.DB_PATH
+    return db_turso.TURSO_URL.removeprefix("file:")
+
+
+def _copias_por_conexao(base: str):
+    """
+    Fábrica de conexões: cada nova conexão abre uma cópia de `base` (já migrado).
+    """
+    contador = itertools.count()
+
+    def connect():
+        caminho = f"{base}.{next(contador)}"
+        for sufixo in ("", "-wal"):
+            if os.path.exists(base + sufixo):
+                shutil.copyfile(base + sufixo, caminho + sufixo)
+        conn = libsql.connect(caminho)
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    return connect
+
+
+async def _update_bloqueante(i: int, send_s: float):
+    uid = f"bench{i % 200}"
+    qid = str(i % 1000)
+    db_turso.get_sent_correct(uid, qid, i)
+    db_turso.record_answer(uid, qid, i % 3 == 0, "A", "BENCH", "BENCH")
+    await asyncio.sleep(send_s)
+
+
+async def _update_async(i: int, send_s: float):
+    uid = f"bench{i % 200}"
+    qid = str(i % 1000)
+    await db_async.get_sent_correct(uid, qid, i)
+    await db_async.record_answer(uid, qid, i % 3 == 0, "A", "BENCH", "BENCH")
+    await asyncio.sleep(send_s)
+
+
+async def _medir_atraso_loop(atrasos: list, parar: asyncio.Event, passo: float = 0.005):
+    """Mede quanto o event loop demora para acordar um timer (o que os outros chats sentem)."""
+    while not parar.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(passo)
+        atrasos.append(time.perf_counter() - t0 - passo)
+
+
+async def _rodar(fn, n: int, concorrencia: int, send_s: float):
+    sem = asyncio.Semaphore(concorrencia)
+
+    async def um(i):
+        async with sem:
+            await fn(i, send_s)
+
+    atrasos = []
+    parar = asyncio.Event()
+    monitor = asyncio.create_task(_medir_atraso_loop(atrasos, parar))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(um(i) for i in range(n)))
+    dt = time.perf_counter() - t0
+
+    parar.set()
+    await monitor
+    atrasos.sort()
+    p99 = atrasos[int(len(atrasos) * 0.99)] if atrasos else 0.0
+    return dt, p99, (atrasos[-1] if atrasos else 0.0)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--latency-ms", type=float, default=30.0, help="ida e volta simulada por query")
+    ap.add_argument("--send-ms", type=float, default=80.0, help="latência simulada do envio ao Telegram")
+    ap.add_argument("--pool", type=int, default=db_turso.DB_POOL_SIZE, help="conexões no pool")
+    ap.add_argument("--um-arquivo", action="store_true", help="todas as conexões no mesmo arquivo (escritas em fila)")
+    args = ap.parse_args()
+
+    db_turso.init_db()
+    base = _arquivo_base()
+    conectar = db_turso._connect
+    if not args.um_arquivo:
+        db_turso._POOL.close()
+        conectar = _copias_por_conexao(base)
+        db_turso._WRITE_LOCK = nullcontext()
+    atraso = args.latency_ms / 1000.0
+    db_turso.configure_pool(
+        size=args.pool,
+        connect=(lambda: SlowConn(conectar(), atraso)) if atraso > 0 else conectar,
+    )
+
+    send_s = args.send_ms / 1000.0
+    for nome, fn in (("bloqueante", _update_bloqueante), ("db_async", _update_async)):
+        dt, p99, pior = asyncio.run(_rodar(fn, args.updates, args.concurrency, send_s))
+        print(
+            f"{nome:>11}: {args.updates} updates em {dt:.2f}s -> {args.updates / dt:.1f} updates/s | "
+            f"atraso do loop p99={p99 * 1000:.1f}ms max={pior * 1000:.1f}ms"
+        )
+
+    print(f"pool: {db_turso.get_pool_stats()}")
+    db_async.shutdown()
+    for copia in glob.glob(glob.escape(base) + ".[0-9]*"):
+        os.remove(copia)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark: caminhos quentes do bot em cada DB_MODE (remote, replica, local).
+
+  - menu:     get_question_status_map com o cache frio (enviar_temas/subtemas)
+  - resposta: record_sent_question + get_sent_correct + record_answer
+  - score:    get_users_overall_scores + get_user_rank + get_overall_progress
+
+Sem credenciais do Turso os três modos são simulados sobre um arquivo local:
+  remote  -> toda ida ao banco paga --simulate-remote-ms
+  replica -> só as escritas pagam a ida e volta (leituras vêm do arquivo)
+  local   -> nenhuma latência extra
+
+Uso:
+    python bench/bench_db_modes.py --simulate-remote-ms 20 --reps 200
+    DB_MODE=replica TURSO_URL=libsql://... TURSO_AUTH_TOKEN=... python bench/bench_db_modes.py --real
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+if "--real" not in sys.argv:
+    os.environ["DB_MODE"] = "local"
+    os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="chobot-bench-"), "bench.db"))
+
+import db_turso  # noqa: E402
+from _lento import SlowConn, SlowWritesConn, percentil  # noqa: E402
+
+
+def _popular(usuarios: int, por_usuario: int):
+    for u in range(usuarios):
+        for q in range(por_usuario):
+            db_turso.record_answer(f"u{u}", str(q), (u + q) % 3 != 0, "A", f"T{q % 5}", f"S{q % 7}")
+    db_turso.flush_writes()
+
+
+def _medir(fn, reps: int) -> list:
+    lat = []
+    for i in range(reps):
+        t0 = time.perf_counter()
+        fn(i)
+        lat.append(time.perf_counter() - t0)
+    return lat
+
+
+def _menu(i):
+    db_turso._STATUS_CACHE.clear()
+    db_turso.get_question_status_map(f"u{i % 50}")
+
+
+def _resposta(i):
+    uid = f"u{i % 50}"
+    db_turso.record_sent_question(uid, "900", 10_000 + i, "B", "C,A,D,B")
+    correta = db_turso.get_sent_correct(uid, "900", 10_000 + i)
+    db_turso.record_answer(uid, "900", correta == "B", "B", "BENCH", "MODOS")
+
+
+def _score(i):
+    uid = f"u{i % 50}"
+    db_turso.get_users_overall_scores(limit=20, offset=0)
+    db_turso.get_user_rank(uid)
+    db_turso.get_overall_progress(uid)
+
+
+def _rodar(nome: str, reps: int):
+    linha = []
+    for caminho, fn in (("menu", _menu), ("resposta", _resposta), ("score", _score)):
+        lat = _medir(fn, reps)
+        linha.append(
+            f"{caminho} p50={percentil(lat, 0.50) * 1000:.2f}ms p99={percentil(lat, 0.99) * 1000:.2f}ms"
+        )
+    print(f"{nome:>8}: " + " | ".join(linha))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reps", type=int, default=200)
+    ap.add_argument("--simulate-remote-ms", type=float, default=20.0)
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--per-user", type=int, default=200)
+    ap.add_argument("--real", action="store_true", help="mede só o DB_MODE do ambiente, sem simulação")
+    args = ap.parse_args()
+
+    # gravação direta: o write-behind esconderia a latência das escritas
+    db_turso.configure_write_behind(False)
+    db_turso.init_db()
+
+    if args.real:
+        _rodar(db_turso.DB_MODE, args.reps)
+        db_turso.close()
+        return
+
+    _popular(args.users, args.per_user)
+    atraso = args.simulate_remote_ms / 1000.0
+    modos = (
+        ("remote", lambda: SlowConn(db_turso._connect(), atraso)),
+        ("replica", lambda: SlowWritesConn(db_turso._connect(), atraso)),
+        ("local", db_turso._connect),
+    )
+    print(f"{args.users} usuários x {args.per_user} respostas, ida e volta simulada={args.simulate_remote_ms:.0f}ms")
+    for nome, connect in modos:
+        db_turso.configure_pool(connect=connect)
+        _rodar(nome, args.reps)
+    db_turso.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark: montagem da fila no início da sessão (iniciar_quiz).
+
+  - pandas:  máscara booleana + copy + astype/strip + 3x isin + 3x sample + to_dict
+             (como era feito antes, sobre o DataFrame da planilha)
+  - índices: quiz.montar_fila sobre subtema_to_qids e o mapa de status
+
+Uso:
+    python banco.py build
+    TURSO_URL=file:/tmp/bench.db TURSO_AUTH_TOKEN=x python bench/bench_fila.py --reps 2000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import quiz  # noqa: E402
+from _lento import percentil  # noqa: E402
+
+
+def _fila_pandas(df, tema, subtema, all_status, limite):
+    base = df[(df["Tema"] == str(tema).strip()) & (df["Subtema"] == str(subtema).strip())].copy()
+    base["ID"] = base["ID"].astype(str).str.strip()
+    nao_resp, erradas, acertadas = [], [], []
+    for qid in base["ID"].tolist():
+        st = all_status.get(str(qid).strip())
+        if st is None:
+            nao_resp.append(qid)
+        elif st is False:
+            erradas.append(qid)
+        else:
+            acertadas.append(qid)
+    nao_resp = base[base["ID"].isin(nao_resp)].sample(frac=1).to_dict("records")
+    erradas = base[base["ID"].isin(erradas)].sample(frac=1).to_dict("records")
+    acertadas = base[base["ID"].isin(acertadas)].sample(frac=1).to_dict("records")
+    return (nao_resp + erradas + acertadas)[:limite]
+
+
+def _medir(fn, reps: int) -> list:
+    lat = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t0)
+    return lat
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reps", type=int, default=2000)
+    ap.add_argument("--limite", type=int, default=20)
+    args = ap.parse_args()
+
+    # maior subtema, com um terço respondido (metade errado)
+    (tema, subtema), qids = max(quiz.banco_atual().subtema_to_qids.items(), key=lambda kv: len(kv[1]))
+    rnd = random.Random(7)
+    status = {q: rnd.random() < 0.5 for q in rnd.sample(list(qids), len(qids) // 3)}
+    rng = random.Random(42)
+
+    resultados = [
+        ("índices", _medir(lambda: quiz.montar_fila(qids, status, args.limite, rng), args.reps)),
+    ]
+
+    try:
+        import pandas as pd
+
+        df = pd.read_excel(quiz.banco.XLSX_PATH)
+        df.columns = df.columns.str.strip()
+        for col in ("ID", "Tema", "Subtema"):
+            df[col] = df[col].astype(str).str.strip()
+        reps = max(1, args.reps // 10)
+        resultados.insert(0, ("pandas", _medir(lambda: _fila_pandas(df, tema, subtema, status, args.limite), reps)))
+    except ImportError:
+        print("(pandas não instalado: só o caminho por índices)")
+
+    print(f"subtema: {tema} / {subtema} ({len(qids)} questões), limite={args.limite}")
+    for nome, lat in resultados:
+        print(
+            f"{nome:>8}: p50={percentil(lat, 0.50) * 1e6:.1f}µs p99={percentil(lat, 0.99) * 1e6:.1f}µs "
+            f"({len(lat)} execuções)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark: planos e tempos das consultas quentes antes/depois das migrações
+de índices (db_turso._MIGRACOES 2-4), sobre uma base SQLite local.
+
+  - antes:  esquema na versão 1 (índices originais)
+  - depois: migrar() até a última versão (índices de cobertura)
+
+Consultas: get_sent_correct, get_last_perm_for_user_question,
+get_last_perms_for_user_questions (fila de 20), a poda de sent (EXISTS)
+e backfill_aggregates (GROUP BY por usuário/qid e por usuário/tema/subtema).
+
+Uso:
+    python bench/bench_indices.py --users 2000 --answers 200 --reps 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+os.environ["DB_MODE"] = "local"
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="chobot-indices-"), "bench.db"))
+
+import db_turso  # noqa: E402
+from _lento import percentil  # noqa: E402
+
+PODA = """
+SELECT COUNT(*) FROM sent
+WHERE id > ? AND id <= ?
+  AND EXISTS (
+      SELECT 1 FROM sent AS novo
+      WHERE novo.user_id = sent.user_id AND novo.qid = sent.qid AND novo.id > sent.id
+  )
+"""
+
+
+def _popular(users: int, answers: int, qids: int, rng: random.Random) -> list:
+    enviados = []
+    mid = 0
+    for u in range(users):
+        uid = f"u{u}"
+        respostas, sent = [], []
+        for _ in range(answers):
+            q = str(rng.randrange(qids))
+            mid += 1
+            ts = db_turso._utc_now_iso()
+            respostas.append((uid, q, int(rng.random() < 0.6), "A", f"T{int(q) % 5}", f"S{int(q) % 23}", ts))
+            sent.append((uid, q, mid, "A", "B,A,D,C", ts))
+            enviados.append((uid, q, mid))
+        # a base está na versão 1: a tabela revisao (migração 5) ainda não existe
+        stmts = [s for s in db_turso._answer_statements(respostas) if "INTO revisao" not in s[0]]
+        db_turso._exec_many(stmts + db_turso._sent_statements(sent))
+    return enviados
+
+
+def _medir(fn, reps: int) -> list:
+    lat = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t0)
+    return lat
+
+
+def _plano(sql: str, params: tuple) -> str:
+    rows = db_turso._fetchall("EXPLAIN QUERY PLAN " + sql, params)
+    return "; ".join(str(r[3]) for r in rows)
+
+
+def _rodada(nome: str, enviados: list, reps: int, rng: random.Random):
+    uid, q, mid = enviados[len(enviados) // 2]
+    fila = [str(rng.randrange(500)) for _ in range(20)]
+    meio = len(enviados) // 2
+    casos = [
+        (
+            "get_sent_correct",
+            lambda: db_turso.get_sent_correct(*rng.choice(enviados)),
+            "SELECT correta_exibida FROM sent WHERE user_id = ? AND qid = ? AND message_id = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (uid, q, mid),
+        ),
+        (
+            "get_last_perm",
+            lambda: db_turso.get_last_perm_for_user_question(*rng.choice(enviados)[:2]),
+            "SELECT perm FROM sent WHERE user_id = ? AND qid = ? ORDER BY id DESC LIMIT 1",
+            (uid, q),
+        ),
+        (
+            "get_last_perms (20)",
+            lambda: db_turso.get_last_perms_for_user_questions(rng.choice(enviados)[0], fila),
+            "SELECT qid, perm FROM (SELECT qid, perm, ROW_NUMBER() OVER (PARTITION BY qid ORDER BY id DESC) AS rn "
+            "FROM sent WHERE user_id = ? AND qid IN (?, ?)) WHERE rn = 1",
+            (uid, fila[0], fila[1]),
+        ),
+        (
+            "poda de sent (2000)",
+            lambda: db_turso._fetchone(PODA, (meio, meio + 2000)),
+            PODA,
+            (meio, meio + 2000),
+        ),
+    ]
+    print(f"== {nome} (schema_version {db_turso.schema_version()})")
+    for rotulo, fn, sql, params in casos:
+        lat = _medir(fn, reps if "poda" not in rotulo else max(1, reps // 20))
+        print(f"  {rotulo:<22} p50={percentil(lat, 0.50) * 1e6:9.1f}µs  p99={percentil(lat, 0.99) * 1e6:9.1f}µs")
+        print(f"  {'':<22} plano: {_plano(sql, params)}")
+
+    t0 = time.perf_counter()
+    db_turso.backfill_aggregates()
+    print(f"  {'backfill_aggregates':<22} {(time.perf_counter() - t0) * 1000:9.1f}ms")
+    for sql in (
+        "SELECT user_id, qid, MAX(acertou) FROM respostas WHERE qid <> '' GROUP BY user_id, qid",
+        "SELECT user_id, tema, subtema, SUM(acertou), COUNT(*) FROM respostas GROUP BY user_id, tema, subtema",
+    ):
+        print(f"  {'':<22} plano: {_plano(sql, ())}")
+    tamanho = sum(
+        os.path.getsize(p) for p in (db_turso.DB_PATH, db_turso.DB_PATH + "-wal") if os.path.exists(p)
+    )
+    print(f"  arquivo: {tamanho / 1e6:.1f} MB")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--answers", type=int, default=200, help="respostas (e envios) por usuário")
+    ap.add_argument("--qids", type=int, default=500)
+    ap.add_argument("--reps", type=int, default=2000)
+    args = ap.parse_args()
+
+    rng = random.Random(7)
+    db_turso.migrar(ate=1)
+    enviados = _popular(args.users, args.answers, args.qids, rng)
+    print(f"{args.users} usuários x {args.answers} respostas/envios ({len(enviados)} linhas em cada tabela)")
+
+    _rodada("antes", enviados, args.reps, rng)
+    t0 = time.perf_counter()
+    aplicadas = db_turso.migrar()
+    print(f"migrações {aplicadas} em {time.perf_counter() - t0:.1f}s")
+    _rodada("depois", enviados, args.reps, rng)
+    db_turso.close()
+
+
+if __name__ == "__main__":
+    main()
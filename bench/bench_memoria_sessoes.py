@@ -0,0 +1,76 @@
+"""
+Benchmark: memória de N sessões de quiz simultâneas.
+
+  - antes:  cada sessão guardava cópias das linhas da planilha (to_dict("records"))
+  - agora:  cada sessão guarda só a lista de qids (strings compartilhadas com o banco)
+
+Uso:
+    python banco.py build
+    python bench/bench_memoria_sessoes.py --sessions 10000 --per-session 20
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sqlite3
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import banco  # noqa: E402
+
+
+def _linhas_cruas() -> list[dict]:
+    # como o pandas entregava: um dict por linha, com todas as colunas
+    conn = sqlite3.connect(banco.ARTEFATO_PATH)
+    try:
+        return [json.loads(d) for (d,) in conn.execute("SELECT dados FROM questoes")]
+    finally:
+        conn.close()
+
+
+def _medir(construir) -> int:
+    gc.collect()
+    tracemalloc.start()
+    antes = tracemalloc.take_snapshot()
+    sessoes = construir()
+    depois = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(st.size_diff for st in depois.compare_to(antes, "filename"))
+    del sessoes
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=10000)
+    ap.add_argument("--per-session", type=int, default=20)
+    args = ap.parse_args()
+
+    b = banco.carregar()
+    qids = list(b.questions_by_id)
+    linhas = _linhas_cruas()
+    rnd = random.Random(1)
+
+    def antigo():
+        return [
+            {"perguntas": [dict(linha) for linha in rnd.sample(linhas, args.per_session)], "index": 0}
+            for _ in range(args.sessions)
+        ]
+
+    def novo():
+        return [{"qids": rnd.sample(qids, args.per_session), "index": 0} for _ in range(args.sessions)]
+
+    for nome, fn in (("linhas copiadas", antigo), ("só qids", novo)):
+        total = _medir(fn)
+        por_sessao = total / args.sessions
+        print(
+            f"{nome:>15}: {total / 1024 / 1024:.1f}MB para {args.sessions} sessões "
+            f"({por_sessao:.0f} B/sessão, {por_sessao / args.per_session:.1f} B/questão na fila)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark: montagem da mensagem de questão em enviar_proxima.
+
+  - direto: _apply_perm + f-string + teclado novo a cada envio (como era antes)
+  - cache:  quiz._renderizar_questao, primeiro com o cache frio e depois quente
+
+Uso:
+    STORAGE_BACKEND=memory python bench/bench_render.py --envios 200000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+import quiz  # noqa: E402
+
+
+def _direto(q, perm: str):
+    exibidas, correta_exibida = quiz._apply_perm(q, perm.split(","), q.correta)
+    texto = (
+        f"📘 *Tema:* {q.tema}\n"
+        f"📂 *Subtema:* {q.subtema}\n\n"
+        f"*{q.pergunta}*\n\n"
+        f"A) {exibidas.get('A', '')}\n"
+        f"B) {exibidas.get('B', '')}\n"
+        f"C) {exibidas.get('C', '')}\n"
+        f"D) {exibidas.get('D', '')}"
+    )
+    teclado = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(letra, callback_data=f"RESP|{q.qid}|{letra}") for letra in quiz.LETRAS]]
+    )
+    return texto, teclado, correta_exibida
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--envios", type=int, default=200000)
+    args = ap.parse_args()
+
+    b = quiz.banco_atual()
+    questoes = list(b.questions_by_id.values())
+    perms = [",".join(p) for p in quiz._PERMS]
+    rnd = random.Random(7)
+    envios = [(rnd.choice(questoes), rnd.choice(perms)) for _ in range(args.envios)]
+
+    casos = [
+        ("direto", _direto),
+        ("cache frio", lambda q, p: quiz._renderizar_questao(q, p, b.versao)),
+        ("cache quente", lambda q, p: quiz._renderizar_questao(q, p, b.versao)),
+    ]
+    print(f"{len(questoes)} questões x {len(perms)} perms, {args.envios} envios sorteados")
+    for nome, fn in casos:
+        t0 = time.perf_counter()
+        for q, perm in envios:
+            fn(q, perm)
+        dt = time.perf_counter() - t0
+        print(f"{nome:>12}: {dt / args.envios * 1e6:.2f}µs/envio")
+    print(f"cache: {len(quiz._RENDER)} mensagens (RENDER_CACHE_MAX={quiz.RENDER_CACHE_MAX})")
+
+
+if __name__ == "__main__":
+    main()
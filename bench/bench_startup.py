@@ -0,0 +1,57 @@
+"""
+Benchmark: carga do banco de questões pelo artefato compilado x pela planilha.
+
+Cada caminho roda num processo novo (import + carga), medindo tempo total e
+RSS máximo. Uso:
+    python banco.py build
+    python bench/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+_FILHO = r"""
+import json, resource, sys, time
+t0 = time.perf_counter()
+import banco
+b = banco.carregar()
+dt = time.perf_counter() - t0
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"fonte": b.fonte, "s": dt, "rss_mb": rss_kb / 1024.0, "pandas": "pandas" in sys.modules}))
+"""
+
+
+def _rodar(env_extra: dict) -> dict:
+    env = dict(os.environ, **env_extra)
+    out = subprocess.run(
+        [sys.executable, "-c", _FILHO], cwd=RAIZ, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    caminhos = (
+        ("artefato", {}),
+        ("xlsx", {"BANCO_ARTEFATO": os.path.join(RAIZ, "nao-existe.banco.sqlite")}),
+    )
+    for nome, env in caminhos:
+        res = [_rodar(env) for _ in range(args.runs)]
+        fontes = {r["fonte"] for r in res}
+        print(
+            f"{nome:>9}: carga mediana={statistics.median(r['s'] for r in res) * 1000:.0f}ms "
+            f"rss={statistics.median(r['rss_mb'] for r in res):.1f}MB "
+            f"pandas_importado={res[0]['pandas']} fonte={','.join(sorted(fontes))}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: rajada de alunos respondendo a mesma questão ao mesmo tempo,
+com gravação direta (um commit por INSERT) x write-behind (group commit).
+
+Cada aluno faz record_sent_question + get_sent_correct + record_answer via db_async.
+Mede vazão e latência p50/p95/p99 por aluno (o que o handler sente).
+
+Uso:
+    TURSO_URL=file:/tmp/bench.db TURSO_AUTH_TOKEN=x \\
+        python bench/bench_write_behind.py --students 300 --latency-ms 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db_turso  # noqa: E402
+import db_async  # noqa: E402
+from _lento import SlowConn, percentil  # noqa: E402
+
+
+async def _aluno(i: int, rodada: int, qid: str, lat: list):
+    uid = f"aluno{i}"
+    mid = rodada * 100000 + i
+    t0 = time.perf_counter()
+    await db_async.record_sent_question(uid, qid, mid, "B", "C,A,D,B")
+    correta = await db_async.get_sent_correct(uid, qid, mid)
+    await db_async.record_answer(uid, qid, correta == "B" and i % 2 == 0, "B", "BENCH", "RAJADA")
+    lat.append(time.perf_counter() - t0)
+
+
+async def _rajada(n: int, rodada: int) -> tuple[float, list]:
+    lat = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_aluno(i, rodada, "42", lat) for i in range(n)))
+    await db_async.flush_writes()
+    return time.perf_counter() - t0, lat
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--students", type=int, default=300)
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="ida e volta simulada por comando")
+    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--interval-ms", type=float, default=50.0)
+    ap.add_argument("--pool", type=int, default=db_turso.DB_POOL_SIZE, help="conexões no pool")
+    args = ap.parse_args()
+
+    db_turso.init_db()
+    atraso = args.latency_ms / 1000.0
+    db_turso.configure_pool(
+        size=args.pool,
+        connect=(lambda: SlowConn(db_turso._connect(), atraso)) if atraso > 0 else None,
+    )
+
+    modos = (
+        ("direto", False),
+        ("write-behind", True),
+    )
+    for rodada, (nome, wb) in enumerate(modos, start=1):
+        db_turso.configure_write_behind(wb, args.batch, args.interval_ms / 1000.0)
+        dt, lat = asyncio.run(_rajada(args.students, rodada))
+        print(
+            f"{nome:>12}: {args.students} alunos em {dt:.2f}s -> {args.students / dt:.1f} respostas/s | "
+            f"p50={percentil(lat, 0.50) * 1000:.1f}ms p95={percentil(lat, 0.95) * 1000:.1f}ms "
+            f"p99={percentil(lat, 0.99) * 1000:.1f}ms"
+        )
+        if wb:
+            print(f"{'':>12}  lotes gravados: {db_turso.get_write_behind_stats()}")
+
+    db_async.shutdown()
+
+
+if __name__ == "__main__":
+    main()
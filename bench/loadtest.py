@@ -0,0 +1,363 @@
+"""
+Teste de carga ponta a ponta: a mesma Application de main.py (build_application)
+recebendo updates sintéticos de milhares de usuários.
+
+Cada usuário faz /start -> TEMA -> SUB -> (resposta -> NEXTQ) x N -> /progresso -> /score,
+sempre clicando nos botões que o bot realmente mandou. A camada HTTP do bot é
+trocada por um Telegram falso que só registra as chamadas (com latência
+simulada opcional), e o armazenamento é o backend em memória por padrão.
+
+Relata vazão e p50/p95/p99 por handler e por prefixo de callback, e as
+chamadas feitas à API do Telegram. Uso:
+    python bench/loadtest.py --users 2000 --concurrency 200 --questions 5
+    python bench/loadtest.py --storage sqlite --api-ms 30
+    python bench/loadtest.py --users 60 --telegram-limites [--sem-agendador]
+    python bench/loadtest.py --double-tap 0.2 --updates-concorrentes 1   # sequencial, p/ comparar
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _ambiente(args):
+    # antes de importar main/quiz/storage, que leem o ambiente no import
+    os.chdir(RAIZ)
+    os.environ["STORAGE_BACKEND"] = args.storage
+    if args.storage == "sqlite":
+        os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="chobot-carga-"), "carga.db"))
+    os.environ.setdefault("BOT_TOKEN", "123456:carga")
+    os.environ.setdefault("QUIZ_SEED", "1")
+    os.environ["SESSOES_PERSISTENTES"] = "1" if args.persistence else "0"
+    if args.signed:
+        os.environ["QUIZ_SIGNED_CALLBACKS"] = "1"
+    # o agendador de envios (envio.py) só entra quando o Telegram falso limita
+    os.environ["ENVIO_LIMITADOR"] = "1" if args.telegram_limites and not args.sem_agendador else "0"
+    if args.updates_concorrentes:
+        os.environ["UPDATES_CONCORRENTES"] = str(args.updates_concorrentes)
+
+
+# ==========================================================
+# Telegram falso (camada HTTP do bot)
+# ==========================================================
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+_BOT_USER = {"id": 123456, "is_bot": True, "first_name": "carga", "username": "carga_bot"}
+
+# limites que o Telegram falso aplica com --telegram-limites (janela de 1s)
+LIMITE_GLOBAL_POR_SEG = 30
+LIMITE_CHAT_POR_SEG = 4
+
+
+def _gera_mensagem(metodo: str) -> bool:
+    return metodo.startswith(("send", "editMessage")) or metodo == "deleteMessage"
+
+
+class FakeTelegram(BaseRequest):
+    """
+    Responde como a Bot API sem sair do processo. Guarda, por chat, a última
+    mensagem com teclado para o usuário simulado saber o que clicar.
+    """
+
+    def __init__(self, api_ms: float = 0.0, limites: bool = False):
+        self.api_ms = api_ms
+        self.limites = limites
+        self.recusas = Counter()  # método -> respostas 429
+        self._janela = deque()
+        self._janela_chat = defaultdict(deque)
+        self.calls = Counter()
+        self.tempo_api = defaultdict(list)
+        self.teclados = {}  # chat_id -> (message_id, [[callback_data, ...], ...])
+        self._mids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        t0 = time.perf_counter()
+        metodo = url.rsplit("/", 1)[-1]
+        params = request_data.json_parameters if request_data is not None else {}
+        if self.api_ms:
+            await asyncio.sleep(self.api_ms / 1000.0)
+        if self.limites and _gera_mensagem(metodo) and self._excedeu(params.get("chat_id")):
+            self.recusas[metodo] += 1
+            corpo = {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                     "parameters": {"retry_after": 1}}
+            return 429, json.dumps(corpo).encode()
+        resultado = self._responder(metodo, params)
+        self.calls[metodo] += 1
+        self.tempo_api[metodo].append(time.perf_counter() - t0)
+        return 200, json.dumps({"ok": True, "result": resultado}).encode()
+
+    def _excedeu(self, chat_id) -> bool:
+        agora = time.monotonic()
+        janelas = [(self._janela, LIMITE_GLOBAL_POR_SEG)]
+        if chat_id is not None:
+            janelas.append((self._janela_chat[chat_id], LIMITE_CHAT_POR_SEG))
+        for janela, limite in janelas:
+            while janela and janela[0] <= agora - 1.0:
+                janela.popleft()
+            if len(janela) >= limite:
+                return True
+        for janela, _ in janelas:
+            janela.append(agora)
+        return False
+
+    def _mensagem(self, params, message_id=None) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        mid = int(message_id or next(self._mids))
+        msg = {
+            "message_id": mid,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": _BOT_USER,
+            "text": params.get("text", ""),
+        }
+        markup = params.get("reply_markup")
+        if markup:
+            teclado = json.loads(markup).get("inline_keyboard", [])
+            self.teclados[chat_id] = (mid, [[b.get("callback_data") for b in linha] for linha in teclado])
+        return msg
+
+    def _responder(self, metodo: str, params: dict):
+        if metodo == "getMe":
+            return _BOT_USER
+        if metodo == "sendMessage":
+            return self._mensagem(params)
+        if metodo in ("editMessageText", "editMessageReplyMarkup"):
+            return self._mensagem(params, params.get("message_id"))
+        return True
+
+
+# ==========================================================
+# Usuários simulados
+# ==========================================================
+_UPDATE_IDS = itertools.count(1)
+
+
+def _usuario_json(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"aluno{uid}"}
+
+
+def _comando(bot, uid: int, texto: str) -> Update:
+    cmd = texto.split()[0]
+    return Update.de_json({
+        "update_id": next(_UPDATE_IDS),
+        "message": {
+            "message_id": next(_UPDATE_IDS),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": _usuario_json(uid),
+            "text": texto,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(cmd)}],
+        },
+    }, bot)
+
+
+def _clique(bot, uid: int, message_id: int, data: str) -> Update:
+    return Update.de_json({
+        "update_id": next(_UPDATE_IDS),
+        "callback_query": {
+            "id": str(next(_UPDATE_IDS)),
+            "from": _usuario_json(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": _BOT_USER,
+                "text": "",
+            },
+        },
+    }, bot)
+
+
+def _rotulo(update: Update) -> tuple[str, str]:
+    """
+    (handler, prefixo): "/start" etc. para comandos; "callback" e o prefixo do callback_data.
+    """
+    if update.callback_query is not None:
+        return "callback", update.callback_query.data.split("|", 1)[0]
+    return update.message.text.split()[0], update.message.text.split()[0]
+
+
+class Carga:
+    def __init__(self, app, fake: FakeTelegram, rng: random.Random, toque_duplo: float = 0.0):
+        self.app = app
+        self.fake = fake
+        self.rng = rng
+        self.toque_duplo = toque_duplo
+        self.duplos = 0
+        self.respostas = 0
+        self.por_handler = defaultdict(list)
+        self.por_prefixo = defaultdict(list)
+        self.updates = 0
+        self.travados = 0
+
+    async def _enviar(self, update: Update):
+        handler, prefixo = _rotulo(update)
+        t0 = time.perf_counter()
+        await self.app.update_processor.process_update(update, self.app.process_update(update))
+        dt = time.perf_counter() - t0
+        self.por_handler[handler].append(dt)
+        self.por_prefixo[prefixo].append(dt)
+        self.updates += 1
+
+    def _botao(self, uid: int, prefixo: str | None = None):
+        mid, linhas = self.fake.teclados.get(uid, (None, []))
+        botoes = [d for linha in linhas for d in linha if d and (prefixo is None or d.startswith(prefixo))]
+        if mid is None or not botoes:
+            return None, None
+        return mid, self.rng.choice(botoes)
+
+    async def _clicar(self, uid: int, prefixo: str) -> bool:
+        mid, data = self._botao(uid, prefixo)
+        if data is None:
+            self.travados += 1
+            return False
+        if data.startswith(("RESP|", "R|")):
+            self.respostas += 1
+        if data != "NEXTQ" and not data.startswith(("RESP|", "R|")) or self.rng.random() >= self.toque_duplo:
+            await self._enviar(_clique(self.app.bot, uid, mid, data))
+            return True
+        # toque duplo: o mesmo botão chega duas vezes, em paralelo
+        self.duplos += 1
+        await asyncio.gather(
+            self._enviar(_clique(self.app.bot, uid, mid, data)),
+            self._enviar(_clique(self.app.bot, uid, mid, data)),
+        )
+        return True
+
+    async def usuario(self, uid: int, perguntas: int):
+        bot = self.app.bot
+        await self._enviar(_comando(bot, uid, "/start"))
+        if await self._clicar(uid, "TEMA|") and await self._clicar(uid, "SUB|"):
+            resposta = "R|" if os.getenv("QUIZ_SIGNED_CALLBACKS") else "RESP|"
+            for i in range(perguntas):
+                if not await self._clicar(uid, resposta):
+                    break
+                if i < perguntas - 1 and not await self._clicar(uid, "NEXTQ"):
+                    break
+        await self._enviar(_comando(bot, uid, "/progresso"))
+        await self._enviar(_comando(bot, uid, "/score"))
+
+
+def _linha(nome: str, lat: list) -> str:
+    from _lento import percentil
+
+    return (
+        f"  {nome:<22} n={len(lat):>7}  p50={percentil(lat, 0.50) * 1000:8.2f}ms  "
+        f"p95={percentil(lat, 0.95) * 1000:8.2f}ms  p99={percentil(lat, 0.99) * 1000:8.2f}ms"
+    )
+
+
+async def _rodar(args):
+    import db_async
+    import main
+    from storage import get_storage
+
+    get_storage().init_db()
+    fake = FakeTelegram(args.api_ms, args.telegram_limites)
+    app = main.build_application(request=fake)
+
+    erros = []
+
+    async def _erro(update, context):
+        erros.append(repr(context.error))
+
+    app.add_error_handler(_erro)
+    await app.initialize()
+    await app.start()
+
+    carga = Carga(app, fake, random.Random(args.seed), args.double_tap)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def _um(uid):
+        async with sem:
+            await carga.usuario(uid, args.questions)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_um(100000 + i) for i in range(args.users)))
+    dt = time.perf_counter() - t0
+
+    # com toques duplos, cada resposta tem que ter sido gravada uma vez só
+    await db_async.flush_writes()
+    gravadas = sum(u["respondidas"] for u in await db_async.get_users_overall_scores())
+
+    await app.stop()
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+    print(
+        f"{args.users} usuários (concorrência {args.concurrency}, storage={args.storage}, "
+        f"api={args.api_ms:.0f}ms, processador={type(app.update_processor).__name__}"
+        f"[{app.update_processor.max_concurrent_updates}])"
+    )
+    print(f"{carga.updates} updates em {dt:.2f}s -> {carga.updates / dt:.0f} updates/s")
+    print("por handler:")
+    for nome in sorted(carga.por_handler):
+        print(_linha(nome, carga.por_handler[nome]))
+    print("por prefixo de callback / comando:")
+    for nome in sorted(carga.por_prefixo):
+        print(_linha(nome, carga.por_prefixo[nome]))
+    print("chamadas à API do Telegram:")
+    for metodo, n in fake.calls.most_common():
+        print(_linha(metodo, fake.tempo_api[metodo]))
+    if args.telegram_limites:
+        print(f"429 do Telegram falso: {sum(fake.recusas.values())} {dict(fake.recusas)}")
+    if carga.duplos:
+        print(f"toques duplos (RESP/NEXTQ): {carga.duplos}")
+    if gravadas != carga.respostas:
+        print(f"ERRO: {gravadas} respostas gravadas para {carga.respostas} respondidas")
+    if carga.travados:
+        print(f"usuários que ficaram sem botão para clicar: {carga.travados}")
+    if erros:
+        print(f"ERROS nos handlers: {len(erros)} (ex.: {Counter(erros).most_common(3)})")
+    return 1 if erros or gravadas != carga.respostas else 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=200, help="usuários ativos ao mesmo tempo")
+    ap.add_argument("--questions", type=int, default=5, help="questões respondidas por usuário")
+    ap.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    ap.add_argument("--api-ms", type=float, default=0.0, help="latência simulada de cada chamada ao Telegram")
+    ap.add_argument("--persistence", action="store_true", help="liga a persistência de sessões")
+    ap.add_argument("--signed", action="store_true", help="botões de resposta assinados (QUIZ_SIGNED_CALLBACKS)")
+    ap.add_argument("--updates-concorrentes", type=int, default=0,
+                    help="UPDATES_CONCORRENTES do processador (1 = sequencial)")
+    ap.add_argument("--double-tap", type=float, default=0.0,
+                    help="fração dos cliques em RESP/NEXTQ enviados duas vezes em paralelo")
+    ap.add_argument("--telegram-limites", action="store_true",
+                    help=f"Telegram falso responde 429 acima de {LIMITE_GLOBAL_POR_SEG}/s no total ou "
+                         f"{LIMITE_CHAT_POR_SEG}/s por chat; liga o agendador de envios")
+    ap.add_argument("--sem-agendador", action="store_true", help="com --telegram-limites, sem o agendador")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    _ambiente(args)
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(_rodar(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import get_storage
+
+# ==========================================================
+# Variante assíncrona da API de armazenamento (storage.py).
+# As chamadas ao libsql são bloqueantes (ida e volta na rede até o Turso),
+# então rodam num pool limitado de threads e os handlers só fazem `await`.
+# Backends sem E/S (memory) são chamados direto, sem passar pelo pool.
+# ==========================================================
+DB_WORKERS = max(1, int(os.getenv("DB_WORKERS", "8")))
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+async def _run(metodo: str, *args, **kwargs):
+    storage = get_storage()
+    fn = getattr(storage, metodo)
+    if not storage.bloqueante:
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    # leva o contexto (rastro do update, ver rastreio.py) para a thread do pool
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_EXECUTOR, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def shutdown(wait: bool = True):
+    _EXECUTOR.shutdown(wait=wait)
+    # drena a fila do write-behind (se ligado), para o sync da réplica e fecha o pool
+    get_storage().close()
+
+
+async def flush_writes():
+    return await _run("flush_writes")
+
+
+async def sync_now():
+    return await _run("sync_now")
+
+
+async def compactar_respostas(lote: int):
+    return await _run("compactar_respostas", lote)
+
+
+async def podar_sent(lote: int):
+    return await _run("podar_sent", lote)
+
+
+async def podar_sessoes(lote: int):
+    return await _run("podar_sessoes", lote)
+
+
+async def init_db():
+    return await _run("init_db")
+
+
+async def record_answer(user_id: str, qid: str, acertou: bool, marcada: str, tema: str, subtema: str):
+    return await _run("record_answer", user_id, qid, acertou, marcada, tema, subtema)
+
+
+async def get_overall_progress(user_id: str):
+    return await _run("get_overall_progress", user_id)
+
+
+async def get_topic_breakdown(user_id: str, limit: int = 20):
+    return await _run("get_topic_breakdown", user_id, limit)
+
+
+async def get_question_status_map(user_id: str):
+    return await _run("get_question_status_map", user_id)
+
+
+async def get_review_queue(user_id: str, limit: int = 20) -> list[tuple[str, int]]:
+    return await _run("get_review_queue", user_id, limit)
+
+
+async def reset_user_stats(user_id: str):
+    return await _run("reset_user_stats", user_id)
+
+
+async def record_sent_question(user_id: str, qid: str, message_id: int, correta_exibida: str, perm: str):
+    return await _run("record_sent_question", user_id, qid, message_id, correta_exibida, perm)
+
+
+async def get_sent_correct(user_id: str, qid: str, message_id: int) -> str:
+    return await _run("get_sent_correct", user_id, qid, message_id)
+
+
+async def get_last_perm_for_user_question(user_id: str, qid: str) -> str:
+    return await _run("get_last_perm_for_user_question", user_id, qid)
+
+
+async def get_last_perms_for_user_questions(user_id: str, qids: list[str]) -> dict:
+    return await _run("get_last_perms_for_user_questions", user_id, qids)
+
+
+async def get_users_overall_scores(limit: int | None = None, offset: int = 0):
+    return await _run("get_users_overall_scores", limit, offset)
+
+
+async def get_user_rank(user_id: str) -> int | None:
+    return await _run("get_user_rank", user_id)
+
+
+async def count_ranked_users() -> int:
+    return await _run("count_ranked_users")
+
+
+async def get_user_topic_breakdown_full(user_id: str):
+    return await _run("get_user_topic_breakdown_full", user_id)
+
+
+async def load_sessions() -> dict[int, str]:
+    return await _run("load_sessions")
+
+
+async def get_session(chat_id: int) -> str | None:
+    return await _run("get_session", chat_id)
+
+
+async def save_sessions(rows: list[tuple[int, str | None]]):
+    return await _run("save_sessions", rows)
@@ -1,43 +1,920 @@
+import logging
 import os
-from datetime import datetime, timezone
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone
 
 import libsql
 
+import rastreio
+import revisao
+from metricas import DB_ERROS, DB_SEGUNDOS, rotulo_sql
+
 # ==========================================================
 # Config
 # ==========================================================
+# DB_MODE:
+#   remote  -> toda leitura/escrita vai ao Turso (TURSO_URL)
+#   replica -> réplica embarcada num arquivo local (DB_REPLICA_PATH): leituras locais,
+#              escritas repassadas ao primário, sync em segundo plano a cada DB_SYNC_INTERVAL
+#   local   -> SQLite local puro (DB_PATH), para desenvolvimento offline e testes
+DB_MODE = os.getenv("DB_MODE", "remote").strip().lower()
+DB_PATH = os.getenv("DB_PATH", "chobot.db")
+DB_REPLICA_PATH = os.getenv("DB_REPLICA_PATH", "turso-replica.db")
+DB_SYNC_INTERVAL = float(os.getenv("DB_SYNC_INTERVAL", "30"))
+
 TURSO_URL = os.getenv("TURSO_URL")
 TURSO_AUTH_TOKEN = os.getenv("TURSO_AUTH_TOKEN")
 
-if not TURSO_URL:
-    raise RuntimeError("TURSO_URL não definido nas variáveis de ambiente.")
-if not TURSO_AUTH_TOKEN:
-    raise RuntimeError("TURSO_AUTH_TOKEN não definido nas variáveis de ambiente.")
 
-# Uma conexão global (simples e rápida). Para carga alta, dá pra evoluir.
-_CONN = libsql.connect(database=TURSO_URL, auth_token=TURSO_AUTH_TOKEN)
+def _check_config():
+    # feito na primeira conexão, e não no import: quem usa outro backend
+    # (storage.py) ou só as funções puras não precisa das credenciais
+    if DB_MODE not in ("remote", "replica", "local"):
+        raise RuntimeError(f"DB_MODE inválido: {DB_MODE!r} (use remote, replica ou local).")
+    if DB_MODE != "local":
+        if not TURSO_URL:
+            raise RuntimeError("TURSO_URL não definido nas variáveis de ambiente.")
+        if not TURSO_AUTH_TOKEN:
+            raise RuntimeError("TURSO_AUTH_TOKEN não definido nas variáveis de ambiente.")
+
+
+# a réplica embarcada é um arquivo só, sincronizado por uma conexão
+DB_POOL_SIZE = 1 if DB_MODE == "replica" else max(1, int(os.getenv("DB_POOL_SIZE", "4")))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
+DB_RECONNECT_RETRIES = max(1, int(os.getenv("DB_RECONNECT_RETRIES", "5")))
+DB_RECONNECT_BACKOFF = float(os.getenv("DB_RECONNECT_BACKOFF", "0.2"))
+
+log = logging.getLogger(__name__)
+
+
+# ==========================================================
+# Pool de conexões
+# Uma conexão libsql não é segura para uso concorrente; db_async chama estas
+# funções a partir de várias threads, então cada uma pega emprestada uma conexão
+# exclusiva. Conexões ociosas há muito tempo passam por um SELECT 1 antes de
+# voltar ao uso e conexões quebradas são refeitas com backoff.
+# ==========================================================
+class PoolTimeout(RuntimeError):
+    pass
+
+
+# Mensagens do libsql (tudo vira ValueError) que indicam conexão perdida,
+# e não erro do SQL em si.
+_CONNECTION_ERROR_HINTS = (
+    "hrana",
+    "stream",
+    "connection",
+    "connect",
+    "timed out",
+    "timeout",
+    "broken pipe",
+    "reset by peer",
+    "http error",
+    "closed",
+)
+
+
+def _is_connection_error(exc: BaseException) -> bool:
+    msg = str(exc).lower()
+    return any(h in msg for h in _CONNECTION_ERROR_HINTS)
+
+
+# Arquivo local (dev/bench): o libsql segura o GIL enquanto espera um lock do
+# SQLite, então escritores concorrentes no mesmo arquivo travariam o processo.
+# Nesse caso usamos WAL (leitura não bloqueia escrita) e serializamos as
+# escritas aqui. No Turso remoto quem ordena as escritas é o servidor.
+# (TURSO_URL sem esquema, ex. "file:/tmp/x.db", também é tratado como arquivo local.)
+_LOCAL_DB = DB_MODE == "local" or (DB_MODE == "remote" and "://" not in (TURSO_URL or "://"))
+_WRITE_LOCK = threading.Lock() if _LOCAL_DB else nullcontext()
+
+
+def _connect():
+    _check_config()
+    if DB_MODE == "replica":
+        return libsql.connect(DB_REPLICA_PATH, sync_url=TURSO_URL, auth_token=TURSO_AUTH_TOKEN)
+    if DB_MODE == "local":
+        conn = libsql.connect(DB_PATH)
+    else:
+        conn = libsql.connect(database=TURSO_URL, auth_token=TURSO_AUTH_TOKEN)
+    if _LOCAL_DB:
+        conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+class _Pool:
+    def __init__(self, connect, size: int, timeout: float, healthcheck_idle: float):
+        self._connect_fn = connect
+        self.size = max(1, int(size))
+        self.timeout = float(timeout)
+        self.healthcheck_idle = float(healthcheck_idle)
+        self._idle = []  # [(conn, usada_em)] — LIFO, a mais quente sai primeiro
+        self._created = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        # métricas
+        self.acquires = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.busy_total = 0.0
+        self.reconnects = 0
+        self.health_failures = 0
+        self._since = time.monotonic()
+
+    def _open(self):
+        espera = DB_RECONNECT_BACKOFF
+        for tentativa in range(1, DB_RECONNECT_RETRIES + 1):
+            try:
+                return self._connect_fn()
+            except RuntimeError:
+                # configuração faltando (_check_config): tentar de novo não resolve
+                raise
+            except Exception as e:
+                if tentativa == DB_RECONNECT_RETRIES:
+                    raise
+                log.warning("db: falha ao conectar (%s); nova tentativa em %.2fs", e, espera)
+                time.sleep(espera)
+                espera *= 2
+
+    def _healthy(self, conn) -> bool:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        t0 = time.monotonic()
+        limite = t0 + self.timeout
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                resta = limite - time.monotonic()
+                if resta <= 0 or self._closed:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"Nenhuma conexão livre em {self.timeout:.1f}s (pool={self.size}).")
+                self._cond.wait(resta)
+            if self._idle:
+                conn, usada_em = self._idle.pop()
+            else:
+                conn, usada_em = None, None
+                self._created += 1
+            self._in_use += 1
+            espera = time.monotonic() - t0
+            self.acquires += 1
+            self.wait_total += espera
+            self.wait_max = max(self.wait_max, espera)
+
+        try:
+            if conn is not None and time.monotonic() - usada_em > self.healthcheck_idle and not self._healthy(conn):
+                self.health_failures += 1
+                self._discard(conn)
+                conn = None
+                self.reconnects += 1
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn, time.monotonic()
+
+    def release(self, conn, emprestada_em: float, broken: bool = False):
+        if broken:
+            self._discard(conn)
+        with self._cond:
+            self._in_use -= 1
+            self.busy_total += time.monotonic() - emprestada_em
+            if broken:
+                self._created -= 1
+                self.reconnects += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Empresta uma conexão; se a operação falhar por conexão perdida,
+        ela é descartada (a próxima aquisição abre outra).
+        """
+        conn, desde = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            self.release(conn, desde, broken=broken)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            decorrido = max(1e-9, time.monotonic() - self._since)
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "acquires": self.acquires,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": (self.wait_total / self.acquires * 1000.0) if self.acquires else 0.0,
+                "wait_max_ms": self.wait_max * 1000.0,
+                "utilization": self.busy_total / (decorrido * self.size),
+                "reconnects": self.reconnects,
+                "health_failures": self.health_failures,
+            }
+
+
+_POOL = _Pool(_connect, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_HEALTHCHECK_IDLE)
+
+
+def configure_pool(size: int | None = None, timeout: float | None = None, connect=None):
+    """
+    Recria o pool (ex.: outro tamanho, ou outra fábrica de conexões em benchmarks).
+    """
+    global _POOL
+    old = _POOL
+    _POOL = _Pool(
+        connect or old._connect_fn,
+        size if size is not None else old.size,
+        timeout if timeout is not None else old.timeout,
+        old.healthcheck_idle,
+    )
+    old.close()
+
+
+def get_pool_stats() -> dict:
+    return _POOL.stats()
+
+
+# ==========================================================
+# Sync da réplica embarcada (DB_MODE=replica)
+# ==========================================================
+class _Syncer:
+    def __init__(self, interval: float):
+        self.interval = max(1.0, float(interval))
+        self._stop = threading.Event()
+        self.syncs = 0
+        self.failures = 0
+        self.last_ok = None
+        self._thread = threading.Thread(target=self._loop, name="db-replica-sync", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                sync_now()
+            except Exception:
+                self.failures += 1
+                log.exception("replica: falha no sync; nova tentativa em %.0fs", self.interval)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+_SYNCER = None
+
+
+def sync_now():
+    """
+    Puxa do primário as mudanças para a réplica local (no-op fora do modo replica).
+    """
+    if DB_MODE != "replica":
+        return
+    with _POOL.connection() as conn:
+        conn.sync()
+    if _SYNCER is not None:
+        _SYNCER.syncs += 1
+        _SYNCER.last_ok = time.time()
+
+
+def start_sync():
+    global _SYNCER
+    if DB_MODE == "replica" and _SYNCER is None:
+        _SYNCER = _Syncer(DB_SYNC_INTERVAL)
+
+
+def close():
+    """
+    Encerramento: drena o write-behind, para o sync e fecha as conexões.
+    """
+    global _SYNCER
+    close_write_behind()
+    if _SYNCER is not None:
+        _SYNCER.close()
+        _SYNCER = None
+    _POOL.close()
+
+
+# ==========================================================
+# Cache em processo do status por questão ({qid: bool}) de cada usuário
+# ==========================================================
+STATUS_CACHE_MAX_USERS = max(0, int(os.getenv("STATUS_CACHE_MAX_USERS", "5000")))
+STATUS_CACHE_MAX_ENTRIES = max(0, int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "2000000")))
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "900"))
+
+
+class _StatusCache:
+    """
+    LRU com TTL e teto de memória (soma de qids guardados).
+    record_answer atualiza o mapa em cache (write-through) e reset_user_stats invalida.
+    Uma carga que correu em paralelo com uma escrita do mesmo usuário é descartada,
+    para não guardar um mapa anterior à escrita.
+    """
+
+    def __init__(self, max_users: int, max_entries: int, ttl: float):
+        self.max_users = max_users
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # uid -> (expira_em, {qid: bool})
+        self._entries = 0
+        self._carregando = {}  # uid -> True enquanto nenhuma escrita concorrente aconteceu
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, uid: str):
+        with self._lock:
+            item = self._data.get(uid)
+            if item is not None:
+                expira_em, status = item
+                if expira_em > time.monotonic():
+                    self._data.move_to_end(uid)
+                    self.hits += 1
+                    return dict(status)
+                self._remove(uid)
+            self.misses += 1
+            self._carregando[uid] = True
+            return None
+
+    def put(self, uid: str, status: dict):
+        with self._lock:
+            if not self._carregando.pop(uid, False):
+                return
+            if self.max_users <= 0 or len(status) > self.max_entries:
+                return
+            self._remove(uid)
+            self._data[uid] = (time.monotonic() + self.ttl, dict(status))
+            self._entries += len(status)
+            while self._data and (len(self._data) > self.max_users or self._entries > self.max_entries):
+                old_uid = next(iter(self._data))
+                self._remove(old_uid)
+                self.evictions += 1
+
+    def record(self, uid: str, qid: str, acertou: bool):
+        with self._lock:
+            if uid in self._carregando:
+                self._carregando[uid] = False
+            item = self._data.get(uid)
+            if item is None:
+                return
+            status = item[1]
+            if qid not in status:
+                self._entries += 1
+            status[qid] = bool(status.get(qid)) or bool(acertou)
+
+    def invalidate(self, uid: str):
+        with self._lock:
+            if uid in self._carregando:
+                self._carregando[uid] = False
+            self._remove(uid)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._entries = 0
+            self._carregando.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "users": len(self._data),
+                "entries": self._entries,
+            }
+
+    def _remove(self, uid: str):
+        item = self._data.pop(uid, None)
+        if item is not None:
+            self._entries -= len(item[1])
+
+
+_STATUS_CACHE = _StatusCache(STATUS_CACHE_MAX_USERS, STATUS_CACHE_MAX_ENTRIES, STATUS_CACHE_TTL)
+
+
+def get_status_cache_stats() -> dict:
+    return _STATUS_CACHE.stats()
+
+
+# ==========================================================
+# Ranking (/score) em memória, ordenado por respondidas desc
+# ==========================================================
+LEADERBOARD_TTL = float(os.getenv("LEADERBOARD_TTL", "300"))
+LEADERBOARD_RODADAS = max(1, int(os.getenv("LEADERBOARD_RODADAS", "5")))
+
+
+def _totais_de(uids: list[str]) -> dict:
+    """
+    user_totais só destes usuários: {user_id: (respondidas, acertos)}.
+    """
+    out = {}
+    for chunk in _chunks(uids, 500):
+        rows = _fetchall(
+            f"SELECT user_id, total, acertos FROM user_totais WHERE user_id IN ({', '.join(['?'] * len(chunk))})",
+            tuple(chunk),
+        )
+        for uid, total, acertos in rows:
+            if int(total or 0) > 0:
+                out[str(uid)] = (int(total or 0), int(acertos or 0))
+    return out
+
+
+class _Leaderboard:
+    """
+    Índice ordenado de (-respondidas, user_id), semeado de user_totais e mantido
+    por record_answer / reset_user_stats. Top-K e posição de um usuário saem
+    por bisect, sem GROUP BY. Recarrega após LEADERBOARD_TTL para absorver
+    escritas de outros processos.
+
+    Recarga única (uma thread lê user_totais, as outras seguem no índice atual)
+    e sem perder respostas: o que chega durante a leitura continua indo para o
+    índice atual e os usuários tocados são anotados. A resposta pode ou não
+    ter entrado no SELECT, então os tocados são relidos (só eles) até uma
+    rodada sem ninguém novo: o commit vem antes do record, logo a releitura
+    já enxerga tudo o que foi anotado antes dela. Se ainda sobrar alguém
+    depois de LEADERBOARD_RODADAS, com índice completo fica o maior entre ele
+    e a leitura; na primeira carga (ou após invalidate) o índice atual só tem
+    o que chegou durante ela, então a próxima consulta recarrega.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._keys = []     # [(-respondidas, user_id)] ordenado
+        self._totais = {}   # user_id -> (respondidas, acertos)
+        self._carregado_em = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._tocados = None  # durante uma recarga: user_id -> zerado durante ela?
+        self._sujo = False    # invalidate durante a recarga: a leitura já nasce velha
+
+    def _ensure_loaded(self):
+        with self._lock:
+            while True:
+                if self._carregado_em is not None and time.monotonic() - self._carregado_em < self.ttl:
+                    return
+                if self._tocados is None:
+                    break
+                if self._carregado_em is not None:
+                    # outra thread já está recarregando: serve o índice atual
+                    return
+                self._cond.wait()
+            self._tocados = {}
+            self._sujo = False
+            completo = self._carregado_em is not None
+            if not completo:
+                # primeira carga (ou invalidate): o índice atual não vale mais nada
+                self._keys, self._totais = [], {}
+
+        try:
+            _flush_for(None)
+            rows = _fetchall("SELECT user_id, total, acertos FROM user_totais WHERE total > 0")
+            totais = {str(uid): (int(total or 0), int(acertos or 0)) for uid, total, acertos in rows}
+            for _ in range(LEADERBOARD_RODADAS):
+                with self._lock:
+                    if not self._tocados:
+                        break
+                    relidos, self._tocados = list(self._tocados), {}
+                _flush_for(None)
+                lidos = _totais_de(relidos)
+                for uid in relidos:
+                    if uid in lidos:
+                        totais[uid] = lidos[uid]
+                    else:
+                        totais.pop(uid, None)
+        except BaseException:
+            with self._lock:
+                self._tocados = None
+                self._cond.notify_all()
+            raise
+
+        with self._lock:
+            sobra = self._tocados
+            if sobra and not completo:
+                self._sujo = True
+            for uid, zerado in sobra.items():
+                atual = self._totais.get(uid)
+                lido = totais.get(uid)
+                if not zerado and lido is not None and (atual is None or lido[0] > atual[0]):
+                    continue
+                if atual is None:
+                    totais.pop(uid, None)
+                else:
+                    totais[uid] = atual
+            self._totais = totais
+            self._keys = sorted((-t, uid) for uid, (t, _a) in totais.items())
+            self._carregado_em = None if self._sujo else time.monotonic()
+            self._tocados = None
+            self._cond.notify_all()
+
+    def record(self, uid: str, acertou: bool):
+        with self._lock:
+            if self._tocados is not None:
+                self._tocados.setdefault(uid, False)
+            elif self._carregado_em is None:
+                return
+            respondidas, acertos = self._totais.get(uid, (0, 0))
+            if respondidas:
+                del self._keys[bisect_left(self._keys, (-respondidas, uid))]
+            respondidas += 1
+            acertos += 1 if acertou else 0
+            self._totais[uid] = (respondidas, acertos)
+            insort(self._keys, (-respondidas, uid))
+
+    def invalidate(self):
+        with self._lock:
+            self._carregado_em = None
+            self._sujo = self._tocados is not None
+
+    def remove(self, uid: str):
+        with self._lock:
+            if self._tocados is not None:
+                self._tocados[uid] = True
+            item = self._totais.pop(uid, None)
+            if item is not None:
+                del self._keys[bisect_left(self._keys, (-item[0], uid))]
+
+    def page(self, offset: int, limit: int | None) -> list[tuple[str, int, int]]:
+        self._ensure_loaded()
+        with self._lock:
+            fim = None if limit is None else offset + limit
+            return [(uid, -neg, self._totais[uid][1]) for neg, uid in self._keys[offset:fim]]
+
+    def rank(self, uid: str) -> int | None:
+        self._ensure_loaded()
+        with self._lock:
+            item = self._totais.get(uid)
+            if item is None:
+                return None
+            return bisect_left(self._keys, (-item[0], uid)) + 1
+
+    def size(self) -> int:
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._keys)
+
+
+_LEADERBOARD = _Leaderboard(LEADERBOARD_TTL)
 
 
 def _utc_now_iso():
     return datetime.now(timezone.utc).isoformat()
 
 
+_PLANOS = {}  # sql -> saída do EXPLAIN QUERY PLAN (o plano de um comando quase nunca muda)
+
+
+def _plano(conn, sql: str, params: tuple) -> str:
+    plano = _PLANOS.get(sql)
+    if plano is None:
+        # cursor próprio, fechado em seguida: no cursor da transação o EXPLAIN
+        # ficaria aberto e travaria o commit (e DROP INDEX numa migração)
+        cur = conn.cursor()
+        try:
+            cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+            plano = "\n".join(f"    {row[-1]}" for row in cur.fetchall()) or "    (vazio)"
+        except Exception as e:
+            plano = f"    (sem plano: {e})"
+        finally:
+            cur.close()
+        if len(_PLANOS) < 1000:
+            _PLANOS[sql] = plano
+    return plano
+
+
+def _medir(conn, sql: str, params: tuple, rotulo: str, op: str, dt: float, linhas: int = 0):
+    DB_SEGUNDOS.observe(dt, op, rotulo)
+    rastreio.registrar(rotulo, dt, linhas)
+    if rastreio.lenta(dt):
+        rastreio.logar_lenta(rotulo, sql, params, dt, _plano(conn, sql, params))
+
+
+def _query(sql: str, params: tuple, op: str, fetch):
+    # leitura: se a conexão caiu, tenta de novo numa conexão nova
+    rotulo = rotulo_sql(sql)
+    for tentativa in (1, 2):
+        try:
+            with _POOL.connection() as conn:
+                t0 = time.perf_counter()
+                cur = conn.cursor()
+                try:
+                    cur.execute(sql, params)
+                    resultado = fetch(cur)
+                    linhas = len(resultado) if isinstance(resultado, list) else int(resultado is not None)
+                    _medir(conn, sql, params, rotulo, op, time.perf_counter() - t0, linhas)
+                    return resultado
+                finally:
+                    # fetchone deixa o comando aberto na conexão (segura o snapshot
+                    # de leitura e impede DROP INDEX/TABLE nela): fecha sempre
+                    cur.close()
+        except Exception as e:
+            DB_ERROS.inc(op, rotulo)
+            if tentativa == 2 or not _is_connection_error(e):
+                raise
+
+
 def _fetchall(sql: str, params: tuple = ()):
-    cur = _CONN.cursor()
-    cur.execute(sql, params)
-    return cur.fetchall()
+    return _query(sql, params, "fetchall", lambda cur: cur.fetchall())
 
 
 def _fetchone(sql: str, params: tuple = ()):
-    cur = _CONN.cursor()
-    cur.execute(sql, params)
-    return cur.fetchone()
+    return _query(sql, params, "fetchone", lambda cur: cur.fetchone())
+
+
+def _executar(conn, cur, sql: str, params: tuple):
+    rotulo = rotulo_sql(sql)
+    t0 = time.perf_counter()
+    try:
+        cur.execute(sql, params)
+    except Exception:
+        DB_ERROS.inc("exec", rotulo)
+        raise
+    _medir(conn, sql, params, rotulo, "exec", time.perf_counter() - t0)
 
 
 def _exec(sql: str, params: tuple = ()):
-    cur = _CONN.cursor()
-    cur.execute(sql, params)
-    _CONN.commit()
+    _exec_many([(sql, params)])
+
+
+def _exec_many(statements: list[tuple[str, tuple]]):
+    """
+    Executa vários comandos numa única transação (um commit só).
+    Se a conexão cair antes do commit, nada foi gravado e a transação é
+    refeita numa conexão nova; falha no próprio commit é repassada.
+    """
+    for tentativa in (1, 2):
+        no_commit = False
+        try:
+            with _WRITE_LOCK, _POOL.connection() as conn:
+                cur = conn.cursor()
+                try:
+                    for sql, params in statements:
+                        _executar(conn, cur, sql, params)
+                    no_commit = True
+                    t0 = time.perf_counter()
+                    conn.commit()
+                    dt = time.perf_counter() - t0
+                    DB_SEGUNDOS.observe(dt, "exec", "COMMIT")
+                    rastreio.registrar("COMMIT", dt)
+                except Exception as e:
+                    if not _is_connection_error(e):
+                        conn.rollback()
+                    raise
+                finally:
+                    cur.close()
+            return
+        except Exception as e:
+            if tentativa == 2 or no_commit or not _is_connection_error(e):
+                raise
+
+
+# ==========================================================
+# Migrações de esquema versionadas
+# Cada migração é (versão, descrição, comandos) e roda numa transação junto
+# com a linha que a registra em schema_version; init_db aplica, em ordem, as
+# que ainda não estão lá. A 1 é o esquema de antes do versionamento (tudo
+# IF NOT EXISTS, então bases antigas só ganham o registro). Nunca edite uma
+# migração já publicada: acrescente outra.
+# ==========================================================
+_MIGRACOES = [
+    (1, "esquema base", [
+        """
+        CREATE TABLE IF NOT EXISTS respostas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            qid TEXT NOT NULL,
+            acertou INTEGER NOT NULL,   -- 1 ou 0
+            marcada TEXT,
+            tema TEXT,
+            subtema TEXT,
+            timestamp TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_respostas_user ON respostas(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_respostas_user_qid ON respostas(user_id, qid)",
+        "CREATE INDEX IF NOT EXISTS idx_respostas_tema_sub ON respostas(tema, subtema)",
+        "CREATE INDEX IF NOT EXISTS idx_respostas_qid ON respostas(qid)",
+        """
+        CREATE TABLE IF NOT EXISTS sent (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            qid TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            correta_exibida TEXT,
+            perm TEXT,
+            timestamp TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sent_user_qid_mid ON sent(user_id, qid, message_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sent_user_qid ON sent(user_id, qid)",
+        # agregados mantidos por record_answer (leitura sem varrer respostas)
+        """
+        CREATE TABLE IF NOT EXISTS user_totais (
+            user_id TEXT PRIMARY KEY,
+            acertos INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_tema_sub (
+            user_id TEXT NOT NULL,
+            tema TEXT NOT NULL,
+            subtema TEXT NOT NULL,
+            acertos INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, tema, subtema)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_qid_status (
+            user_id TEXT NOT NULL,
+            qid TEXT NOT NULL,
+            ok INTEGER NOT NULL,        -- 1 se acertou ao menos uma vez
+            PRIMARY KEY (user_id, qid)
+        )
+        """,
+        # sessões de quiz em andamento (persistência do PTB, ver sessoes.py)
+        """
+        CREATE TABLE IF NOT EXISTS sessoes (
+            chat_id INTEGER PRIMARY KEY,
+            dados TEXT NOT NULL,        -- JSON compacto
+            atualizado_em TEXT
+        )
+        """,
+        # retenção (ver compactar_respostas / podar_sent): respostas antigas
+        # somadas por usuário/questão/tema/subtema
+        """
+        CREATE TABLE IF NOT EXISTS respostas_resumo (
+            user_id TEXT NOT NULL,
+            qid TEXT NOT NULL,
+            tema TEXT NOT NULL,
+            subtema TEXT NOT NULL,
+            acertos INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            ok INTEGER NOT NULL DEFAULT 0,   -- 1 se acertou ao menos uma vez
+            ultimo TEXT,                     -- timestamp da resposta mais nova resumida
+            PRIMARY KEY (user_id, qid, tema, subtema)
+        )
+        """,
+        # onde cada tarefa de manutenção parou (retomada em lotes)
+        """
+        CREATE TABLE IF NOT EXISTS manutencao (
+            tarefa TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            atualizado_em TEXT
+        )
+        """,
+    ]),
+    # sent: cobertura para get_last_perm* (ORDER BY id DESC) e o EXISTS da
+    # poda. idx_sent_user_qid_mid é redefinido na mesma transação (nunca
+    # fica sem ele): no de cobertura message_id vem depois de id DESC e
+    # get_sent_correct percorreria todos os envios do usuário/qid. Com id
+    # DESC e correta_exibida no fim, a busca pelo message_id sai já na ordem
+    # do ORDER BY e sem ir à tabela (só com as três colunas o planejador,
+    # sem estatísticas, preferia o de cobertura)
+    (2, "sent: índice de cobertura (user_id, qid, id DESC)", [
+        """
+        CREATE INDEX IF NOT EXISTS idx_sent_cobertura
+        ON sent(user_id, qid, id DESC, message_id, correta_exibida, perm)
+        """,
+        "DROP INDEX IF EXISTS idx_sent_user_qid_mid",
+        """
+        CREATE INDEX idx_sent_user_qid_mid
+        ON sent(user_id, qid, message_id, id DESC, correta_exibida)
+        """,
+        "DROP INDEX IF EXISTS idx_sent_user_qid",
+    ]),
+    # o que já era gravado assim desde record_answer; linhas antigas (da
+    # planilha) podem ter espaços/NULL, o que obrigava TRIM/COALESCE nos GROUP BY
+    (3, "respostas: normaliza qid, tema e subtema", [
+        """
+        UPDATE respostas
+        SET qid = TRIM(qid), tema = COALESCE(tema, ''), subtema = COALESCE(subtema, '')
+        WHERE qid <> TRIM(qid) OR tema IS NULL OR subtema IS NULL
+        """,
+    ]),
+    # GROUP BY user_id, qid com MAX(acertou) e GROUP BY user_id, tema, subtema
+    # (backfill_aggregates) saem do índice, sem ordenar nem ler a tabela;
+    # os DELETE por user_id usam o prefixo
+    (4, "respostas: índices de cobertura por usuário", [
+        "CREATE INDEX IF NOT EXISTS idx_respostas_user_qid_ok ON respostas(user_id, qid, acertou)",
+        "CREATE INDEX IF NOT EXISTS idx_respostas_user_tema_sub ON respostas(user_id, tema, subtema, acertou)",
+        "DROP INDEX IF EXISTS idx_respostas_user",
+        "DROP INDEX IF EXISTS idx_respostas_user_qid",
+        "DROP INDEX IF EXISTS idx_respostas_tema_sub",
+        "DROP INDEX IF EXISTS idx_respostas_qid",
+    ]),
+    # repetição espaçada (ver revisao.py): estado SM-2 por usuário/questão,
+    # atualizado por record_answer; a fila de revisão sai de
+    # idx_revisao_vence em ordem de vencimento (LIMIT N, sem ordenar)
+    (5, "revisao: agenda SM-2 por usuário/questão", [
+        """
+        CREATE TABLE IF NOT EXISTS revisao (
+            user_id TEXT NOT NULL,
+            qid TEXT NOT NULL,
+            ease REAL NOT NULL,
+            intervalo REAL NOT NULL,         -- dias
+            repeticoes INTEGER NOT NULL,     -- acertos seguidos
+            vence_em INTEGER NOT NULL,       -- epoch (s)
+            revisada_em INTEGER NOT NULL,    -- epoch (s) da última resposta
+            PRIMARY KEY (user_id, qid)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_revisao_vence ON revisao(user_id, vence_em, qid)",
+        # histórico anterior vira uma primeira revisão: vence 1 dia depois da
+        # última resposta (resumidas incluídas), com 1 repetição se já acertou
+        """
+        INSERT OR IGNORE INTO revisao (user_id, qid, ease, intervalo, repeticoes, vence_em, revisada_em)
+        SELECT user_id, qid, 2.5, 1.0, MAX(ok), COALESCE(MAX(ts), 0) + 86400, COALESCE(MAX(ts), 0)
+        FROM (
+            SELECT user_id, qid, acertou AS ok, CAST(strftime('%s', timestamp) AS INTEGER) AS ts
+            FROM respostas
+            UNION ALL
+            SELECT user_id, qid, ok, CAST(strftime('%s', ultimo) AS INTEGER)
+            FROM respostas_resumo
+        )
+        WHERE qid <> ''
+        GROUP BY user_id, qid
+        """,
+    ]),
+]
+
+
+def schema_version() -> int:
+    row = _fetchone("SELECT COALESCE(MAX(versao), 0) FROM schema_version")
+    return int(row[0] or 0)
+
+
+def migrar(ate: int | None = None) -> list[int]:
+    """
+    Aplica as migrações pendentes (até a versão `ate`, se dada). Retorna as aplicadas.
+    """
+    _exec("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        versao INTEGER PRIMARY KEY,
+        descricao TEXT,
+        aplicada_em TEXT
+    )
+    """)
+    atual = schema_version()
+    aplicadas = []
+    for versao, descricao, comandos in _MIGRACOES:
+        if versao <= atual or (ate is not None and versao > ate):
+            continue
+        stmts = [(sql, ()) for sql in comandos]
+        stmts.append((
+            "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+            (versao, descricao, _utc_now_iso()),
+        ))
+        try:
+            _exec_many(stmts)
+        except Exception:
+            # outro processo pode ter aplicado a mesma migração ao mesmo tempo
+            if schema_version() >= versao:
+                continue
+            raise
+        log.info("schema: migração %d aplicada (%s)", versao, descricao)
+        aplicadas.append(versao)
+    return aplicadas
 
 
 # ==========================================================
@@ -45,69 +922,415 @@ def _exec(sql: str, params: tuple = ()):
 # ==========================================================
 def init_db():
     """
-    Cria as tabelas e índices equivalentes ao uso atual:
+    Leva o esquema à versão mais recente (ver _MIGRACOES). Tabelas principais:
       - respostas  (equivale à sheet1 stats)
       - sent       (equivale à worksheet 'sent')
     """
-    _exec("""
-    CREATE TABLE IF NOT EXISTS respostas (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        qid TEXT NOT NULL,
-        acertou INTEGER NOT NULL,   -- 1 ou 0
-        marcada TEXT,
-        tema TEXT,
-        subtema TEXT,
-        timestamp TEXT
-    )
-    """)
+    migrar()
 
-    _exec("CREATE INDEX IF NOT EXISTS idx_respostas_user ON respostas(user_id)")
-    _exec("CREATE INDEX IF NOT EXISTS idx_respostas_user_qid ON respostas(user_id, qid)")
-    _exec("CREATE INDEX IF NOT EXISTS idx_respostas_tema_sub ON respostas(tema, subtema)")
-    _exec("CREATE INDEX IF NOT EXISTS idx_respostas_qid ON respostas(qid)")
+    # base antiga (só respostas): monta os agregados uma vez
+    vazio = _fetchone("SELECT 1 FROM user_totais LIMIT 1") is None
+    if vazio and _fetchone("SELECT 1 FROM respostas LIMIT 1") is not None:
+        backfill_aggregates()
 
-    _exec("""
-    CREATE TABLE IF NOT EXISTS sent (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        qid TEXT NOT NULL,
-        message_id INTEGER NOT NULL,
-        correta_exibida TEXT,
-        perm TEXT,
-        timestamp TEXT
-    )
-    """)
+    start_sync()
+
+
+_MULTIROW_CHUNK = 100
+
+
+def _chunks(rows: list, n: int = _MULTIROW_CHUNK):
+    for i in range(0, len(rows), n):
+        yield rows[i:i + n]
 
-    _exec("CREATE INDEX IF NOT EXISTS idx_sent_user_qid_mid ON sent(user_id, qid, message_id)")
-    _exec("CREATE INDEX IF NOT EXISTS idx_sent_user_qid ON sent(user_id, qid)")
+
+def _answer_statements(rows: list[tuple]) -> list[tuple[str, tuple]]:
+    """
+    rows: [(user_id, qid, acertou, marcada, tema, subtema, timestamp), ...]
+    Gera INSERTs multi-linha em respostas e os upserts já somados dos agregados,
+    para que um lote inteiro vire poucos comandos numa transação só.
+    """
+    stmts = []
+    for chunk in _chunks(rows):
+        stmts.append((
+            "INSERT INTO respostas (user_id, qid, acertou, marcada, tema, subtema, timestamp) VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk)),
+            tuple(v for r in chunk for v in r),
+        ))
+
+    totais = {}
+    tema_sub = {}
+    status = {}
+    for uid, q, ok, _marcada, tema, subtema, _ts in rows:
+        a, t = totais.get(uid, (0, 0))
+        totais[uid] = (a + ok, t + 1)
+        a, t = tema_sub.get((uid, tema, subtema), (0, 0))
+        tema_sub[(uid, tema, subtema)] = (a + ok, t + 1)
+        if q:
+            status[(uid, q)] = max(status.get((uid, q), 0), ok)
+
+    linhas = [(uid, a, t) for uid, (a, t) in totais.items()]
+    for chunk in _chunks(linhas):
+        stmts.append((
+            "INSERT INTO user_totais (user_id, acertos, total) VALUES "
+            + ", ".join(["(?, ?, ?)"] * len(chunk))
+            + """
+            ON CONFLICT(user_id) DO UPDATE SET
+                acertos = acertos + excluded.acertos,
+                total = total + excluded.total
+            """,
+            tuple(v for r in chunk for v in r),
+        ))
+
+    linhas = [(uid, tema, subtema, a, t) for (uid, tema, subtema), (a, t) in tema_sub.items()]
+    for chunk in _chunks(linhas):
+        stmts.append((
+            "INSERT INTO user_tema_sub (user_id, tema, subtema, acertos, total) VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?)"] * len(chunk))
+            + """
+            ON CONFLICT(user_id, tema, subtema) DO UPDATE SET
+                acertos = acertos + excluded.acertos,
+                total = total + excluded.total
+            """,
+            tuple(v for r in chunk for v in r),
+        ))
+
+    linhas = [(uid, q, ok) for (uid, q), ok in status.items()]
+    for chunk in _chunks(linhas):
+        stmts.append((
+            "INSERT INTO user_qid_status (user_id, qid, ok) VALUES "
+            + ", ".join(["(?, ?, ?)"] * len(chunk))
+            + """
+            ON CONFLICT(user_id, qid) DO UPDATE SET ok = MAX(ok, excluded.ok)
+            """,
+            tuple(v for r in chunk for v in r),
+        ))
+
+    # revisao: uma linha por resposta, na ordem; o upsert aplica as repetidas
+    # do mesmo (user_id, qid) uma após a outra, cada uma sobre a anterior
+    linhas = []
+    for uid, q, ok, _marcada, _tema, _subtema, ts in rows:
+        if q:
+            t = int(datetime.fromisoformat(ts).timestamp())
+            linhas.append((uid, q, *revisao.proximo(None, ok, t), t))
+    for chunk in _chunks(linhas):
+        stmts.append((
+            "INSERT INTO revisao (user_id, qid, ease, intervalo, repeticoes, vence_em, revisada_em) VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * len(chunk))
+            + _REVISAO_UPSERT,
+            tuple(v for r in chunk for v in r),
+        ))
+    return stmts
+
+
+# SM-2 de revisao.proximo em SQL. Numa linha nova, repeticoes = 1 se acertou e
+# 0 se errou, então excluded.repeticoes diz o resultado da resposta; os SET
+# enxergam os valores antigos (o intervalo usa a ease de antes, como proximo)
+_REVISAO_INTERVALO = f"""
+    CASE
+        WHEN excluded.repeticoes = 0 OR repeticoes = 0 THEN 1.0
+        WHEN repeticoes = 1 THEN 6.0
+        ELSE MIN({revisao.INTERVALO_MAX}, ROUND(intervalo * ease))
+    END
+"""
+_REVISAO_UPSERT = f"""
+    ON CONFLICT(user_id, qid) DO UPDATE SET
+        ease = MAX({revisao.EASE_MIN},
+                   ease + CASE WHEN excluded.repeticoes > 0 THEN {revisao.EASE_ACERTO} ELSE {revisao.EASE_ERRO} END),
+        intervalo = {_REVISAO_INTERVALO},
+        repeticoes = CASE WHEN excluded.repeticoes > 0 THEN repeticoes + 1 ELSE 0 END,
+        vence_em = excluded.revisada_em + CAST({_REVISAO_INTERVALO} * {revisao.DIA} AS INTEGER),
+        revisada_em = excluded.revisada_em
+"""
+
+
+def _sent_statements(rows: list[tuple]) -> list[tuple[str, tuple]]:
+    """
+    rows: [(user_id, qid, message_id, correta_exibida, perm, timestamp), ...]
+    """
+    return [
+        (
+            "INSERT INTO sent (user_id, qid, message_id, correta_exibida, perm, timestamp) VALUES "
+            + ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk)),
+            tuple(v for r in chunk for v in r),
+        )
+        for chunk in _chunks(rows)
+    ]
+
+
+# ==========================================================
+# Write-behind opcional (DB_WRITE_BEHIND=1): record_answer e
+# record_sent_question só enfileiram; uma thread grava em lote
+# (group commit) por tamanho ou intervalo. As leituras enxergam a fila.
+# ==========================================================
+class _WriteBehind:
+    def __init__(self, batch_size: int, interval: float):
+        self.batch_size = max(1, int(batch_size))
+        self.interval = max(0.001, float(interval))
+        self._answers = []   # [(seq, row)]
+        self._sent = []      # [(seq, row)]
+        self._seq = 0
+        self._pending_users = {}    # user_id -> último seq de resposta na fila
+        self._pending_correct = {}  # (user_id, qid, message_id) -> (seq, correta_exibida)
+        self._pending_perm = {}     # (user_id, qid) -> (seq, perm)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopped = False
+        self.batches = 0
+        self.rows = 0
+        self._thread = threading.Thread(target=self._loop, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def add_answer(self, row: tuple):
+        with self._cond:
+            self._seq += 1
+            self._answers.append((self._seq, row))
+            self._pending_users[row[0]] = self._seq
+            self._notify_if_full()
+
+    def add_sent(self, row: tuple):
+        uid, q, mid, correta, perm, _ts = row
+        with self._cond:
+            self._seq += 1
+            self._sent.append((self._seq, row))
+            self._pending_correct[(uid, q, mid)] = (self._seq, correta)
+            self._pending_perm[(uid, q)] = (self._seq, perm)
+            self._notify_if_full()
+
+    def _notify_if_full(self):
+        if len(self._answers) + len(self._sent) >= self.batch_size:
+            self._cond.notify()
+
+    def pending_correct(self, uid: str, qid: str, message_id: int):
+        with self._cond:
+            item = self._pending_correct.get((uid, qid, message_id))
+            return None if item is None else item[1]
+
+    def pending_perm(self, uid: str, qid: str):
+        with self._cond:
+            item = self._pending_perm.get((uid, qid))
+            return None if item is None else item[1]
+
+    def has_pending_answers(self, uid: str | None = None) -> bool:
+        with self._cond:
+            return bool(self._pending_users) if uid is None else uid in self._pending_users
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._answers) + len(self._sent)
+
+    def flush(self):
+        """
+        Grava tudo o que está na fila (bloqueia até terminar).
+        """
+        with self._flush_lock:
+            with self._cond:
+                answers, self._answers = self._answers, []
+                sent, self._sent = self._sent, []
+            if not answers and not sent:
+                return
+
+            try:
+                _exec_many(
+                    _sent_statements([r for _seq, r in sent]) + _answer_statements([r for _seq, r in answers])
+                )
+            except Exception:
+                with self._cond:
+                    self._answers[:0] = answers
+                    self._sent[:0] = sent
+                raise
+
+            top = max(seq for seq, _r in answers + sent)
+            with self._cond:
+                self._pending_users = {k: v for k, v in self._pending_users.items() if v > top}
+                self._pending_correct = {k: v for k, v in self._pending_correct.items() if v[0] > top}
+                self._pending_perm = {k: v for k, v in self._pending_perm.items() if v[0] > top}
+                self.batches += 1
+                self.rows += len(answers) + len(sent)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stopped or len(self._answers) + len(self._sent) >= self.batch_size,
+                    timeout=self.interval,
+                )
+                parar = self._stopped
+            try:
+                self.flush()
+            except Exception:
+                log.exception("write-behind: falha ao gravar lote; nova tentativa em %.3fs", self.interval)
+                time.sleep(self.interval)
+            if parar:
+                return
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._answers) + len(self._sent), "batches": self.batches, "rows": self.rows}
+
+
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "").strip().lower() in ("1", "true", "yes", "on")
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.05"))
+
+_WB = None
+
+
+def configure_write_behind(enabled: bool, batch_size: int = 200, interval: float = 0.05):
+    """
+    Liga/desliga o write-behind. Ao desligar, drena a fila antes.
+    """
+    global _WB
+    if _WB is not None:
+        _WB.close()
+        _WB = None
+    if enabled:
+        _WB = _WriteBehind(batch_size, interval)
+
+
+def flush_writes():
+    if _WB is not None:
+        _WB.flush()
+
+
+def close_write_behind():
+    configure_write_behind(False)
+
+
+def get_write_behind_stats() -> dict | None:
+    return None if _WB is None else _WB.stats()
+
+
+if DB_WRITE_BEHIND:
+    configure_write_behind(True, WRITE_BEHIND_BATCH, WRITE_BEHIND_INTERVAL)
+
+
+def _flush_for(uid: str | None = None):
+    """
+    Antes de ler agregados: grava respostas ainda na fila (do usuário, ou de todos).
+    """
+    if _WB is not None and _WB.has_pending_answers(uid):
+        _WB.flush()
+
+
+def backfill_aggregates():
+    """
+    Reconstroi user_totais, user_tema_sub e user_qid_status a partir de
+    respostas + respostas_resumo (o que a retenção já compactou). Uso único (ou para conferência): python db_turso.py backfill
+    """
+    flush_writes()
+    _exec_many([
+        ("DELETE FROM user_totais", ()),
+        ("DELETE FROM user_tema_sub", ()),
+        ("DELETE FROM user_qid_status", ()),
+        # respostas: cada GROUP BY sai de um índice de cobertura (migração 4)
+        (
+            """
+            INSERT INTO user_totais (user_id, acertos, total)
+            SELECT user_id, SUM(acertou), COUNT(*)
+            FROM respostas
+            GROUP BY user_id
+            """,
+            (),
+        ),
+        (
+            """
+            INSERT INTO user_tema_sub (user_id, tema, subtema, acertos, total)
+            SELECT user_id, tema, subtema, SUM(acertou), COUNT(*)
+            FROM respostas
+            GROUP BY user_id, tema, subtema
+            """,
+            (),
+        ),
+        (
+            """
+            INSERT INTO user_qid_status (user_id, qid, ok)
+            SELECT user_id, qid, MAX(acertou)
+            FROM respostas
+            WHERE qid <> ''
+            GROUP BY user_id, qid
+            """,
+            (),
+        ),
+        # + o que a retenção já resumiu
+        (
+            """
+            INSERT INTO user_totais (user_id, acertos, total)
+            SELECT user_id, SUM(acertos), SUM(total)
+            FROM respostas_resumo
+            WHERE true
+            GROUP BY user_id
+            ON CONFLICT(user_id) DO UPDATE SET
+                acertos = acertos + excluded.acertos,
+                total = total + excluded.total
+            """,
+            (),
+        ),
+        (
+            """
+            INSERT INTO user_tema_sub (user_id, tema, subtema, acertos, total)
+            SELECT user_id, tema, subtema, SUM(acertos), SUM(total)
+            FROM respostas_resumo
+            WHERE true
+            GROUP BY user_id, tema, subtema
+            ON CONFLICT(user_id, tema, subtema) DO UPDATE SET
+                acertos = acertos + excluded.acertos,
+                total = total + excluded.total
+            """,
+            (),
+        ),
+        (
+            """
+            INSERT INTO user_qid_status (user_id, qid, ok)
+            SELECT user_id, qid, MAX(ok)
+            FROM respostas_resumo
+            WHERE qid <> ''
+            GROUP BY user_id, qid
+            ON CONFLICT(user_id, qid) DO UPDATE SET ok = MAX(ok, excluded.ok)
+            """,
+            (),
+        ),
+    ])
+    _STATUS_CACHE.clear()
+    _LEADERBOARD.invalidate()
 
 
 def record_answer(user_id: str, qid: str, acertou: bool, marcada: str, tema: str, subtema: str):
     ts = _utc_now_iso()
-    _exec(
-        """
-        INSERT INTO respostas (user_id, qid, acertou, marcada, tema, subtema, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (str(user_id), str(qid).strip(), 1 if acertou else 0, str(marcada), str(tema or ""), str(subtema or ""), ts),
-    )
+    uid = str(user_id)
+    q = str(qid).strip()
+    row = (uid, q, 1 if acertou else 0, str(marcada), str(tema or ""), str(subtema or ""), ts)
+
+    if _WB is not None:
+        _WB.add_answer(row)
+    else:
+        _exec_many(_answer_statements([row]))
+    if q:
+        _STATUS_CACHE.record(uid, q, acertou)
+    _LEADERBOARD.record(uid, acertou)
 
 
 def get_overall_progress(user_id: str):
     uid = str(user_id)
+    _flush_for(uid)
 
     row = _fetchone(
         """
-        SELECT
-            COALESCE(SUM(acertou), 0) AS acertos,
-            COUNT(*) - COALESCE(SUM(acertou), 0) AS erros,
-            COUNT(*) AS total
-        FROM respostas
+        SELECT acertos, total - acertos AS erros, total
+        FROM user_totais
         WHERE user_id = ?
         """,
         (uid,),
     )
+    if not row:
+        row = (0, 0, 0)
 
     acertos = int(row[0] or 0)
     erros = int(row[1] or 0)
@@ -119,18 +1342,13 @@ def get_overall_progress(user_id: str):
 def get_topic_breakdown(user_id: str, limit: int = 20):
     uid = str(user_id)
     lim = max(0, int(limit))
+    _flush_for(uid)
 
     rows = _fetchall(
         """
-        SELECT
-            COALESCE(tema, '') AS tema,
-            COALESCE(subtema, '') AS subtema,
-            COALESCE(SUM(acertou), 0) AS acertos,
-            COUNT(*) - COALESCE(SUM(acertou), 0) AS erros,
-            COUNT(*) AS total
-        FROM respostas
+        SELECT tema, subtema, acertos, total - acertos AS erros, total
+        FROM user_tema_sub
         WHERE user_id = ?
-        GROUP BY tema, subtema
         ORDER BY total DESC
         LIMIT ?
         """,
@@ -162,15 +1380,20 @@ def get_question_status_map(user_id: str):
       - True  => acertou ao menos uma vez na questão
       - False => errou e nunca acertou
       - ausente => não respondeu (não aparece no dict)
+    Servido do cache em processo quando possível.
     """
     uid = str(user_id)
 
+    cached = _STATUS_CACHE.get(uid)
+    if cached is not None:
+        return cached
+    _flush_for(uid)
+
     rows = _fetchall(
         """
-        SELECT qid, MAX(acertou) AS ok
-        FROM respostas
+        SELECT qid, ok
+        FROM user_qid_status
         WHERE user_id = ?
-        GROUP BY qid
         """,
         (uid,),
     )
@@ -181,38 +1404,76 @@ def get_question_status_map(user_id: str):
         if not q:
             continue
         status[q] = True if int(ok or 0) == 1 else False
+
+    _STATUS_CACHE.put(uid, status)
     return status
 
 
+def get_review_queue(user_id: str, limit: int = 20) -> list[tuple[str, int]]:
+    """
+    As `limit` questões do usuário que vencem primeiro (vencidas ou não), em
+    ordem de vencimento: [(qid, vence_em epoch)]. Sai de idx_revisao_vence
+    sem ordenar: custo da busca no índice + limit linhas.
+    """
+    uid = str(user_id)
+    _flush_for(uid)
+
+    rows = _fetchall(
+        """
+        SELECT qid, vence_em
+        FROM revisao
+        WHERE user_id = ?
+        ORDER BY vence_em
+        LIMIT ?
+        """,
+        (uid, max(0, int(limit))),
+    )
+    return [(str(qid), int(vence_em)) for qid, vence_em in rows]
+
+
 def reset_user_stats(user_id: str):
     uid = str(user_id)
-    _exec("DELETE FROM respostas WHERE user_id = ?", (uid,))
-    _exec("DELETE FROM sent WHERE user_id = ?", (uid,))
+    flush_writes()
+    _exec_many([
+        ("DELETE FROM respostas WHERE user_id = ?", (uid,)),
+        ("DELETE FROM respostas_resumo WHERE user_id = ?", (uid,)),
+        ("DELETE FROM sent WHERE user_id = ?", (uid,)),
+        ("DELETE FROM user_totais WHERE user_id = ?", (uid,)),
+        ("DELETE FROM user_tema_sub WHERE user_id = ?", (uid,)),
+        ("DELETE FROM user_qid_status WHERE user_id = ?", (uid,)),
+        ("DELETE FROM revisao WHERE user_id = ?", (uid,)),
+    ])
+    _STATUS_CACHE.invalidate(uid)
+    _LEADERBOARD.remove(uid)
 
 
 def record_sent_question(user_id: str, qid: str, message_id: int, correta_exibida: str, perm: str):
     ts = _utc_now_iso()
-    _exec(
-        """
-        INSERT INTO sent (user_id, qid, message_id, correta_exibida, perm, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (
-            str(user_id),
-            str(qid).strip(),
-            int(message_id),
-            str(correta_exibida or "").strip().upper(),
-            str(perm or "").strip(),
-            ts,
-        ),
+    row = (
+        str(user_id),
+        str(qid).strip(),
+        int(message_id),
+        str(correta_exibida or "").strip().upper(),
+        str(perm or "").strip(),
+        ts,
     )
 
+    if _WB is not None:
+        _WB.add_sent(row)
+    else:
+        _exec_many(_sent_statements([row]))
+
 
 def get_sent_correct(user_id: str, qid: str, message_id: int) -> str:
     uid = str(user_id)
     q = str(qid).strip()
     mid = int(message_id)
 
+    if _WB is not None:
+        pend = _WB.pending_correct(uid, q, mid)
+        if pend is not None:
+            return pend
+
     row = _fetchone(
         """
         SELECT correta_exibida
@@ -232,6 +1493,11 @@ def get_last_perm_for_user_question(user_id: str, qid: str) -> str:
     uid = str(user_id)
     q = str(qid).strip()
 
+    if _WB is not None:
+        pend = _WB.pending_perm(uid, q)
+        if pend is not None:
+            return pend
+
     row = _fetchone(
         """
         SELECT perm
@@ -247,47 +1513,52 @@ def get_last_perm_for_user_question(user_id: str, qid: str) -> str:
     return str(row[0] or "").strip()
 
 
-def get_users_overall_scores(limit: int | None = None):
+def get_last_perms_for_user_questions(user_id: str, qids: list[str]) -> dict:
     """
-    Retorna lista:
-      [{"user_id": "...", "respondidas": N, "acertos": A, "erros": E, "pct": P}, ...]
-    Ordenado por respondidas desc.
+    Última perm enviada de cada qid (uma consulta por até 500 qids, janela por qid).
+    Retorna {qid: "B,A,D,C"}; qids nunca enviados não aparecem.
     """
-    if limit is None:
-        rows = _fetchall(
-            """
-            SELECT
-                user_id,
-                COUNT(*) AS respondidas,
-                COALESCE(SUM(acertou), 0) AS acertos,
-                COUNT(*) - COALESCE(SUM(acertou), 0) AS erros
-            FROM respostas
-            GROUP BY user_id
-            ORDER BY respondidas DESC
-            """
-        )
-    else:
-        lim = max(0, int(limit))
+    uid = str(user_id)
+    lista = list(dict.fromkeys(str(q).strip() for q in qids))
+    out = {}
+
+    for chunk in _chunks(lista, 500):
+        marcadores = ", ".join(["?"] * len(chunk))
         rows = _fetchall(
-            """
-            SELECT
-                user_id,
-                COUNT(*) AS respondidas,
-                COALESCE(SUM(acertou), 0) AS acertos,
-                COUNT(*) - COALESCE(SUM(acertou), 0) AS erros
-            FROM respostas
-            GROUP BY user_id
-            ORDER BY respondidas DESC
-            LIMIT ?
+            f"""
+            SELECT qid, perm
+            FROM (
+                SELECT qid, perm, ROW_NUMBER() OVER (PARTITION BY qid ORDER BY id DESC) AS rn
+                FROM sent
+                WHERE user_id = ? AND qid IN ({marcadores})
+            )
+            WHERE rn = 1
             """,
-            (lim,),
+            (uid, *chunk),
         )
+        for qid, perm in rows:
+            out[str(qid)] = str(perm or "").strip()
+
+    if _WB is not None:
+        for q in lista:
+            pend = _WB.pending_perm(uid, q)
+            if pend is not None:
+                out[q] = pend
+    return out
+
+
+def get_users_overall_scores(limit: int | None = None, offset: int = 0):
+    """
+    Retorna lista:
+      [{"user_id": "...", "respondidas": N, "acertos": A, "erros": E, "pct": P}, ...]
+    Ordenado por respondidas desc. offset/limit paginam o ranking em memória.
+    """
+    off = max(0, int(offset))
+    lim = None if limit is None else max(0, int(limit))
 
     out = []
-    for uid, respondidas, acertos, erros in rows:
-        respondidas = int(respondidas or 0)
-        acertos = int(acertos or 0)
-        erros = int(erros or 0)
+    for uid, respondidas, acertos in _LEADERBOARD.page(off, lim):
+        erros = respondidas - acertos
         pct = (acertos / respondidas * 100.0) if respondidas else 0.0
         out.append(
             {
@@ -301,6 +1572,17 @@ def get_users_overall_scores(limit: int | None = None):
     return out
 
 
+def get_user_rank(user_id: str) -> int | None:
+    """
+    Posição (1 = mais respondidas) do usuário no ranking; None se não respondeu nada.
+    """
+    return _LEADERBOARD.rank(str(user_id).strip())
+
+
+def count_ranked_users() -> int:
+    return _LEADERBOARD.size()
+
+
 def get_user_topic_breakdown_full(user_id: str):
     """
     Retorna duas visões:
@@ -308,15 +1590,16 @@ def get_user_topic_breakdown_full(user_id: str):
       - por tema/subtema (detalhado)
     """
     uid = str(user_id).strip()
+    _flush_for(uid)
 
     rows_tema = _fetchall(
         """
         SELECT
-            COALESCE(tema, '') AS tema,
-            COALESCE(SUM(acertou), 0) AS acertos,
-            COUNT(*) - COALESCE(SUM(acertou), 0) AS erros,
-            COUNT(*) AS total
-        FROM respostas
+            tema,
+            SUM(acertos) AS acertos,
+            SUM(total) - SUM(acertos) AS erros,
+            SUM(total) AS total
+        FROM user_tema_sub
         WHERE user_id = ?
         GROUP BY tema
         ORDER BY total DESC
@@ -336,15 +1619,9 @@ def get_user_topic_breakdown_full(user_id: str):
 
     rows_ts = _fetchall(
         """
-        SELECT
-            COALESCE(tema, '') AS tema,
-            COALESCE(subtema, '') AS subtema,
-            COALESCE(SUM(acertou), 0) AS acertos,
-            COUNT(*) - COALESCE(SUM(acertou), 0) AS erros,
-            COUNT(*) AS total
-        FROM respostas
+        SELECT tema, subtema, acertos, total - acertos AS erros, total
+        FROM user_tema_sub
         WHERE user_id = ?
-        GROUP BY tema, subtema
         ORDER BY total DESC
         """,
         (uid,),
@@ -368,3 +1645,218 @@ def get_user_topic_breakdown_full(user_id: str):
         )
 
     return {"temas": temas, "tema_subtema": tema_subtema}
+
+
+# ==========================================================
+# Retenção: respostas e sent não crescem sem limite
+#   - respostas mais velhas que RETENCAO_RESPOSTAS_DIAS são somadas em
+#     respostas_resumo (por usuário/qid/tema/subtema) e apagadas; agregados,
+#     status e progresso não mudam (backfill_aggregates lê as duas tabelas)
+#   - sent mais velho que RETENCAO_SENT_DIAS é apagado, menos a linha mais
+#     nova de cada usuário/qid (a última perm, para não repetir)
+#   - sessões paradas há mais de RETENCAO_SESSOES_DIAS (quiz largado no
+#     meio) são apagadas; as terminadas já saem em sessoes.py
+# Cada chamada faz um lote de até RETENCAO_LOTE linhas (em ordem de id) numa
+# transação curta que também grava o cursor em manutencao; interrompido, o
+# trabalho continua de onde parou. Dias <= 0 desliga a tarefa.
+# ==========================================================
+RETENCAO_RESPOSTAS_DIAS = float(os.getenv("RETENCAO_RESPOSTAS_DIAS", "180"))
+RETENCAO_SENT_DIAS = float(os.getenv("RETENCAO_SENT_DIAS", "30"))
+RETENCAO_SESSOES_DIAS = float(os.getenv("RETENCAO_SESSOES_DIAS", "14"))
+RETENCAO_LOTE = max(1, int(os.getenv("RETENCAO_LOTE", "2000")))
+
+
+def _corte(dias: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=dias)).isoformat()
+
+
+def _cursor(tarefa: str) -> int:
+    row = _fetchone("SELECT cursor FROM manutencao WHERE tarefa = ?", (tarefa,))
+    return int(row[0]) if row else 0
+
+
+def _cursor_stmt(tarefa: str, cursor: int) -> tuple[str, tuple]:
+    return (
+        """
+        INSERT INTO manutencao (tarefa, cursor, atualizado_em) VALUES (?, ?, ?)
+        ON CONFLICT(tarefa) DO UPDATE SET cursor = excluded.cursor, atualizado_em = excluded.atualizado_em
+        """,
+        (tarefa, int(cursor), _utc_now_iso()),
+    )
+
+
+def _proximo_lote(tabela: str, cursor: int, lote: int, corte: str) -> tuple[int | None, int]:
+    """
+    (último id, quantidade) das próximas linhas após `cursor` mais velhas que
+    `corte`. Os ids crescem com o timestamp, então para na primeira linha nova.
+    """
+    rows = _fetchall(f"SELECT id, timestamp FROM {tabela} WHERE id > ? ORDER BY id LIMIT ?", (cursor, lote))
+    fim, n = None, 0
+    for id_, ts in rows:
+        if (ts or "") >= corte:
+            break
+        fim, n = int(id_), n + 1
+    return fim, n
+
+
+def compactar_respostas(lote: int = RETENCAO_LOTE, dias: float = RETENCAO_RESPOSTAS_DIAS) -> tuple[int, int]:
+    """
+    Um lote: respostas antigas -> respostas_resumo. Retorna (examinadas, removidas);
+    (0, 0) quando não há mais o que compactar (o cursor volta ao início).
+    """
+    if dias <= 0:
+        return 0, 0
+    cursor = _cursor("respostas")
+    fim, n = _proximo_lote("respostas", cursor, lote, _corte(dias))
+    if fim is None:
+        if cursor:
+            _exec_many([_cursor_stmt("respostas", 0)])
+        return 0, 0
+
+    _exec_many([
+        (
+            """
+            INSERT INTO respostas_resumo (user_id, qid, tema, subtema, acertos, total, ok, ultimo)
+            SELECT user_id, qid, tema, subtema, SUM(acertou), COUNT(*), MAX(acertou), MAX(timestamp)
+            FROM respostas
+            WHERE id > ? AND id <= ?
+            GROUP BY user_id, qid, tema, subtema
+            ON CONFLICT(user_id, qid, tema, subtema) DO UPDATE SET
+                acertos = acertos + excluded.acertos,
+                total = total + excluded.total,
+                ok = MAX(ok, excluded.ok),
+                ultimo = MAX(COALESCE(ultimo, ''), COALESCE(excluded.ultimo, ''))
+            """,
+            (cursor, fim),
+        ),
+        ("DELETE FROM respostas WHERE id > ? AND id <= ?", (cursor, fim)),
+        _cursor_stmt("respostas", fim),
+    ])
+    return n, n
+
+
+def podar_sent(lote: int = RETENCAO_LOTE, dias: float = RETENCAO_SENT_DIAS) -> tuple[int, int]:
+    """
+    Um lote: apaga sent antigo, exceto a linha mais nova de cada usuário/qid.
+    Retorna (examinadas, removidas); (0, 0) ao fim do ciclo (o cursor volta
+    ao início, para rever as linhas mantidas que depois ficaram velhas).
+    """
+    if dias <= 0:
+        return 0, 0
+    cursor = _cursor("sent")
+    fim, n = _proximo_lote("sent", cursor, lote, _corte(dias))
+    if fim is None:
+        if cursor:
+            _exec_many([_cursor_stmt("sent", 0)])
+        return 0, 0
+
+    _exec_many([
+        (
+            """
+            DELETE FROM sent
+            WHERE id > ? AND id <= ?
+              AND EXISTS (
+                  SELECT 1 FROM sent AS novo
+                  WHERE novo.user_id = sent.user_id AND novo.qid = sent.qid AND novo.id > sent.id
+              )
+            """,
+            (cursor, fim),
+        ),
+        _cursor_stmt("sent", fim),
+    ])
+    mantidas = _fetchone("SELECT COUNT(*) FROM sent WHERE id > ? AND id <= ?", (cursor, fim))
+    return n, n - int(mantidas[0] or 0)
+
+
+def podar_sessoes(lote: int = RETENCAO_LOTE, dias: float = RETENCAO_SESSOES_DIAS) -> tuple[int, int]:
+    """
+    Um lote: apaga sessões sem atualização há mais de `dias`. Retorna
+    (examinadas, removidas); (0, 0) quando não sobrou nenhuma velha.
+    """
+    if dias <= 0:
+        return 0, 0
+    corte = _corte(dias)
+    rows = _fetchall("SELECT chat_id FROM sessoes WHERE atualizado_em < ? LIMIT ?", (corte, lote))
+    if not rows:
+        return 0, 0
+    ids = [int(r[0]) for r in rows]
+    # confere o corte de novo: a sessão pode ter sido regravada depois do SELECT
+    _exec_many([
+        (
+            f"DELETE FROM sessoes WHERE chat_id IN ({', '.join(['?'] * len(ids))}) AND atualizado_em < ?",
+            (*ids, corte),
+        ),
+    ])
+    return len(ids), len(ids)
+
+
+def compactar(lote: int = RETENCAO_LOTE) -> dict:
+    """
+    Roda as tarefas até o fim (CLI). Retorna as linhas removidas por tabela.
+    """
+    removidas = {"respostas": 0, "sent": 0, "sessoes": 0}
+    for tabela, tarefa in (("respostas", compactar_respostas), ("sent", podar_sent), ("sessoes", podar_sessoes)):
+        while True:
+            examinadas, n = tarefa(lote)
+            removidas[tabela] += n
+            if not examinadas:
+                break
+    return removidas
+
+
+# ==========================================================
+# Sessões (persistência do PTB)
+# ==========================================================
+def load_sessions() -> dict[int, str]:
+    return {int(cid): str(dados) for cid, dados in _fetchall("SELECT chat_id, dados FROM sessoes")}
+
+
+def get_session(chat_id: int) -> str | None:
+    row = _fetchone("SELECT dados FROM sessoes WHERE chat_id = ?", (int(chat_id),))
+    return str(row[0]) if row else None
+
+
+def save_sessions(rows: list[tuple[int, str | None]]):
+    """
+    rows: [(chat_id, dados), ...]; dados None apaga a sessão. Tudo numa transação.
+    """
+    ts = _utc_now_iso()
+    gravar = [(int(cid), dados, ts) for cid, dados in rows if dados is not None]
+    apagar = [int(cid) for cid, dados in rows if dados is None]
+
+    stmts = []
+    for chunk in _chunks(gravar):
+        stmts.append((
+            "INSERT INTO sessoes (chat_id, dados, atualizado_em) VALUES "
+            + ", ".join(["(?, ?, ?)"] * len(chunk))
+            + """
+            ON CONFLICT(chat_id) DO UPDATE SET
+                dados = excluded.dados,
+                atualizado_em = excluded.atualizado_em
+            """,
+            tuple(v for r in chunk for v in r),
+        ))
+    for chunk in _chunks(apagar, 500):
+        stmts.append((f"DELETE FROM sessoes WHERE chat_id IN ({', '.join(['?'] * len(chunk))})", tuple(chunk)))
+    if stmts:
+        _exec_many(stmts)
+
+
+if __name__ == "__main__":
+    import sys
+
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "backfill":
+        init_db()
+        backfill_aggregates()
+        print("Agregados reconstruídos a partir de respostas.")
+    elif cmd == "compactar":
+        init_db()
+        removidas = compactar()
+        print(
+            f"Retenção: {removidas['respostas']} respostas resumidas, {removidas['sent']} linhas de sent podadas, "
+            f"{removidas['sessoes']} sessões largadas apagadas."
+        )
+    else:
+        print("Uso: python db_turso.py backfill|compactar")
+        sys.exit(2)
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from metricas import Contador, Histograma, adicionar
+
+# ==========================================================
+# Agendador de envios ao Telegram (rate limiter do PTB)
+# Tudo que gera mensagem (send*, edições, deleteMessage) passa por dois baldes
+# de tokens: um global (ENVIO_GLOBAL_POR_SEG) e um por chat
+# (ENVIO_CHAT_POR_SEG com rajada de ENVIO_CHAT_RAJADA; grupos usam
+# ENVIO_GRUPO_POR_MIN). Quem espera sai por prioridade: a questão (sendMessage)
+# antes de edições de texto, e estas antes de remover teclado. Um 429
+# (RetryAfter) pausa o balde do chat e o global pelo tempo pedido e repete o
+# envio até ENVIO_MAX_TENTATIVAS vezes. answerCallbackQuery e afins não são limitados.
+#   ENVIO_LIMITADOR=0 desliga o agendador
+# ==========================================================
+ENVIO_LIMITADOR = os.getenv("ENVIO_LIMITADOR", "1").strip().lower() not in ("0", "false", "no", "off")
+ENVIO_GLOBAL_POR_SEG = float(os.getenv("ENVIO_GLOBAL_POR_SEG", "30"))
+ENVIO_CHAT_POR_SEG = float(os.getenv("ENVIO_CHAT_POR_SEG", "1"))
+ENVIO_CHAT_RAJADA = max(1, int(os.getenv("ENVIO_CHAT_RAJADA", "3")))
+ENVIO_GRUPO_POR_MIN = float(os.getenv("ENVIO_GRUPO_POR_MIN", "20"))
+ENVIO_MAX_TENTATIVAS = max(0, int(os.getenv("ENVIO_MAX_TENTATIVAS", "3")))
+
+log = logging.getLogger(__name__)
+
+# prioridade por método (menor sai antes); o resto fica em NORMAL
+ALTA, NORMAL, BAIXA = 0, 1, 2
+PRIORIDADES = {
+    "sendMessage": ALTA,
+    "editMessageText": NORMAL,
+    "editMessageReplyMarkup": BAIXA,
+    "deleteMessage": BAIXA,
+}
+_LIMITADOS = ("editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+              "deleteMessage", "copyMessage", "forwardMessage")
+
+ESPERA_SEGUNDOS = Histograma("chobot_envio_espera_seconds", "Espera na fila de envio.", ("prioridade",))
+RETRY_AFTER = Contador("chobot_telegram_retry_after_total", "Respostas 429 (RetryAfter) por método.", ("metodo",))
+adicionar(ESPERA_SEGUNDOS, RETRY_AFTER)
+
+
+def _limitado(endpoint: str) -> bool:
+    return endpoint.startswith("send") or endpoint in _LIMITADOS
+
+
+class _Balde:
+    """
+    Balde de tokens com fila de espera por prioridade (FIFO dentro da mesma).
+    """
+
+    __slots__ = ("taxa", "capacidade", "tokens", "atualizado", "pausa_ate", "fila", "servidor")
+
+    def __init__(self, taxa: float, capacidade: float):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = capacidade
+        self.atualizado = time.monotonic()
+        self.pausa_ate = 0.0
+        self.fila = []  # heap de (prioridade, seq, future)
+        self.servidor = None
+
+    def _espera(self, agora: float) -> float:
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+        self.atualizado = agora
+        if agora < self.pausa_ate:
+            return self.pausa_ate - agora
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.taxa
+
+    async def pegar(self, prioridade: int, seq: int):
+        if not self.fila and self._espera(time.monotonic()) == 0:
+            self.tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.fila, (prioridade, seq, fut))
+        if self.servidor is None:
+            self.servidor = asyncio.get_running_loop().create_task(self._servir())
+        await fut
+
+    async def _servir(self):
+        try:
+            while self.fila:
+                espera = self._espera(time.monotonic())
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                    continue
+                _, _, fut = heapq.heappop(self.fila)
+                if fut.done():
+                    # quem esperava foi cancelado: não gasta token
+                    continue
+                self.tokens -= 1
+                fut.set_result(None)
+        finally:
+            self.servidor = None
+
+    def pausar(self, segundos: float):
+        self.pausa_ate = max(self.pausa_ate, time.monotonic() + segundos)
+
+    def ocioso(self) -> bool:
+        return not self.fila and self._espera(time.monotonic()) == 0 and self.tokens >= self.capacidade
+
+    def parar(self):
+        if self.servidor is not None:
+            self.servidor.cancel()
+        for _, _, fut in self.fila:
+            fut.cancel()
+        self.fila.clear()
+
+
+class AgendadorEnvio(BaseRateLimiter[int]):
+    """
+    rate_limit_args, se passado numa chamada do bot, é a prioridade (ALTA/NORMAL/BAIXA).
+    """
+
+    def __init__(
+        self,
+        global_por_seg: float = ENVIO_GLOBAL_POR_SEG,
+        chat_por_seg: float = ENVIO_CHAT_POR_SEG,
+        chat_rajada: int = ENVIO_CHAT_RAJADA,
+        grupo_por_min: float = ENVIO_GRUPO_POR_MIN,
+        max_tentativas: int = ENVIO_MAX_TENTATIVAS,
+    ):
+        self.chat_por_seg = chat_por_seg
+        self.chat_rajada = chat_rajada
+        self.grupo_por_min = grupo_por_min
+        self.max_tentativas = max_tentativas
+        # global sem rajada: espaça os envios em vez de gastar o segundo todo de uma vez
+        self._global = _Balde(global_por_seg, 1) if global_por_seg > 0 else None
+        self._chats = {}
+        self._seq = itertools.count()
+        self._desde_limpeza = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        for balde in (self._global, *self._chats.values()):
+            if balde is not None:
+                balde.parar()
+        self._chats.clear()
+
+    def _balde_chat(self, chat_id):
+        if chat_id is None:
+            return None
+        balde = self._chats.get(chat_id)
+        if balde is None:
+            grupo = isinstance(chat_id, str) or int(chat_id) < 0
+            taxa = self.grupo_por_min / 60.0 if grupo else self.chat_por_seg
+            if taxa <= 0:
+                return None
+            balde = self._chats[chat_id] = _Balde(taxa, self.chat_rajada)
+        return balde
+
+    def _limpar(self):
+        self._desde_limpeza += 1
+        if self._desde_limpeza < 1000:
+            return
+        self._desde_limpeza = 0
+        for chat_id in [c for c, b in self._chats.items() if b.ocioso()]:
+            del self._chats[chat_id]
+
+    async def _vez(self, prioridade: int, balde_chat: _Balde | None):
+        seq = next(self._seq)
+        t0 = time.perf_counter()
+        if balde_chat is not None:
+            await balde_chat.pegar(prioridade, seq)
+        if self._global is not None:
+            await self._global.pegar(prioridade, seq)
+        ESPERA_SEGUNDOS.observe(time.perf_counter() - t0, str(prioridade))
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not _limitado(endpoint):
+            return await callback(*args, **kwargs)
+
+        prioridade = rate_limit_args if isinstance(rate_limit_args, int) else PRIORIDADES.get(endpoint, NORMAL)
+        balde_chat = self._balde_chat(data.get("chat_id"))
+        self._limpar()
+        tentativa = 0
+        while True:
+            await self._vez(prioridade, balde_chat)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                RETRY_AFTER.inc(endpoint)
+                tentativa += 1
+                if tentativa > self.max_tentativas:
+                    raise
+                log.warning(
+                    "envio: 429 em %s (chat %s), aguardando %ss (tentativa %d/%d)",
+                    endpoint, data.get("chat_id"), e.retry_after, tentativa, self.max_tentativas,
+                )
+                # o limite estourado pode ser o do bot todo, não só o do chat:
+                # segura os dois baldes, senão os outros chats seguem levando 429
+                baldes = [b for b in (balde_chat, self._global) if b is not None]
+                for balde in baldes:
+                    balde.pausar(float(e.retry_after))
+                if not baldes:
+                    await asyncio.sleep(float(e.retry_after))
+
+
+# ==========================================================
+# Remoção de teclado (cosmética): em segundo plano e com prioridade baixa,
+# para não segurar o handler nem passar na frente da próxima questão
+# ==========================================================
+async def _sem_teclado(query):
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except BadRequest as e:
+        # "message is not modified", mensagem antiga demais etc.: nada a fazer
+        log.debug("envio: teclado não removido (chat %s): %s", query.message.chat_id, e)
+    except TelegramError as e:
+        log.warning("envio: falha ao remover teclado (chat %s): %s", query.message.chat_id, e)
+
+
+def remover_teclado(context, query):
+    context.application.create_task(_sem_teclado(query))
@@ -2,9 +2,18 @@ import os
 from dotenv import load_dotenv
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler
-
-from db_turso import (
-    init_db,
+from telegram.request import HTTPXRequest
+
+import db_async
+import envio
+import metricas
+import rastreio
+import retencao
+from envio import remover_teclado
+from processador import PorChatUpdateProcessor
+from sessoes import SessaoPersistence
+from storage import get_storage
+from db_async import (
     record_answer,
     get_overall_progress,
     get_topic_breakdown,
@@ -13,37 +22,47 @@ from db_turso import (
     # 🔥 novos para /score
     get_users_overall_scores,
     get_user_topic_breakdown_full,
+    get_user_rank,
+    count_ranked_users,
 )
 
 from quiz import (
     enviar_temas,
     enviar_subtemas,
     iniciar_quiz,
+    iniciar_revisao,
     enviar_proxima,
+    invalidar_progresso,
     get_correct_and_explanation,
+    get_question_by_id,
+    explicacao_renderizada,
+    verificar_resposta_assinada,
+    recarregar_banco,
+    iniciar_vigia,
+    parar_vigia,
 )
 
 load_dotenv()
 
 TOKEN = os.getenv("BOT_TOKEN")
-WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_URL = (os.getenv("WEBHOOK_URL") or "").rstrip("/")
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
 PORT = int(os.getenv("PORT", "10000"))
-
-if not TOKEN:
-    raise RuntimeError("BOT_TOKEN não definido nas variáveis de ambiente.")
-if not WEBHOOK_URL:
-    raise RuntimeError("WEBHOOK_URL não definido nas variáveis de ambiente.")
+SCORE_PAGE_SIZE = 20
+# quem pode usar /recarregar (ids do Telegram separados por vírgula)
+ADMIN_IDS = {x.strip() for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+# sessões de quiz sobrevivem a reinícios (tabela sessoes); SESSOES_PERSISTENTES=0 desliga
+SESSOES_PERSISTENTES = os.getenv("SESSOES_PERSISTENTES", "1").strip().lower() not in ("0", "false", "no", "off")
 
 if not WEBHOOK_PATH.startswith("/"):
     WEBHOOK_PATH = "/" + WEBHOOK_PATH
-WEBHOOK_URL = WEBHOOK_URL.rstrip("/")
 
 
 async def setup_commands(app: Application):
     await app.bot.set_my_commands(
         [
             BotCommand("start", "Iniciar o bot e escolher tema/subtema"),
+            BotCommand("revisar", "Revisar as questões vencidas (repetição espaçada)"),
             BotCommand("progresso", "Ver seu progresso por tema/subtema"),
             BotCommand("score", "Ranking e detalhamento por usuário (tema/subtema)"),
             BotCommand("zerar", "Zerar suas estatísticas (com confirmação)"),
@@ -51,13 +70,30 @@ async def setup_commands(app: Application):
     )
 
 
+async def on_startup(app: Application):
+    await setup_commands(app)
+    iniciar_vigia()
+    retencao.iniciar()
+    metricas.iniciar_servidor()
+
+
+async def on_shutdown(app: Application):
+    parar_vigia()
+    retencao.parar()
+    db_async.shutdown()
+
+
 async def start(update, context):
     await enviar_temas(update, context)
 
 
+async def revisar(update, context):
+    await iniciar_revisao(update, context, str(update.effective_user.id), limite=20)
+
+
 async def progresso(update, context):
     user_id = str(update.effective_user.id)
-    geral = get_overall_progress(user_id)
+    geral = await get_overall_progress(user_id)
     total = geral["acertos"] + geral["erros"]
 
     linhas = [
@@ -71,7 +107,7 @@ async def progresso(update, context):
         "📌 *Por Tema/Subtema (top 20 por volume):*",
     ]
 
-    breakdown = get_topic_breakdown(user_id, limit=20)
+    breakdown = await get_topic_breakdown(user_id, limit=20)
     if not breakdown:
         linhas.append("—")
     else:
@@ -87,7 +123,7 @@ async def progresso(update, context):
 async def score(update, context):
     """
     /score
-      - sem args: lista usuários (top 20 por respondidas)
+      - sem args: lista usuários (top 20 por respondidas), com botões de página
       - com args: /score <user_id> => detalha por tema e por tema/subtema
     """
     args = getattr(context, "args", []) or []
@@ -95,16 +131,18 @@ async def score(update, context):
     # detalhe: /score <user_id>
     if args:
         uid = str(args[0]).strip()
-        geral = get_overall_progress(uid)
+        geral = await get_overall_progress(uid)
         total = geral["acertos"] + geral["erros"]
 
-        blob = get_user_topic_breakdown_full(uid)
+        blob = await get_user_topic_breakdown_full(uid)
         temas = blob["temas"]
         tema_sub = blob["tema_subtema"]
+        rank = await get_user_rank(uid)
 
         linhas = [
             f"👤 *SCORE do usuário:* `{uid}`",
             "",
+            f"🏅 Posição no ranking: *{f'#{rank}' if rank else '—'}*",
             f"Respondidas: *{total}*",
             f"✅ Acertos: *{geral['acertos']}*",
             f"❌ Erros: *{geral['erros']}*",
@@ -137,10 +175,25 @@ async def score(update, context):
         return
 
     # lista geral: /score
-    scores = get_users_overall_scores(limit=20)
+    texto, teclado = await _score_page(0, str(update.effective_user.id))
+    await update.message.reply_text(texto, reply_markup=teclado, parse_mode="Markdown")
+
+
+async def _score_page(offset: int, viewer_id: str):
+    """
+    Monta uma página do ranking (SCORE_PAGE_SIZE posições a partir de offset).
+    """
+    total_users = await count_ranked_users()
+    offset = max(0, min(int(offset), max(0, total_users - 1)))
+    scores = await get_users_overall_scores(limit=SCORE_PAGE_SIZE, offset=offset)
+
+    if offset == 0:
+        titulo = f"🏆 *SCORE (Top {SCORE_PAGE_SIZE} por respondidas)*"
+    else:
+        titulo = f"🏆 *SCORE (posições {offset + 1}–{offset + len(scores)} de {total_users})*"
 
     linhas = [
-        "🏆 *SCORE (Top 20 por respondidas)*",
+        titulo,
         "",
         "_Use_ `/score <user_id>` _para ver por TEMA e SUBTEMA._",
         "",
@@ -148,16 +201,53 @@ async def score(update, context):
 
     if not scores:
         linhas.append("— sem dados ainda —")
-        await update.message.reply_text("\n".join(linhas), parse_mode="Markdown")
-        return
+        return "\n".join(linhas), None
 
-    for i, s in enumerate(scores, start=1):
+    for i, s in enumerate(scores, start=offset + 1):
         linhas.append(
             f"{i:02d}. `{s['user_id']}` → *{s['respondidas']}* "
             f"(✅{s['acertos']} ❌{s['erros']}) | *{s['pct']:.1f}%*"
         )
 
-    await update.message.reply_text("\n".join(linhas), parse_mode="Markdown")
+    rank = await get_user_rank(viewer_id)
+    if rank:
+        linhas.append("")
+        linhas.append(f"📍 Sua posição: *#{rank}* de {total_users}")
+
+    botoes = []
+    if offset > 0:
+        botoes.append(
+            InlineKeyboardButton("⬅️ Anteriores", callback_data=f"SCORE|{max(0, offset - SCORE_PAGE_SIZE)}")
+        )
+    if offset + SCORE_PAGE_SIZE < total_users:
+        botoes.append(InlineKeyboardButton("Próximos ➡️", callback_data=f"SCORE|{offset + SCORE_PAGE_SIZE}"))
+
+    teclado = InlineKeyboardMarkup([botoes]) if botoes else None
+    return "\n".join(linhas), teclado
+
+
+async def recarregar(update, context):
+    """
+    /recarregar (só ADMIN_IDS): relê a planilha/artefato sem reiniciar o bot.
+    Sessões em andamento continuam na versão em que começaram.
+    """
+    if str(update.effective_user.id) not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Comando restrito.")
+        return
+
+    try:
+        mudou, b = await recarregar_banco()
+    except Exception as e:
+        await update.message.reply_text(f"⚠️ Falha ao recarregar o banco: {e}")
+        return
+
+    if not mudou:
+        await update.message.reply_text(f"ℹ️ Banco sem mudanças (versão `{b.versao}`).", parse_mode="Markdown")
+        return
+    await update.message.reply_text(
+        f"🔄 Banco recarregado: versão `{b.versao}`, {len(b.questions_by_id)} questões em {len(b.temas)} temas.",
+        parse_mode="Markdown",
+    )
 
 
 async def zerar(update, context):
@@ -190,15 +280,13 @@ async def callback_handler(update, context):
             return
 
         if decision == "NO":
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception:
-                pass
+            remover_teclado(context, query)
             await query.message.reply_text("✅ Cancelado. Nenhuma estatística foi alterada.")
             return
 
         if decision == "YES":
-            reset_user_stats(user_id)
+            await reset_user_stats(user_id)
+            invalidar_progresso(user_id)
 
             context.chat_data.pop("quiz", None)
             context.chat_data.pop("tema", None)
@@ -206,14 +294,21 @@ async def callback_handler(update, context):
             context.chat_data.pop("qid_atual", None)
             context.chat_data.pop("perm_atual", None)
 
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception:
-                pass
+            remover_teclado(context, query)
 
             await query.message.reply_text("🧹 Estatísticas zeradas com sucesso. Use /start para recomeçar.")
             return
 
+    # ===== paginação do /score =====
+    if data.startswith("SCORE|"):
+        try:
+            offset = int(data.split("|", 1)[1])
+        except ValueError:
+            offset = 0
+        texto, teclado = await _score_page(offset, user_id)
+        await query.edit_message_text(texto, reply_markup=teclado, parse_mode="Markdown")
+        return
+
     # ===== fluxo normal =====
     if data.startswith("TEMA|"):
         tema = data.split("|", 1)[1]
@@ -227,7 +322,13 @@ async def callback_handler(update, context):
         await iniciar_quiz(update, context, user_id, tema, sub, limite=20)
         return
 
+    if data == "REV":
+        await iniciar_revisao(update, context, user_id, limite=20)
+        return
+
     if data.startswith("RESP|"):
+        if not _primeiro_toque(context, query):
+            return
         _, qid_raw, marcada = data.split("|", 2)
         qid = str(qid_raw).strip()
 
@@ -235,67 +336,137 @@ async def callback_handler(update, context):
         correta_exibida = ""
         if message_id is not None:
             try:
-                correta_exibida = get_sent_correct(user_id, qid, message_id)
+                correta_exibida = await get_sent_correct(user_id, qid, message_id)
             except Exception:
                 correta_exibida = ""
 
         if not correta_exibida:
             correta_exibida = str(context.chat_data.get("correta_exibida", "")).strip().upper()
 
-        correta_original, explicacao = get_correct_and_explanation(qid)
+        await _registrar_resposta(query, context, user_id, qid, marcada, correta_exibida)
+        return
 
-        if correta_exibida:
-            acertou = (marcada == correta_exibida)
-        else:
-            acertou = (marcada == correta_original)
+    # resposta com callback assinado: nenhuma leitura no banco para conferir
+    if data.startswith("R|"):
+        if not _primeiro_toque(context, query):
+            return
+        verificado = verificar_resposta_assinada(data, user_id)
+        if verificado is None:
+            await query.message.reply_text("⚠️ Botão inválido ou expirado. Use /start para continuar.")
+            return
+        qid, marcada, correta_exibida, versao = verificado
+        await _registrar_resposta(query, context, user_id, qid, marcada, correta_exibida, versao)
+        return
 
-        sess = context.chat_data.get("quiz", {})
-        tema = sess.get("tema", "")
-        subtema = sess.get("subtema", "")
+    if data == "NEXTQ":
+        if not _primeiro_toque(context, query):
+            return
+        remover_teclado(context, query)
+        await enviar_proxima(update, context)
+        return
 
-        record_answer(user_id, qid, acertou, marcada, tema, subtema)
 
-        try:
-            await query.edit_message_reply_markup(reply_markup=None)
-        except Exception:
-            pass
+def _primeiro_toque(context, query) -> bool:
+    # updates do mesmo chat são serializados (processador.py), então o segundo
+    # toque no mesmo botão só chega depois do primeiro terminar: ignora-o aqui,
+    # senão a resposta seria gravada duas vezes ou o NEXTQ pularia uma questão
+    message_id = getattr(query.message, "message_id", None)
+    if message_id is None:
+        return True
+    if context.chat_data.get("mid_tratado") == message_id:
+        return False
+    context.chat_data["mid_tratado"] = message_id
+    return True
+
+
+async def _registrar_resposta(
+    query, context, user_id: str, qid: str, marcada: str, correta_exibida: str, versao: str | None = None,
+):
+    # versao: a do botão assinado; nos demais, a da sessão
+    sess = context.chat_data.get("quiz", {})
+    versao = versao or sess.get("versao")
+    correta_original, _exp = get_correct_and_explanation(qid, versao)
+
+    if correta_exibida:
+        acertou = (marcada == correta_exibida)
+    else:
+        acertou = (marcada == correta_original)
 
-        cab = "✅ *Correto!*" if acertou else f"❌ *Errado.* Correta: *{correta_exibida or correta_original or '—'}*"
-        texto = f"{cab}\n\n📘 *Explicação:*\n{explicacao if explicacao else '—'}"
+    # tema/subtema da própria questão: na revisão a sessão mistura temas
+    q = get_question_by_id(qid, versao)
+    tema = q.tema if q is not None else sess.get("tema", "")
+    subtema = q.subtema if q is not None else sess.get("subtema", "")
 
-        teclado = [[InlineKeyboardButton("➡️ Próxima questão", callback_data="NEXTQ")]]
+    await record_answer(user_id, qid, acertou, marcada, tema, subtema)
+    invalidar_progresso(user_id)
 
-        await query.message.chat.send_message(
-            texto,
-            reply_markup=InlineKeyboardMarkup(teclado),
-            parse_mode="Markdown",
-        )
-        return
+    if context.chat_data.get("qid_atual") == qid:
+        # questão respondida: nada mais em aberto (e a sessão no fim da fila
+        # deixa de ser persistida, ver sessoes.py)
+        context.chat_data.pop("correta_exibida", None)
+        context.chat_data.pop("qid_atual", None)
+        context.chat_data.pop("perm_atual", None)
 
-    if data == "NEXTQ":
-        try:
-            await query.edit_message_reply_markup(reply_markup=None)
-        except Exception:
-            pass
-        await enviar_proxima(update, context)
-        return
+    remover_teclado(context, query)
 
+    # MarkdownV2: a explicação já vem escapada do cache de render do quiz
+    cab = "✅ *Correto\\!*" if acertou else f"❌ *Errado\\.* Correta: *{correta_exibida or correta_original or '—'}*"
+    texto = f"{cab}\n\n📘 *Explicação:*\n{explicacao_renderizada(qid, versao)}"
 
-def main():
-    init_db()
+    teclado = [[InlineKeyboardButton("➡️ Próxima questão", callback_data="NEXTQ")]]
+
+    await query.message.chat.send_message(
+        texto,
+        reply_markup=InlineKeyboardMarkup(teclado),
+        parse_mode="MarkdownV2",
+    )
 
-    app = (
+
+def build_application(token: str | None = None, request=None) -> Application:
+    """
+    Application com todos os handlers. request substitui a camada HTTP do bot
+    (o teste de carga usa uma que não fala com o Telegram); em ambos os casos
+    as chamadas à API passam pela medição de metricas.
+    """
+    builder = (
         Application.builder()
-        .token(TOKEN)
-        .post_init(setup_commands)
-        .build()
+        .token(token or TOKEN)
+        .request(metricas.RequestMedido(request or HTTPXRequest(connection_pool_size=256)))
+        .get_updates_request(metricas.RequestMedido(request or HTTPXRequest(connection_pool_size=1)))
+        .concurrent_updates(PorChatUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
     )
+    if envio.ENVIO_LIMITADOR:
+        builder = builder.rate_limiter(envio.AgendadorEnvio())
+    if SESSOES_PERSISTENTES:
+        builder = builder.persistence(SessaoPersistence())
+    app = builder.build()
+
+    comandos = {
+        "start": start, "revisar": revisar, "progresso": progresso,
+        "score": score, "zerar": zerar, "recarregar": recarregar,
+    }
+    for nome, fn in comandos.items():
+        app.add_handler(CommandHandler(nome, _instrumentado(nome, fn)))
+    app.add_handler(CallbackQueryHandler(_instrumentado("callback", callback_handler)))
+    return app
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("progresso", progresso))
-    app.add_handler(CommandHandler("score", score))
-    app.add_handler(CommandHandler("zerar", zerar))
-    app.add_handler(CallbackQueryHandler(callback_handler))
+
+def _instrumentado(nome: str, fn):
+    # métricas por handler + rastro de idas ao banco por update
+    return metricas.medir_handler(nome, rastreio.rastrear_handler(nome, fn))
+
+
+def main():
+    if not TOKEN:
+        raise RuntimeError("BOT_TOKEN não definido nas variáveis de ambiente.")
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL não definido nas variáveis de ambiente.")
+
+    get_storage().init_db()
+    app = build_application()
+    metricas.instalar_no_webhook()
 
     app.run_webhook(
         listen="0.0.0.0",
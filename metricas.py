@@ -0,0 +1,280 @@
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+from telegram.request import BaseRequest
+
+# ==========================================================
+# Métricas no formato texto do Prometheus (sem dependência extra)
+#   - latência/erros por handler e por tipo de callback (RESP, NEXTQ, TEMA...)
+#   - latência/erros por comando SQL (op + verbo + tabela), medidos em db_turso
+#   - latência/erros das chamadas à API do Telegram, por método
+# Servidas em METRICS_PATH no mesmo servidor do webhook (run_webhook, só nas
+# versões do PTB conferidas, ver instalar_no_webhook) e, se METRICS_PORT
+# estiver definido, também numa porta própria.
+# ==========================================================
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger(__name__)
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(nomes: tuple, valores: tuple, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class Contador:
+    def __init__(self, nome: str, ajuda: str, labels: tuple = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, n: float = 1.0):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0.0) + n
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            itens = sorted(self._valores.items())
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        linhas += [f"{self.nome}{_labels(self.labels, k)} {v:g}" for k, v in itens]
+        return linhas
+
+
+class Histograma:
+    def __init__(self, nome: str, ajuda: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # valores dos labels -> [contagens por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, segundos: float, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * len(self.buckets) + [0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += segundos
+            serie[-1] += 1
+
+    def exportar(self) -> list[str]:
+        with self._lock:
+            itens = sorted((k, list(v)) for k, v in self._series.items())
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        for k, serie in itens:
+            acumulado = 0
+            for limite, n in zip(self.buckets, serie):
+                acumulado += n
+                le = 'le="%g"' % limite
+                linhas.append(f"{self.nome}_bucket{_labels(self.labels, k, le)} {acumulado}")
+            le = 'le="+Inf"'
+            linhas.append(f"{self.nome}_bucket{_labels(self.labels, k, le)} {serie[-1]}")
+            linhas.append(f"{self.nome}_sum{_labels(self.labels, k)} {serie[-2]:.6f}")
+            linhas.append(f"{self.nome}_count{_labels(self.labels, k)} {serie[-1]}")
+        return linhas
+
+
+HANDLER_SEGUNDOS = Histograma("chobot_handler_seconds", "Tempo por handler.", ("handler",))
+HANDLER_ERROS = Contador("chobot_handler_errors_total", "Exceções por handler.", ("handler",))
+CALLBACK_SEGUNDOS = Histograma("chobot_callback_seconds", "Tempo por tipo de callback.", ("tipo",))
+DB_SEGUNDOS = Histograma("chobot_db_seconds", "Tempo por comando SQL.", ("op", "stmt"))
+DB_ERROS = Contador("chobot_db_errors_total", "Falhas por comando SQL.", ("op", "stmt"))
+TELEGRAM_SEGUNDOS = Histograma("chobot_telegram_api_seconds", "Tempo por método da API do Telegram.", ("metodo",))
+TELEGRAM_ERROS = Contador("chobot_telegram_api_errors_total", "Falhas por método da API do Telegram.", ("metodo",))
+
+_METRICAS = [
+    HANDLER_SEGUNDOS, HANDLER_ERROS, CALLBACK_SEGUNDOS, DB_SEGUNDOS, DB_ERROS, TELEGRAM_SEGUNDOS, TELEGRAM_ERROS
+]
+
+
+def adicionar(*metricas):
+    """
+    Inclui métricas de outros módulos na exportação.
+    """
+    _METRICAS.extend(metricas)
+
+
+def exportar() -> str:
+    linhas = []
+    for m in _METRICAS:
+        linhas += m.exportar()
+    return "\n".join(linhas) + "\n"
+
+
+# ==========================================================
+# Rótulo de um comando SQL: verbo + tabela ("SELECT user_qid_status")
+# ==========================================================
+_RE_TABELA = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|ON)\s+([A-Za-z_][A-Za-z0-9_]*)", re.I)
+_ROTULOS_SQL = {}
+
+
+def rotulo_sql(sql: str) -> str:
+    rotulo = _ROTULOS_SQL.get(sql)
+    if rotulo is None:
+        texto = sql.strip()
+        verbo = texto.split(None, 1)[0].upper() if texto else "?"
+        m = _RE_TABELA.search(texto)
+        rotulo = f"{verbo} {m.group(1)}" if m else verbo
+        if len(_ROTULOS_SQL) < 10000:
+            _ROTULOS_SQL[sql] = rotulo
+    return rotulo
+
+
+# ==========================================================
+# Handlers
+# ==========================================================
+def medir_handler(nome: str, fn):
+    """
+    Envolve um callback do PTB medindo tempo e exceções. No callback_handler
+    mede também por tipo (prefixo do callback_data: RESP, NEXTQ, TEMA, ...).
+    """
+
+    @functools.wraps(fn)
+    async def medido(update, context):
+        t0 = time.perf_counter()
+        try:
+            return await fn(update, context)
+        except Exception:
+            HANDLER_ERROS.inc(nome)
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            HANDLER_SEGUNDOS.observe(dt, nome)
+            query = getattr(update, "callback_query", None)
+            if query is not None and query.data:
+                CALLBACK_SEGUNDOS.observe(dt, query.data.split("|", 1)[0])
+
+    return medido
+
+
+# ==========================================================
+# API do Telegram: envolve a camada HTTP do bot
+# ==========================================================
+class RequestMedido(BaseRequest):
+    def __init__(self, interno: BaseRequest):
+        self._interno = interno
+
+    @property
+    def read_timeout(self):
+        return self._interno.read_timeout
+
+    async def initialize(self):
+        await self._interno.initialize()
+
+    async def shutdown(self):
+        await self._interno.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        metodo = url.rsplit("/", 1)[-1]
+        t0 = time.perf_counter()
+        try:
+            codigo, corpo = await self._interno.do_request(
+                url, method, request_data,
+                read_timeout=read_timeout, write_timeout=write_timeout,
+                connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+        except Exception:
+            TELEGRAM_ERROS.inc(metodo)
+            raise
+        finally:
+            TELEGRAM_SEGUNDOS.observe(time.perf_counter() - t0, metodo)
+        if codigo >= 400:
+            TELEGRAM_ERROS.inc(metodo)
+        return codigo, corpo
+
+
+# ==========================================================
+# Endpoint HTTP
+# ==========================================================
+def _handler_tornado():
+    import tornado.web
+
+    class MetricasHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(exportar())
+
+    return MetricasHandler
+
+
+# versões principais do PTB em que a troca de WebhookAppClass foi conferida
+_PTB_WEBHOOK_TESTADO = ((20,),)
+
+
+def instalar_no_webhook(path: str = METRICS_PATH) -> bool:
+    """
+    Acrescenta `path` ao app tornado que o run_webhook sobe. O PTB não expõe
+    um ponto de extensão para isso, então trocamos a classe do app no módulo
+    do Updater, que é interno: só nas versões de _PTB_WEBHOOK_TESTADO e só se
+    o ponto de troca estiver lá. Fora disso avisa e segue sem o path (as
+    métricas continuam em METRICS_PORT, se definido).
+    """
+    if not path:
+        return False
+    import telegram
+
+    if tuple(telegram.__version_info__[:1]) not in _PTB_WEBHOOK_TESTADO:
+        log.warning(
+            "metricas: PTB %s não testado para servir %s no webhook; use METRICS_PORT",
+            telegram.__version__, path,
+        )
+        return False
+    try:
+        from telegram.ext import _updater
+        from telegram.ext._utils.webhookhandler import WebhookAppClass
+    except ImportError:
+        log.warning("metricas: webhook do PTB sem WebhookAppClass; use METRICS_PORT")
+        return False
+    atual = getattr(_updater, "WebhookAppClass", None)
+    if getattr(atual, "_com_metricas", False):
+        return True
+    if atual is not WebhookAppClass:
+        log.warning("metricas: telegram.ext._updater.WebhookAppClass ausente ou já trocado; use METRICS_PORT")
+        return False
+
+    handler = _handler_tornado()
+    rota = path if path.startswith("/") else "/" + path
+
+    class WebhookComMetricas(WebhookAppClass):
+        _com_metricas = True
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.add_handlers(r".*", [(re.escape(rota), handler)])
+
+    _updater.WebhookAppClass = WebhookComMetricas
+    return True
+
+
+def iniciar_servidor(porta: int = METRICS_PORT, path: str = METRICS_PATH):
+    """
+    Servidor só de métricas (precisa do loop rodando). porta <= 0 não sobe nada.
+    """
+    if porta <= 0:
+        return None
+    import tornado.web
+
+    rota = (path or "/metrics") if (path or "/metrics").startswith("/") else "/" + path
+    app = tornado.web.Application([(re.escape(rota), _handler_tornado())])
+    return app.listen(porta)
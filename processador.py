@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# ==========================================================
+# Processamento concorrente de updates, em ordem dentro de cada chat
+# Chats diferentes andam em paralelo (até UPDATES_CONCORRENTES updates em
+# voo); updates do mesmo chat (ex.: botão de resposta tocado duas vezes)
+# passam um de cada vez e na ordem de chegada, então chat_data["quiz"] nunca
+# é mexido por dois handlers ao mesmo tempo. O lock do chat vem antes da vaga
+# global: updates à espera do próprio chat não ocupam vaga, então um chat
+# tocando sem parar não segura o limite dos outros.
+# ==========================================================
+UPDATES_CONCORRENTES = max(1, int(os.getenv("UPDATES_CONCORRENTES", "64")))
+
+
+class PorChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = UPDATES_CONCORRENTES):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # chave do chat -> [asyncio.Lock, updates usando/esperando]
+
+    @staticmethod
+    def _chave(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return ("chat", update.effective_chat.id)
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+        return None
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # o BaseUpdateProcessor pega a vaga (semáforo) e só então chama
+        # do_process_update; aqui o lock do chat é pego antes disso
+        chave = self._chave(update)
+        if chave is None:
+            await super().process_update(update, coroutine)
+            return
+
+        item = self._locks.get(chave)
+        if item is None:
+            item = self._locks[chave] = [asyncio.Lock(), 0]
+        item[1] += 1
+        try:
+            # asyncio.Lock acorda quem espera em ordem de chegada
+            async with item[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            item[1] -= 1
+            if item[1] == 0:
+                del self._locks[chave]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def chats_ativos(self) -> int:
+        return len(self._locks)
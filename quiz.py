@@ -1,84 +1,124 @@
-import re
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import logging
+import os
 import random
-import pandas as pd
+import time
+from array import array
+from collections import OrderedDict
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.helpers import escape_markdown
 
-# ✅ TROCA: agora vem do Turso (persistente)
-from db_turso import get_question_status_map, get_last_perm_for_user_question, record_sent_question
-
-
-# --- carga e normalização ---
-df = pd.read_excel("perguntascho2026.xlsx")
-df.columns = df.columns.str.strip()
-
-if "ID" not in df.columns:
-    raise RuntimeError("Coluna 'ID' não encontrada no Excel.")
-
-df["ID"] = df["ID"].astype(str).str.strip()
-df["Tema"] = df["Tema"].astype(str).str.strip()
-df["Subtema"] = df["Subtema"].astype(str).str.strip()
-
-QUESTIONS_BY_ID = {str(r["ID"]): r.dropna().to_dict() for _, r in df.iterrows()}
-
-# precomputações
-TEMAS = sorted(df["Tema"].dropna().unique().tolist())
-TEMA_TO_QIDS = {
-    tema: df[df["Tema"] == tema]["ID"].astype(str).str.strip().tolist()
-    for tema in TEMAS
-}
-TEMA_TO_SUBTEMAS = {
-    tema: sorted(df[df["Tema"] == tema]["Subtema"].dropna().unique().tolist())
-    for tema in TEMAS
-}
-SUBTEMA_TO_QIDS = {}
-for tema in TEMAS:
-    for sub in TEMA_TO_SUBTEMAS[tema]:
-        SUBTEMA_TO_QIDS[(tema, sub)] = (
-            df[(df["Tema"] == tema) & (df["Subtema"] == sub)]["ID"].astype(str).str.strip().tolist()
-        )
+import banco
+import revisao
 
+# ✅ TROCA: agora vem do Turso (persistente), via variante assíncrona
+from db_async import (
+    get_question_status_map,
+    get_review_queue,
+    get_last_perm_for_user_question,
+    get_last_perms_for_user_questions,
+    record_sent_question,
+)
 
-def _extract_letter(value) -> str:
-    s = str(value).strip().upper()
-    m = re.search(r"\b([ABCD])\b", s)
-    return m.group(1) if m else ""
 
+log = logging.getLogger(__name__)
 
-def get_question_by_id(qid: str) -> dict | None:
-    qid = str(qid).strip()
-    return QUESTIONS_BY_ID.get(qid)
+# ==========================================================
+# Banco de questões versionado (recarga sem reiniciar o bot)
+# _BANCO é o snapshot atual (questões + índices) e é trocado inteiro, numa
+# atribuição só, pelo loop de eventos: um handler lê _BANCO uma vez e nunca vê
+# índices pela metade. Cada sessão guarda a versão com que começou e continua
+# nela enquanto a versão estiver entre as BANCO_VERSOES_MAX mais recentes.
+# ==========================================================
+BANCO_VERSOES_MAX = max(1, int(os.getenv("BANCO_VERSOES_MAX", "3")))
+BANCO_WATCH_INTERVAL = float(os.getenv("BANCO_WATCH_INTERVAL", "0"))  # segundos; 0 = sem vigia
 
+# --- carga (artefato compilado; planilha só se o artefato estiver desatualizado) ---
+_BANCO = banco.carregar()
+_VERSOES = OrderedDict([(_BANCO.versao, _BANCO)])
+_FONTES = banco.assinatura_fontes()
+_RECARGA_LOCK = asyncio.Lock()
+_VIGIA = None
 
-def get_correct_and_explanation(qid: str) -> tuple[str, str]:
-    q = get_question_by_id(qid)
-    if not q:
-        return "", ""
-    correta = _extract_letter(q.get("Resposta Correta", ""))
-    explicacao = str(q.get("Explicação", "") or "").strip()
-    return correta, explicacao
 
+def banco_atual() -> banco.Banco:
+    return _BANCO
 
-def _subset_status_map(user_id: str, qids: list[str]) -> dict:
+
+def _banco(versao: str | None = None) -> banco.Banco:
+    if versao:
+        b = _VERSOES.get(versao)
+        if b is not None:
+            return b
+    return _BANCO
+
+
+async def recarregar_banco() -> tuple[bool, banco.Banco]:
     """
-    get_question_status_map(user_id) retorna status global: {qid: True/False}
-    Aqui filtramos apenas as questões do tema/subtema.
+    Reconstrói o banco numa thread (recompilando o artefato se a planilha mudou)
+    e publica o snapshot novo. Retorna (mudou, banco_atual).
     """
-    all_map = get_question_status_map(str(user_id))
-    qset = set(str(x).strip() for x in qids)
-    return {qid: st for qid, st in all_map.items() if str(qid).strip() in qset}
+    global _BANCO, _FONTES
+    async with _RECARGA_LOCK:
+        novo = await asyncio.to_thread(banco.atualizar)
+        _FONTES = banco.assinatura_fontes()
+        if novo.versao == _BANCO.versao:
+            return False, _BANCO
+
+        _VERSOES[novo.versao] = novo
+        _VERSOES.move_to_end(novo.versao)
+        while len(_VERSOES) > BANCO_VERSOES_MAX:
+            _VERSOES.popitem(last=False)
+        anterior, _BANCO = _BANCO, novo
+        log.info(
+            "banco: versão %s -> %s (%d questões)", anterior.versao, novo.versao, len(novo.questions_by_id)
+        )
+        return True, novo
 
 
-def _count_acertos_erros(user_id: str, qids: list[str]) -> tuple[int, int]:
+async def _vigiar_banco(intervalo: float):
+    while True:
+        await asyncio.sleep(intervalo)
+        if banco.assinatura_fontes() == _FONTES:
+            continue
+        try:
+            await recarregar_banco()
+        except Exception:
+            # planilha no meio de uma cópia, por exemplo: tenta na próxima volta
+            log.exception("banco: falha ao recarregar; mantendo a versão %s", _BANCO.versao)
+
+
+def iniciar_vigia(intervalo: float = BANCO_WATCH_INTERVAL):
     """
-    Retorna (acertos, erros) no conjunto de qids, considerando:
-      - True  => acertou ao menos uma vez
-      - False => errou e nunca acertou
-      - ausente => não respondida
+    Liga o vigia de arquivo (precisa de um loop rodando). intervalo <= 0 desliga.
     """
-    sub = _subset_status_map(user_id, qids)
-    acertos = sum(1 for v in sub.values() if v is True)
-    erros = sum(1 for v in sub.values() if v is False)
-    return acertos, erros
+    global _VIGIA
+    if intervalo > 0 and _VIGIA is None:
+        _VIGIA = asyncio.get_running_loop().create_task(_vigiar_banco(intervalo))
+
+
+def parar_vigia():
+    global _VIGIA
+    if _VIGIA is not None:
+        _VIGIA.cancel()
+        _VIGIA = None
+
+
+def get_question_by_id(qid: str, versao: str | None = None) -> banco.Question | None:
+    qid = str(qid).strip()
+    return _banco(versao).questions_by_id.get(qid)
+
+
+def get_correct_and_explanation(qid: str, versao: str | None = None) -> tuple[str, str]:
+    q = get_question_by_id(qid, versao)
+    if not q:
+        return "", ""
+    return q.correta, q.explicacao
 
 
 def _progress_icon(ok: int, total: int) -> str:
@@ -101,13 +141,97 @@ def _progress_icon(ok: int, total: int) -> str:
 # ==========================================================
 # 🔥 embaralhamento não repetido por usuário/questão
 # ==========================================================
-LETRAS = ["A", "B", "C", "D"]
+LETRAS = list(banco.LETRAS)
+
+# ==========================================================
+# 🔐 callback_data assinado (QUIZ_SIGNED_CALLBACKS=1)
+# A permutação exibida e a versão do banco de questões vão no próprio botão,
+# protegidas por HMAC, e a resposta é conferida sem ler a tabela sent, na
+# versão em que a questão foi mostrada (não na da sessão, que pode ter mudado
+# com /recarregar ou um quiz novo). Botão de uma versão que já saiu das
+# BANCO_VERSOES_MAX guardadas expira. O "não repetir perm" fica em memória.
+# ==========================================================
+SIGNED_CALLBACKS = os.getenv("QUIZ_SIGNED_CALLBACKS", "").strip().lower() in ("1", "true", "yes", "on")
+ULTIMAS_PERMS_MAX = max(1, int(os.getenv("ULTIMAS_PERMS_MAX", "100000")))
+CALLBACK_DATA_MAX = 64  # limite do Telegram, em bytes
+
+_PERMS = ["".join(p) for p in itertools.permutations(LETRAS)]  # 24 ordens possíveis
+_PERM_CODES = "abcdefghijklmnopqrstuvwx"
+_ULTIMAS_PERMS = OrderedDict()  # (user_id, qid) -> "B,A,D,C"
+_HMAC_KEY = None
+
 
-def _make_perm_no_repeat(user_id: str, qid: str) -> list[str]:
+def _hmac_key() -> bytes:
+    global _HMAC_KEY
+    if _HMAC_KEY is None:
+        segredo = os.getenv("CALLBACK_SECRET") or os.getenv("BOT_TOKEN")
+        if not segredo:
+            raise RuntimeError("CALLBACK_SECRET (ou BOT_TOKEN) não definido para assinar os botões.")
+        _HMAC_KEY = hashlib.sha256(b"quiz-callback|" + segredo.encode()).digest()
+    return _HMAC_KEY
+
+
+def _assinatura(user_id: str, qid: str, code: str, versao: str) -> str:
+    mac = hmac.new(_hmac_key(), f"{user_id}|{qid}|{code}|{versao}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac[:9]).decode()  # 12 caracteres
+
+
+def _callbacks_assinados(user_id: str, qid: str, perm: list[str], versao: str) -> list[str] | None:
+    """
+    callback_data "R|qid|letra|perm|versão|assinatura" para cada botão; None se não couber em 64 bytes.
+    """
+    code = _PERM_CODES[_PERMS.index("".join(perm))]
+    sig = _assinatura(user_id, qid, code, versao)
+    dados = [f"R|{qid}|{letra}|{code}|{versao}|{sig}" for letra in LETRAS]
+    if any(len(d.encode()) > CALLBACK_DATA_MAX for d in dados):
+        return None
+    return dados
+
+
+def verificar_resposta_assinada(data: str, user_id: str) -> tuple[str, str, str, str] | None:
+    """
+    Confere um callback "R|..." e devolve (qid, marcada, correta_exibida, versão),
+    ou None se a assinatura não bater (adulterado, de outro usuário ou segredo
+    trocado) ou se a versão do banco em que foi mostrado já não está guardada.
+    """
+    try:
+        _, qid, marcada, code, versao, sig = data.split("|")
+    except ValueError:
+        return None
+    if marcada not in LETRAS or len(code) != 1 or code not in _PERM_CODES:
+        return None
+    if not hmac.compare_digest(sig, _assinatura(str(user_id), qid, code, versao)):
+        return None
+    if versao not in _VERSOES:
+        return None
+
+    q = get_question_by_id(qid, versao)
+    perm = _PERMS[_PERM_CODES.index(code)]
+    correta_exibida = ""
+    if q is not None and q.correta:
+        correta_exibida = LETRAS[perm.index(q.correta)]
+    return qid, marcada, correta_exibida, versao
+
+
+def _lembrar_perm(user_id: str, qid: str, perm: str):
+    chave = (user_id, qid)
+    _ULTIMAS_PERMS[chave] = perm
+    _ULTIMAS_PERMS.move_to_end(chave)
+    while len(_ULTIMAS_PERMS) > ULTIMAS_PERMS_MAX:
+        _ULTIMAS_PERMS.popitem(last=False)
+
+
+async def _make_perm_no_repeat(user_id: str, qid: str, last_perms: dict | None = None) -> list[str]:
     """
     Gera perm (ordem de letras originais) evitando repetir a última perm desse user/qid.
+    last_perms: últimas perms já buscadas no início da sessão (sem ida ao banco).
     """
-    last_perm = get_last_perm_for_user_question(str(user_id), str(qid).strip())
+    if SIGNED_CALLBACKS:
+        last_perm = _ULTIMAS_PERMS.get((str(user_id), str(qid).strip()), "")
+    elif last_perms is not None:
+        last_perm = last_perms.get(str(qid).strip(), "")
+    else:
+        last_perm = await get_last_perm_for_user_question(str(user_id), str(qid).strip())
     last = [p.strip().upper() for p in last_perm.split(",")] if last_perm else []
 
     base = LETRAS[:]  # ["A","B","C","D"]
@@ -123,19 +247,14 @@ def _make_perm_no_repeat(user_id: str, qid: str) -> list[str]:
     return cand
 
 
-def _apply_perm(q: dict, perm: list[str], correta_original: str):
+def _apply_perm(q: banco.Question, perm: list[str], correta_original: str):
     """
     perm: lista de letras ORIGINAIS na ordem exibida A,B,C,D
     retorna:
       alternativas_exibidas: dict {"A":texto, ...}
       correta_exibida: "A"/"B"/"C"/"D"
     """
-    orig_to_text = {
-        "A": q.get("Opção A", ""),
-        "B": q.get("Opção B", ""),
-        "C": q.get("Opção C", ""),
-        "D": q.get("Opção D", ""),
-    }
+    orig_to_text = dict(zip(LETRAS, q.opcoes))
 
     exibidas = {}
     correta_exibida = ""
@@ -151,47 +270,155 @@ def _apply_perm(q: dict, perm: list[str], correta_original: str):
 
 # =========================
 # UI: temas / subtemas
+# O esqueleto dos menus (rótulos, callback_data, totais e em que tema/subtema
+# cai cada qid) é montado uma vez por versão do banco. Por usuário, os acertos
+# de todos os temas e subtemas saem de uma passada só no mapa de status e
+# ficam memorizados, junto com os teclados já montados, até ele responder
+# (ou zerar) — ver invalidar_progresso — ou por no máximo MENU_CACHE_TTL
+# segundos, para absorver escritas de outros workers.
 # =========================
-async def enviar_temas(update, context):
-    user_id = str(update.effective_user.id)
-
-    keyboard = []
-    for tema in TEMAS:
-        qids = TEMA_TO_QIDS.get(tema, [])
-        total = len(qids)
+MENU_CACHE_USUARIOS = max(0, int(os.getenv("MENU_CACHE_USUARIOS", "20000")))
+MENU_CACHE_TTL = float(os.getenv("MENU_CACHE_TTL", "60"))
+
+
+def _incluir(indice: dict, qid: str, pos: int):
+    atual = indice.get(qid, ())
+    if pos not in atual:
+        indice[qid] = atual + (pos,)
+
+
+class _Esqueleto:
+    __slots__ = ("temas", "subtemas", "tema_de", "sub_de", "n_subtemas")
+
+    def __init__(self, b: banco.Banco):
+        self.temas = []      # [(prefixo do rótulo, total, callback_data)]
+        self.subtemas = {}   # tema -> [(prefixo do rótulo, total, callback_data, índice)]
+        # qid -> índices do tema / dos subtemas (entre todos os temas); em geral
+        # um só, mas a planilha tem qids repetidos ("nan") em mais de um lugar
+        self.tema_de = {}
+        self.sub_de = {}
+        n = 0
+        for i, tema in enumerate(b.temas):
+            qids = b.tema_to_qids.get(tema, [])
+            self.temas.append((f"{tema}  |  ", len(qids), f"TEMA|{tema}"))
+            for qid in qids:
+                _incluir(self.tema_de, qid, i)
+            subs = []
+            for s in b.tema_to_subtemas.get(tema, []):
+                qids = b.subtema_to_qids.get((tema, s), [])
+                subs.append((f"{s}  |  ", len(qids), f"SUB|{s}", n))
+                for qid in qids:
+                    _incluir(self.sub_de, qid, n)
+                n += 1
+            self.subtemas[tema] = subs
+        self.n_subtemas = n
+
+    def acertos(self, status: dict) -> tuple[list[int], list[int]]:
+        """
+        (acertos por tema, acertos por subtema) numa passada pelo mapa de status.
+        """
+        por_tema = [0] * len(self.temas)
+        por_sub = [0] * self.n_subtemas
+        tema_de, sub_de = self.tema_de, self.sub_de
+        for qid, st in status.items():
+            if st is not True:
+                continue
+            for i in tema_de.get(qid, ()):
+                por_tema[i] += 1
+            for j in sub_de.get(qid, ()):
+                por_sub[j] += 1
+        return por_tema, por_sub
+
+
+_ESQUELETOS = {}  # versão do banco -> _Esqueleto
+_PROGRESSO = OrderedDict()  # user_id -> (versão, acertos por tema, por subtema, {tema|None: teclado}, expira_em)
+_GERACOES = {}  # user_id -> [geração, leituras de status em voo]; só enquanto há leitura
+
+
+def _esqueleto(b: banco.Banco) -> _Esqueleto:
+    esq = _ESQUELETOS.get(b.versao)
+    if esq is None:
+        for versao in [v for v in _ESQUELETOS if v not in _VERSOES]:
+            del _ESQUELETOS[versao]
+        esq = _ESQUELETOS[b.versao] = _Esqueleto(b)
+    return esq
+
+
+def invalidar_progresso(user_id: str):
+    """
+    Descarta os menus memorizados do usuário (chamar depois de gravar resposta ou zerar).
+    """
+    user_id = str(user_id)
+    item = _GERACOES.get(user_id)
+    if item is not None:
+        item[0] += 1
+    _PROGRESSO.pop(user_id, None)
+
+
+async def _progresso_menu(user_id: str, b: banco.Banco) -> tuple:
+    memo = _PROGRESSO.get(user_id)
+    if memo is not None and memo[0] == b.versao and memo[4] > time.monotonic():
+        _PROGRESSO.move_to_end(user_id)
+        return memo
+
+    item = _GERACOES.get(user_id)
+    if item is None:
+        item = _GERACOES[user_id] = [0, 0]
+    geracao = item[0]
+    item[1] += 1
+    try:
+        status = await get_question_status_map(user_id)
+    finally:
+        item[1] -= 1
+        if item[1] == 0:
+            del _GERACOES[user_id]
+    memo = (b.versao, *_esqueleto(b).acertos(status), {}, time.monotonic() + MENU_CACHE_TTL)
+    # se o usuário gravou resposta enquanto o status era lido, não memoriza
+    if MENU_CACHE_USUARIOS and MENU_CACHE_TTL > 0 and geracao == item[0]:
+        _PROGRESSO[user_id] = memo
+        while len(_PROGRESSO) > MENU_CACHE_USUARIOS:
+            _PROGRESSO.popitem(last=False)
+    return memo
 
-        acertos, _erros = _count_acertos_erros(user_id, qids)
-        icon = _progress_icon(acertos, total)
 
-        label = f"{tema}  |  {icon} {acertos}/{total}"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"TEMA|{tema}")])
+async def enviar_temas(update, context):
+    user_id = str(update.effective_user.id)
+    b = _BANCO
+    memo = await _progresso_menu(user_id, b)
+
+    teclado = memo[3].get(None)
+    if teclado is None:
+        linhas = []
+        for (prefixo, total, cb), acertos in zip(_esqueleto(b).temas, memo[1]):
+            label = f"{prefixo}{_progress_icon(acertos, total)} {acertos}/{total}"
+            linhas.append([InlineKeyboardButton(label, callback_data=cb)])
+        linhas.append([InlineKeyboardButton("🔁 Revisão (questões vencidas)", callback_data="REV")])
+        teclado = memo[3][None] = InlineKeyboardMarkup(linhas)
 
     await update.message.reply_text(
         "📚 *Escolha o TEMA:*",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=teclado,
         parse_mode="Markdown"
     )
 
 
 async def enviar_subtemas(update, context, tema: str):
     user_id = str(update.effective_user.id)
-
-    subtemas = TEMA_TO_SUBTEMAS.get(tema, [])
-    keyboard = []
-
-    for s in subtemas:
-        qids = SUBTEMA_TO_QIDS.get((tema, s), [])
-        total = len(qids)
-
-        acertos, _erros = _count_acertos_erros(user_id, qids)
-        icon = _progress_icon(acertos, total)
-
-        label = f"{s}  |  {icon} {acertos}/{total}"
-        keyboard.append([InlineKeyboardButton(label, callback_data=f"SUB|{s}")])
+    b = _BANCO
+    memo = await _progresso_menu(user_id, b)
+
+    teclado = memo[3].get(tema)
+    if teclado is None:
+        linhas = []
+        for prefixo, total, cb, i in _esqueleto(b).subtemas.get(tema, []):
+            acertos = memo[2][i]
+            label = f"{prefixo}{_progress_icon(acertos, total)} {acertos}/{total}"
+            linhas.append([InlineKeyboardButton(label, callback_data=cb)])
+        teclado = memo[3][tema] = InlineKeyboardMarkup(linhas)
 
     await update.callback_query.edit_message_text(
         f"📘 *Tema:* {tema}\n\n📂 Escolha o *SUBTEMA:*",
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=teclado,
         parse_mode="Markdown"
     )
 
@@ -199,112 +426,227 @@ async def enviar_subtemas(update, context, tema: str):
 # =========================
 # montar fila com prioridade
 # =========================
+# Embaralhador da fila. QUIZ_SEED fixa a semente (testes/benchmarks reproduzíveis).
+_RNG = random.Random(int(os.environ["QUIZ_SEED"]) if os.getenv("QUIZ_SEED") else None)
+
+
+def montar_fila(qids: tuple, status: dict, limite: int, rng: random.Random | None = None) -> list[str]:
+    """
+    Fila 'não respondidas → erradas → restantes', embaralhada dentro de cada grupo.
+    Uma passada sobre os qids do subtema separa as posições em três arrays de
+    inteiros; cada grupo só é sorteado até completar o limite.
+    """
+    rng = rng or _RNG
+    grupos = (array("I"), array("I"), array("I"))  # não respondidas, erradas, acertadas
+    for pos, qid in enumerate(qids):
+        st = status.get(qid)
+        grupos[0 if st is None else (1 if st is False else 2)].append(pos)
+
+    fila = []
+    for grupo in grupos:
+        faltam = limite - len(fila)
+        if faltam <= 0:
+            break
+        if len(grupo) <= faltam:
+            escolhidas = list(grupo)
+            rng.shuffle(escolhidas)
+        else:
+            escolhidas = rng.sample(grupo, faltam)
+        fila.extend(qids[p] for p in escolhidas)
+    return fila
+
+
 async def iniciar_quiz(update, context, user_id: str, tema: str, subtema: str, limite: int = 20):
-    base = df[
-        (df["Tema"] == str(tema).strip()) &
-        (df["Subtema"] == str(subtema).strip())
-    ].copy()
+    b = _BANCO
+    qids = b.subtema_to_qids.get((str(tema).strip(), str(subtema).strip()), [])
 
-    if base.empty:
+    if not qids:
         await update.effective_chat.send_message("⚠️ Sem questões para esse Tema/Subtema.")
         return
 
-    base["ID"] = base["ID"].astype(str).str.strip()
-    qids = base["ID"].tolist()
+    all_status = await get_question_status_map(str(user_id))
 
-    all_status = get_question_status_map(str(user_id))
+    # a sessão guarda só os qids (as questões ficam no banco compartilhado)
+    fila = montar_fila(qids, all_status, limite)
 
-    nao_resp, erradas, acertadas = [], [], []
-    for qid in qids:
-        st = all_status.get(str(qid).strip())
-        if st is None:
-            nao_resp.append(qid)
-        elif st is False:
-            erradas.append(qid)
-        else:
-            acertadas.append(qid)
+    await _comecar_sessao(
+        update, context, user_id, tema, subtema, fila, b,
+        f"🎯 *Quiz iniciado*\n📘 Tema: *{tema}*\n📂 Subtema: *{subtema}*\n\nPrioridade: *não respondidas → erradas → restantes*",
+    )
 
-    nao_resp = base[base["ID"].isin(nao_resp)].sample(frac=1).to_dict("records")
-    erradas = base[base["ID"].isin(erradas)].sample(frac=1).to_dict("records")
-    acertadas = base[base["ID"].isin(acertadas)].sample(frac=1).to_dict("records")
 
-    fila = (nao_resp + erradas + acertadas)[:limite]
+def _falta(segundos: float) -> str:
+    if segundos < 3600:
+        return f"{max(1, int(segundos // 60))} min"
+    if segundos < 2 * revisao.DIA:
+        return f"{int(segundos // 3600)} h"
+    return f"{int(segundos // revisao.DIA)} dias"
 
-    fila_clean = []
-    for item in fila:
-        item["ID"] = str(item.get("ID", "")).strip()
-        fila_clean.append(item)
 
+async def iniciar_revisao(update, context, user_id: str, limite: int = 20):
+    """
+    Modo revisão: as questões vencidas na agenda SM-2 do usuário (revisao.py),
+    de todos os temas, das mais atrasadas para as mais recentes.
+    """
+    b = _BANCO
+    agenda = await get_review_queue(str(user_id), limite)
+    agora = revisao.agora()
+    # questões que saíram do banco ficam de fora (a sessão sai um pouco menor)
+    fila = [qid for qid, vence_em in agenda if vence_em <= agora and qid in b.questions_by_id]
+
+    if not fila:
+        if agenda:
+            texto = f"🔁 Nada para revisar agora. Próxima revisão em *{_falta(agenda[0][1] - agora)}*."
+        else:
+            texto = "🔁 Nada para revisar ainda: responda algumas questões primeiro (/start)."
+        await update.effective_chat.send_message(texto, parse_mode="Markdown")
+        return
+
+    # tema/subtema vazios: cada resposta vai para o tema/subtema da própria questão
+    await _comecar_sessao(
+        update, context, user_id, "", "", fila, b,
+        f"🔁 *Revisão*\n{len(fila)} questões vencidas, das mais atrasadas para as mais recentes",
+    )
+
+
+async def _comecar_sessao(update, context, user_id: str, tema: str, subtema: str, fila: list, b, cabecalho: str):
     context.chat_data["quiz"] = {
         "user_id": str(user_id),
         "tema": tema,
         "subtema": subtema,
-        "perguntas": fila_clean,
-        "index": 0
+        "qids": fila,
+        "index": 0,
+        "versao": b.versao,  # a sessão segue no snapshot em que começou
     }
 
-    await update.effective_chat.send_message(
-        f"🎯 *Quiz iniciado*\n📘 Tema: *{tema}*\n📂 Subtema: *{subtema}*\n\nPrioridade: *não respondidas → erradas → restantes*",
-        parse_mode="Markdown"
-    )
+    if not SIGNED_CALLBACKS:
+        # uma consulta só para as últimas perms de toda a fila
+        context.chat_data["quiz"]["last_perms"] = await get_last_perms_for_user_questions(str(user_id), fila)
+
+    await update.effective_chat.send_message(cabecalho, parse_mode="Markdown")
 
     await enviar_proxima(update, context)
 
 
+# =========================
+# mensagens de questão pré-renderizadas
+# Texto (escapado para MarkdownV2 aqui, uma vez), teclado e letra correta
+# exibida de cada (qid, perm, versão) são montados no primeiro envio e depois
+# só consultados: cada questão tem no máximo 24 perms. A explicação mostrada
+# na resposta entra no mesmo cache, com perm None.
+# =========================
+RENDER_CACHE_MAX = max(0, int(os.getenv("RENDER_CACHE_MAX", "50000")))
+_RENDER = OrderedDict()  # (qid, perm, versão) -> (texto, teclado, correta_exibida) | explicação
+
+
+def md(texto) -> str:
+    return escape_markdown(str(texto), version=2)
+
+
+def _cache_render(chave: tuple, montar):
+    r = _RENDER.get(chave)
+    if r is not None:
+        _RENDER.move_to_end(chave)
+        return r
+    r = montar()
+    if RENDER_CACHE_MAX:
+        _RENDER[chave] = r
+        while len(_RENDER) > RENDER_CACHE_MAX:
+            _RENDER.popitem(last=False)
+    return r
+
+
+def _renderizar_questao(q: banco.Question, perm: str, versao: str) -> tuple:
+    """
+    (texto MarkdownV2, teclado RESP|..., correta_exibida) para a perm "B,A,D,C".
+    """
+
+    def montar():
+        exibidas, correta_exibida = _apply_perm(q, perm.split(","), q.correta)
+        texto = (
+            f"📘 *Tema:* {md(q.tema)}\n"
+            f"📂 *Subtema:* {md(q.subtema)}\n\n"
+            f"*{md(q.pergunta)}*\n\n"
+            + "\n".join(f"{letra}\\) {md(exibidas.get(letra, ''))}" for letra in LETRAS)
+        )
+        teclado = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(letra, callback_data=f"RESP|{q.qid}|{letra}") for letra in LETRAS]]
+        )
+        return texto, teclado, correta_exibida
+
+    return _cache_render((q.qid, perm, versao), montar)
+
+
+def explicacao_renderizada(qid: str, versao: str | None = None) -> str:
+    """
+    Explicação da questão já escapada para MarkdownV2 ("—" se não houver).
+    """
+    b = _banco(versao)
+    q = b.questions_by_id.get(str(qid).strip())
+    if q is None or not q.explicacao:
+        return "—"
+    return _cache_render((q.qid, None, b.versao), lambda: md(q.explicacao))
+
+
 # =========================
 # enviar próxima
 # =========================
 async def enviar_proxima(update, context):
     quiz = context.chat_data.get("quiz")
-    if not quiz or quiz["index"] >= len(quiz["perguntas"]):
+    if not quiz or quiz["index"] >= len(quiz["qids"]):
         await update.effective_chat.send_message("✅ Fim das questões desta sessão.")
         return
 
-    q = quiz["perguntas"][quiz["index"]]
+    qid = quiz["qids"][quiz["index"]]
     quiz["index"] += 1
 
-    qid = str(q.get("ID", "")).strip()
-    user_id = str(quiz.get("user_id") or "")
+    versao = quiz.get("versao")
+    q = get_question_by_id(qid, versao)
+    if q is None:
+        await enviar_proxima(update, context)
+        return
 
-    correta_original, _exp = get_correct_and_explanation(qid)
+    user_id = str(quiz.get("user_id") or "")
 
-    perm = _make_perm_no_repeat(user_id, qid)
-    alternativas_exibidas, correta_exibida = _apply_perm(q, perm, correta_original)
+    last_perms = quiz.get("last_perms")
+    perm = await _make_perm_no_repeat(user_id, qid, last_perms)
+    perm_txt = ",".join(perm)
+    versao = _banco(versao).versao
+    texto, teclado, correta_exibida = _renderizar_questao(q, perm_txt, versao)
 
     context.chat_data["correta_exibida"] = correta_exibida
     context.chat_data["qid_atual"] = qid
-    context.chat_data["perm_atual"] = ",".join(perm)
-
-    texto = (
-        f"📘 *Tema:* {quiz['tema']}\n"
-        f"📂 *Subtema:* {quiz['subtema']}\n\n"
-        f"*{q.get('Pergunta','')}*\n\n"
-        f"A) {alternativas_exibidas.get('A','')}\n"
-        f"B) {alternativas_exibidas.get('B','')}\n"
-        f"C) {alternativas_exibidas.get('C','')}\n"
-        f"D) {alternativas_exibidas.get('D','')}"
-    )
+    context.chat_data["perm_atual"] = perm_txt
 
-    teclado = [[
-        InlineKeyboardButton("A", callback_data=f"RESP|{qid}|A"),
-        InlineKeyboardButton("B", callback_data=f"RESP|{qid}|B"),
-        InlineKeyboardButton("C", callback_data=f"RESP|{qid}|C"),
-        InlineKeyboardButton("D", callback_data=f"RESP|{qid}|D"),
-    ]]
+    assinados = _callbacks_assinados(user_id, qid, perm, versao) if SIGNED_CALLBACKS else None
+    if assinados:
+        # o botão assinado depende do usuário: este teclado não vai para o cache
+        teclado = InlineKeyboardMarkup(
+            [[InlineKeyboardButton(letra, callback_data=d) for letra, d in zip(LETRAS, assinados)]]
+        )
 
     msg = await update.effective_chat.send_message(
         texto,
-        reply_markup=InlineKeyboardMarkup(teclado),
-        parse_mode="Markdown"
+        reply_markup=teclado,
+        parse_mode="MarkdownV2"
     )
 
+    if assinados:
+        # a resposta se confere pelo próprio botão; só guarda a perm para não repetir
+        _lembrar_perm(user_id, qid, perm_txt)
+        return
+
+    if last_perms is not None:
+        # se o qid reaparecer na sessão, evita repetir a perm que acabou de sair
+        last_perms[qid] = perm_txt
+
     try:
-        record_sent_question(
+        await record_sent_question(
             user_id=user_id,
             qid=qid,
             message_id=msg.message_id,
             correta_exibida=correta_exibida,
-            perm=",".join(perm)
+            perm=perm_txt
         )
     except Exception:
         pass
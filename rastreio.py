@@ -0,0 +1,119 @@
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+from metricas import Contador, Histograma, adicionar
+
+# ==========================================================
+# Rastreio por update: idas ao banco, linhas e tempo de banco de cada update
+#   DB_TRACE=1              loga o resumo de cada update
+#   DB_ROUNDTRIP_BUDGET=N   sinaliza (log + métrica) updates com mais de N idas
+#   DB_SLOW_QUERY_MS=M      loga consultas acima de M ms com parâmetros e
+#                           EXPLAIN QUERY PLAN (independe de DB_TRACE)
+# O rastro vive num ContextVar; db_async copia o contexto para as threads do
+# pool, então o que db_turso registra lá cai no rastro do update certo.
+# ==========================================================
+DB_TRACE = os.getenv("DB_TRACE", "").strip().lower() in ("1", "true", "yes", "on")
+DB_ROUNDTRIP_BUDGET = max(0, int(os.getenv("DB_ROUNDTRIP_BUDGET", "0")))
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+log = logging.getLogger(__name__)
+
+IDAS_POR_UPDATE = Histograma(
+    "chobot_db_roundtrips_per_update", "Idas ao banco por update.", ("handler",),
+    buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+ORCAMENTO_ESTOURADO = Contador(
+    "chobot_db_roundtrip_budget_exceeded_total", "Updates acima de DB_ROUNDTRIP_BUDGET.", ("handler",)
+)
+adicionar(IDAS_POR_UPDATE, ORCAMENTO_ESTOURADO)
+
+
+class Rastro:
+    __slots__ = ("nome", "idas", "linhas", "segundos_db", "inicio", "consultas", "_lock")
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.idas = 0
+        self.linhas = 0
+        self.segundos_db = 0.0
+        self.inicio = time.perf_counter()
+        self.consultas = []  # [(rotulo, ms)]
+        self._lock = threading.Lock()
+
+    def registrar(self, rotulo: str, segundos: float, linhas: int):
+        with self._lock:
+            self.idas += 1
+            self.linhas += linhas
+            self.segundos_db += segundos
+            self.consultas.append((rotulo, round(segundos * 1000, 2)))
+
+
+_ATUAL = contextvars.ContextVar("rastro_db", default=None)
+
+
+def ativo() -> bool:
+    return DB_TRACE or DB_ROUNDTRIP_BUDGET > 0
+
+
+def registrar(rotulo: str, segundos: float, linhas: int = 0):
+    """
+    Uma ida ao banco (execute ou commit). Chamado por db_turso.
+    """
+    rastro = _ATUAL.get()
+    if rastro is not None:
+        rastro.registrar(rotulo, segundos, linhas)
+
+
+def lenta(segundos: float) -> bool:
+    return DB_SLOW_QUERY_MS > 0 and segundos * 1000 >= DB_SLOW_QUERY_MS
+
+
+def logar_lenta(rotulo: str, sql: str, params: tuple, segundos: float, plano: str):
+    rastro = _ATUAL.get()
+    log.warning(
+        "consulta lenta (%.1fms) %s [update: %s]\n  sql: %s\n  params: %r\n  plano:\n%s",
+        segundos * 1000, rotulo, rastro.nome if rastro else "-", " ".join(sql.split()), params, plano,
+    )
+
+
+def _encerrar(rastro: Rastro):
+    total = time.perf_counter() - rastro.inicio
+    IDAS_POR_UPDATE.observe(rastro.idas, rastro.nome)
+    estourou = DB_ROUNDTRIP_BUDGET > 0 and rastro.idas > DB_ROUNDTRIP_BUDGET
+    if estourou:
+        ORCAMENTO_ESTOURADO.inc(rastro.nome)
+        log.warning(
+            "update %s acima do orçamento: %d idas ao banco (limite %d), %.1fms de banco; consultas: %s",
+            rastro.nome, rastro.idas, DB_ROUNDTRIP_BUDGET, rastro.segundos_db * 1000, rastro.consultas,
+        )
+    elif DB_TRACE:
+        log.info(
+            "update %s: %d idas, %d linhas, banco %.1fms de %.1fms",
+            rastro.nome, rastro.idas, rastro.linhas, rastro.segundos_db * 1000, total * 1000,
+        )
+
+
+def rastrear_handler(nome: str, fn):
+    """
+    Abre um rastro por chamada do handler (nome + tipo do callback, se houver).
+    """
+
+    @functools.wraps(fn)
+    async def rastreado(update, context):
+        if not ativo():
+            return await fn(update, context)
+        query = getattr(update, "callback_query", None)
+        rotulo = f"{nome}:{query.data.split('|', 1)[0]}" if query is not None and query.data else nome
+        rastro = Rastro(rotulo)
+        token = _ATUAL.set(rastro)
+        try:
+            return await fn(update, context)
+        finally:
+            _ATUAL.reset(token)
+            _encerrar(rastro)
+
+    return rastreado
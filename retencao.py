@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+
+import db_async
+
+# ==========================================================
+# Tarefa de retenção em segundo plano (ver db_turso: compactar_respostas /
+# podar_sent / podar_sessoes)
+# A cada RETENCAO_INTERVALO segundos compacta respostas, poda sent e apaga as
+# sessões largadas, um lote por vez no pool do banco, com RETENCAO_PAUSA
+# segundos entre lotes para as escritas dos handlers passarem na frente.
+# RETENCAO_INTERVALO=0 desliga; fora do bot: python db_turso.py compactar
+# ==========================================================
+RETENCAO_INTERVALO = float(os.getenv("RETENCAO_INTERVALO", str(6 * 3600)))
+RETENCAO_PAUSA = float(os.getenv("RETENCAO_PAUSA", "0.2"))
+RETENCAO_LOTE = max(1, int(os.getenv("RETENCAO_LOTE", "2000")))
+
+log = logging.getLogger(__name__)
+
+_TAREFA = None
+
+
+async def compactar(lote: int = RETENCAO_LOTE, pausa: float = RETENCAO_PAUSA) -> dict:
+    removidas = {"respostas": 0, "sent": 0, "sessoes": 0}
+    tarefas = (
+        ("respostas", db_async.compactar_respostas),
+        ("sent", db_async.podar_sent),
+        ("sessoes", db_async.podar_sessoes),
+    )
+    for tabela, tarefa in tarefas:
+        while True:
+            examinadas, n = await tarefa(lote)
+            removidas[tabela] += n
+            if not examinadas:
+                break
+            await asyncio.sleep(pausa)
+    return removidas
+
+
+async def _ciclo(intervalo: float):
+    while True:
+        try:
+            removidas = await compactar()
+            if any(removidas.values()):
+                log.info(
+                    "retenção: %d respostas resumidas, %d linhas de sent podadas, %d sessões largadas apagadas",
+                    removidas["respostas"], removidas["sent"], removidas["sessoes"],
+                )
+        except Exception:
+            # o cursor ficou no último lote gravado: a próxima volta continua dali
+            log.exception("retenção: falha; tentando de novo em %.0fs", intervalo)
+        await asyncio.sleep(intervalo)
+
+
+def iniciar(intervalo: float = RETENCAO_INTERVALO):
+    """
+    Liga a tarefa periódica (precisa de um loop rodando). intervalo <= 0 desliga.
+    """
+    global _TAREFA
+    if intervalo > 0 and _TAREFA is None:
+        _TAREFA = asyncio.get_running_loop().create_task(_ciclo(intervalo))
+
+
+def parar():
+    global _TAREFA
+    if _TAREFA is not None:
+        _TAREFA.cancel()
+        _TAREFA = None
@@ -0,0 +1,40 @@
+import time
+
+# ==========================================================
+# Repetição espaçada (SM-2) por usuário/questão
+# Cada resposta atualiza a facilidade (ease), o intervalo em dias e as
+# repetições certas seguidas; a questão volta a vencer em vence_em (epoch,
+# segundos). Acerto conta como qualidade 5 (ease +0.1) e erro como 2 (ease
+# -0.32, repetições zeradas, volta em 1 dia); intervalos 1, 6 e depois
+# intervalo x ease, até INTERVALO_MAX dias. db_turso faz a mesma conta em
+# SQL, no upsert da tabela revisao dentro da transação de record_answer:
+# mexeu aqui, mexa lá.
+# ==========================================================
+EASE_INICIAL = 2.5
+EASE_MIN = 1.3
+EASE_ACERTO = 0.1
+EASE_ERRO = -0.32
+INTERVALO_MAX = 365.0  # dias
+DIA = 86400
+
+
+def proximo(estado: tuple | None, acertou: bool, agora: int) -> tuple:
+    """
+    estado: (ease, intervalo, repeticoes) ou None (nunca respondida).
+    Retorna (ease, intervalo, repeticoes, vence_em).
+    """
+    ease, intervalo, repeticoes = estado or (EASE_INICIAL, 0.0, 0)
+    if not acertou or repeticoes == 0:
+        novo = 1.0
+    elif repeticoes == 1:
+        novo = 6.0
+    else:
+        # int(x + 0.5) arredonda como o ROUND do SQLite (meio para cima)
+        novo = min(INTERVALO_MAX, float(int(intervalo * ease + 0.5)))
+    repeticoes = repeticoes + 1 if acertou else 0
+    ease = max(EASE_MIN, ease + (EASE_ACERTO if acertou else EASE_ERRO))
+    return ease, novo, repeticoes, int(agora) + int(novo * DIA)
+
+
+def agora() -> int:
+    return int(time.time())
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db_async
+
+# ==========================================================
+# Persistência das sessões de quiz (chat_data) no banco
+# Só o necessário para retomar a sessão vai para a tabela sessoes, num JSON
+# compacto: fila de qids, cursor, tema/subtema, versão do banco de questões
+# e a questão em aberto. Sessão terminada (fila no fim e a última questão já
+# respondida) não é guardada: a linha é apagada; as largadas no meio saem
+# pela retenção (db_turso.podar_sessoes). O PTB junta as alterações e chama update_chat_data a
+# cada SESSOES_FLUSH_INTERVAL segundos (e no desligamento); aqui só seguem
+# para o banco os chats cuja sessão mudou, todos numa transação.
+#
+# Vários workers: o caminho recomendado é rotear por chat_id no balanceador
+# (cada chat sempre no mesmo processo). Sem isso, SESSOES_REFRESH=1 relê a
+# sessão do banco antes de cada update, ao custo de uma leitura por update.
+#
+# A persistência lembra o último JSON gravado de cada chat para não regravar
+# o que não mudou. Chat sem linha (sessão terminada ou apagada) não fica
+# nessa memória, e quem não grava há RETENCAO_SESSOES_DIAS (o mesmo corte
+# de podar_sessoes, que apaga a linha no banco) é esquecido a cada lote.
+# ==========================================================
+SESSOES_FLUSH_INTERVAL = float(os.getenv("SESSOES_FLUSH_INTERVAL", "5"))
+RETENCAO_SESSOES_DIAS = float(os.getenv("RETENCAO_SESSOES_DIAS", "14"))
+SESSOES_REFRESH = os.getenv("SESSOES_REFRESH", "").strip().lower() in ("1", "true", "yes", "on")
+
+log = logging.getLogger(__name__)
+
+# chaves soltas de chat_data -> chave curta no JSON
+_CHAVES = (
+    ("tema", "t"),
+    ("correta_exibida", "c"),
+    ("qid_atual", "a"),
+    ("perm_atual", "m"),
+    ("mid_tratado", "u"),
+)
+
+
+def _em_andamento(chat_data: dict) -> bool:
+    quiz = chat_data.get("quiz")
+    if not quiz:
+        return False
+    # depois da última questão o índice já está no fim, mas ela segue em
+    # aberto (qid_atual) até ser respondida
+    return int(quiz.get("index", 0)) < len(quiz.get("qids", ())) or bool(chat_data.get("qid_atual"))
+
+
+def codificar(chat_data: dict) -> str | None:
+    """
+    chat_data -> JSON compacto; None se não há nada a guardar. Quiz terminado
+    não deixa nada; antes do primeiro quiz, só o tema escolhido no menu.
+    """
+    d = {}
+    quiz = chat_data.get("quiz")
+    if quiz and not _em_andamento(chat_data):
+        return None
+    if quiz:
+        d["q"] = [
+            quiz.get("user_id", ""),
+            quiz.get("tema", ""),
+            quiz.get("subtema", ""),
+            quiz.get("versao", ""),
+            int(quiz.get("index", 0)),
+            list(quiz.get("qids", ())),
+        ]
+        last_perms = quiz.get("last_perms")
+        if last_perms:
+            # "B,A,D,C" -> "BADC"
+            d["p"] = {qid: perm.replace(",", "") for qid, perm in last_perms.items()}
+        chaves = _CHAVES
+    else:
+        chaves = _CHAVES[:1]
+    for chave, curta in chaves:
+        valor = chat_data.get(chave)
+        if valor:
+            d[curta] = valor
+    if not d:
+        return None
+    return json.dumps(d, ensure_ascii=False, separators=(",", ":"))
+
+
+def decodificar(dados: str) -> dict:
+    d = json.loads(dados)
+    chat_data = {}
+    if "q" in d:
+        user_id, tema, subtema, versao, index, qids = d["q"]
+        chat_data["quiz"] = {
+            "user_id": user_id,
+            "tema": tema,
+            "subtema": subtema,
+            "qids": qids,
+            "index": index,
+            "versao": versao,
+        }
+        if "p" in d:
+            chat_data["quiz"]["last_perms"] = {qid: ",".join(perm) for qid, perm in d["p"].items()}
+    for chave, curta in _CHAVES:
+        if curta in d:
+            chat_data[chave] = d[curta]
+    return chat_data
+
+
+class SessaoPersistence(BasePersistence):
+    """
+    BasePersistence só de chat_data, sobre storage (via db_async).
+    """
+
+    def __init__(self, update_interval: float = SESSOES_FLUSH_INTERVAL, refresh: bool = SESSOES_REFRESH):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.refresh = refresh
+        self.esquecer_apos = RETENCAO_SESSOES_DIAS * 86400
+        self._gravado = OrderedDict()  # chat_id -> (último JSON gravado, quando); ausente = sem linha
+        self._pendente = {}   # chat_id -> JSON a gravar (None = apagar)
+        self._lote = None
+        # métricas
+        self.gravacoes = 0
+        self.ignoradas = 0
+
+    def _ultimo(self, chat_id: int) -> str | None:
+        gravado = self._gravado.get(chat_id)
+        return gravado[0] if gravado else None
+
+    def _lembrar(self, chat_id: int, dados: str | None):
+        self._gravado.pop(chat_id, None)
+        if dados is not None:
+            self._gravado[chat_id] = (dados, time.monotonic())
+
+    def _esquecer_velhos(self):
+        # em ordem de gravação: para no primeiro que ainda está no prazo
+        corte = time.monotonic() - self.esquecer_apos
+        while self._gravado:
+            chat_id, (_dados, quando) = next(iter(self._gravado.items()))
+            if quando >= corte:
+                break
+            del self._gravado[chat_id]
+
+    # ----- chat_data -----
+    async def get_chat_data(self) -> dict:
+        linhas = await db_async.load_sessions()
+        out = {}
+        apagar = []
+        for chat_id, dados in linhas.items():
+            try:
+                chat_data = decodificar(dados)
+            except (ValueError, TypeError, KeyError):
+                log.warning("sessoes: sessão ilegível do chat %s descartada", chat_id)
+                apagar.append((chat_id, None))
+                continue
+            if codificar(chat_data) is None:
+                # terminada (gravada antes de codificar descartá-las)
+                apagar.append((chat_id, None))
+                continue
+            out[chat_id] = chat_data
+            self._lembrar(chat_id, dados)
+        if apagar:
+            await db_async.save_sessions(apagar)
+        return out
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        dados = codificar(data)
+        if self._ultimo(chat_id) == dados:
+            self.ignoradas += 1
+            return
+        self._pendente[chat_id] = dados
+        if self._lote is None:
+            self._lote = asyncio.get_running_loop().create_task(self._gravar_lote())
+        await asyncio.shield(self._lote)
+
+    async def _gravar_lote(self):
+        # deixa as demais chamadas do mesmo update_persistence entrarem no lote
+        await asyncio.sleep(0)
+        lote, self._pendente = self._pendente, {}
+        self._lote = None
+        try:
+            await db_async.save_sessions(list(lote.items()))
+        except Exception:
+            # volta para a fila (sem passar por cima de algo mais novo); tenta no próximo ciclo
+            for chat_id, dados in lote.items():
+                self._pendente.setdefault(chat_id, dados)
+            raise
+        for chat_id, dados in lote.items():
+            self._lembrar(chat_id, dados)
+        self._esquecer_velhos()
+        self.gravacoes += 1
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._pendente.pop(chat_id, None)
+        await db_async.save_sessions([(chat_id, None)])
+        self._gravado.pop(chat_id, None)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        if not self.refresh:
+            return
+        dados = await db_async.get_session(chat_id)
+        if dados == self._ultimo(chat_id):
+            return
+        # outro worker mexeu nesta sessão
+        chat_data.clear()
+        if dados is not None:
+            chat_data.update(decodificar(dados))
+        self._lembrar(chat_id, dados)
+
+    async def flush(self) -> None:
+        # desligamento: grava o que sobrou (inclusive de um lote que falhou)
+        if self._lote is None and self._pendente:
+            self._lote = asyncio.get_running_loop().create_task(self._gravar_lote())
+        if self._lote is not None:
+            await self._lote
+
+    # ----- o resto não é persistido -----
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
@@ -0,0 +1,414 @@
+import abc
+import heapq
+import os
+import threading
+from bisect import bisect_left, insort
+
+import revisao
+
+# ==========================================================
+# Armazenamento plugável
+# main.py / quiz.py (via db_async) só conhecem a interface Storage.
+# STORAGE_BACKEND:
+#   turso  -> db_turso com DB_MODE remote/replica (padrão)
+#   sqlite -> db_turso sobre um arquivo SQLite local (DB_MODE=local, DB_PATH)
+#   memory -> tudo em dicionários no processo (testes, CI, benchmarks de carga)
+# Sem STORAGE_BACKEND, DB_MODE=local implica sqlite.
+# ==========================================================
+STORAGE_BACKEND = (
+    os.getenv("STORAGE_BACKEND")
+    or ("sqlite" if os.getenv("DB_MODE", "").strip().lower() == "local" else "turso")
+).strip().lower()
+
+
+def _pct(acertos: int, total: int) -> float:
+    return (acertos / total * 100.0) if total else 0.0
+
+
+class Storage(abc.ABC):
+    """
+    Contrato comum dos backends (mesmas assinaturas e formatos de retorno
+    de db_turso); um backend sem algum dos métodos abstratos falha já
+    ao ser instanciado. `bloqueante` diz se as chamadas fazem E/S: db_async só
+    manda para o pool de threads o que bloqueia.
+    """
+
+    nome = "base"
+    bloqueante = True
+
+    @abc.abstractmethod
+    def init_db(self): ...
+
+    @abc.abstractmethod
+    def record_answer(self, user_id: str, qid: str, acertou: bool, marcada: str, tema: str, subtema: str): ...
+
+    @abc.abstractmethod
+    def get_overall_progress(self, user_id: str) -> dict: ...
+
+    @abc.abstractmethod
+    def get_topic_breakdown(self, user_id: str, limit: int = 20) -> list[dict]: ...
+
+    @abc.abstractmethod
+    def get_user_topic_breakdown_full(self, user_id: str) -> dict: ...
+
+    @abc.abstractmethod
+    def get_question_status_map(self, user_id: str) -> dict: ...
+
+    # repetição espaçada (revisao.py): [(qid, vence_em)] em ordem de vencimento
+    @abc.abstractmethod
+    def get_review_queue(self, user_id: str, limit: int = 20) -> list[tuple[str, int]]: ...
+
+    @abc.abstractmethod
+    def reset_user_stats(self, user_id: str): ...
+
+    @abc.abstractmethod
+    def record_sent_question(self, user_id: str, qid: str, message_id: int, correta_exibida: str, perm: str): ...
+
+    @abc.abstractmethod
+    def get_sent_correct(self, user_id: str, qid: str, message_id: int) -> str: ...
+
+    @abc.abstractmethod
+    def get_last_perm_for_user_question(self, user_id: str, qid: str) -> str: ...
+
+    @abc.abstractmethod
+    def get_last_perms_for_user_questions(self, user_id: str, qids: list[str]) -> dict: ...
+
+    @abc.abstractmethod
+    def get_users_overall_scores(self, limit: int | None = None, offset: int = 0) -> list[dict]: ...
+
+    @abc.abstractmethod
+    def get_user_rank(self, user_id: str) -> int | None: ...
+
+    @abc.abstractmethod
+    def count_ranked_users(self) -> int: ...
+
+    # sessões de quiz (dados = JSON compacto de sessoes.py; None apaga)
+    @abc.abstractmethod
+    def load_sessions(self) -> dict[int, str]: ...
+
+    @abc.abstractmethod
+    def get_session(self, chat_id: int) -> str | None: ...
+
+    @abc.abstractmethod
+    def save_sessions(self, rows: list[tuple[int, str | None]]): ...
+
+    # retenção, um lote por chamada: (examinadas, removidas); (0, 0) = nada a fazer
+    def compactar_respostas(self, lote: int) -> tuple[int, int]:
+        return 0, 0
+
+    def podar_sent(self, lote: int) -> tuple[int, int]:
+        return 0, 0
+
+    def podar_sessoes(self, lote: int) -> tuple[int, int]:
+        return 0, 0
+
+    def flush_writes(self):
+        pass
+
+    def sync_now(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ==========================================================
+# Em memória
+# ==========================================================
+class MemoryStorage(Storage):
+    """
+    Sem E/S: agregados mantidos direto em dicionários e ranking por bisect,
+    como o cache de db_turso. Os dados somem com o processo.
+    """
+
+    nome = "memory"
+    bloqueante = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totais = {}    # uid -> [acertos, total]
+        self._tema_sub = {}  # uid -> {(tema, subtema): [acertos, total]}
+        self._status = {}    # uid -> {qid: bool}
+        self._revisao = {}   # uid -> {qid: (ease, intervalo, repeticoes, vence_em)}
+        self._sent = {}      # (uid, qid, message_id) -> correta_exibida
+        self._perms = {}     # uid -> {qid: perm}
+        self._ranking = []   # [(-respondidas, uid)] ordenado
+        self._sessoes = {}   # chat_id -> dados
+
+    def init_db(self):
+        pass
+
+    def record_answer(self, user_id: str, qid: str, acertou: bool, marcada: str, tema: str, subtema: str):
+        uid = str(user_id)
+        q = str(qid).strip()
+        ok = 1 if acertou else 0
+        chave = (str(tema or ""), str(subtema or ""))
+        with self._lock:
+            tot = self._totais.get(uid)
+            if tot is None:
+                tot = self._totais[uid] = [0, 0]
+            else:
+                del self._ranking[bisect_left(self._ranking, (-tot[1], uid))]
+            tot[0] += ok
+            tot[1] += 1
+            insort(self._ranking, (-tot[1], uid))
+
+            por_ts = self._tema_sub.setdefault(uid, {})
+            ts = por_ts.get(chave)
+            if ts is None:
+                ts = por_ts[chave] = [0, 0]
+            ts[0] += ok
+            ts[1] += 1
+
+            # qid vazio conta nos totais mas não tem status nem revisão (como em db_turso)
+            if q:
+                status = self._status.setdefault(uid, {})
+                status[q] = status.get(q, False) or bool(acertou)
+
+                agenda = self._revisao.setdefault(uid, {})
+                anterior = agenda.get(q)
+                agenda[q] = revisao.proximo(anterior and anterior[:3], acertou, revisao.agora())
+
+    def get_overall_progress(self, user_id: str) -> dict:
+        with self._lock:
+            acertos, total = self._totais.get(str(user_id), (0, 0))
+        return {"acertos": acertos, "erros": total - acertos, "pct": _pct(acertos, total)}
+
+    def _linhas_tema_sub(self, uid: str) -> list[dict]:
+        with self._lock:
+            itens = [(t, s, a, n) for (t, s), (a, n) in self._tema_sub.get(uid, {}).items()]
+        itens.sort(key=lambda x: x[3], reverse=True)
+        return [
+            {"tema": t, "subtema": s, "acertos": a, "erros": n - a, "total": n, "pct": _pct(a, n)}
+            for t, s, a, n in itens
+        ]
+
+    def get_topic_breakdown(self, user_id: str, limit: int = 20) -> list[dict]:
+        return self._linhas_tema_sub(str(user_id))[:max(0, int(limit))]
+
+    def get_user_topic_breakdown_full(self, user_id: str) -> dict:
+        tema_subtema = self._linhas_tema_sub(str(user_id).strip())
+        por_tema = {}
+        for r in tema_subtema:
+            a, n = por_tema.get(r["tema"], (0, 0))
+            por_tema[r["tema"]] = (a + r["acertos"], n + r["total"])
+        temas = [
+            {"tema": t, "acertos": a, "erros": n - a, "total": n, "pct": _pct(a, n)}
+            for t, (a, n) in sorted(por_tema.items(), key=lambda kv: kv[1][1], reverse=True)
+        ]
+        return {"temas": temas, "tema_subtema": tema_subtema}
+
+    def get_question_status_map(self, user_id: str) -> dict:
+        with self._lock:
+            return dict(self._status.get(str(user_id), {}))
+
+    def get_review_queue(self, user_id: str, limit: int = 20) -> list[tuple[str, int]]:
+        # sem índice aqui: seleção parcial sobre as questões do usuário
+        with self._lock:
+            agenda = list(self._revisao.get(str(user_id), {}).items())
+        primeiras = heapq.nsmallest(max(0, int(limit)), agenda, key=lambda kv: kv[1][3])
+        return [(q, estado[3]) for q, estado in primeiras]
+
+    def reset_user_stats(self, user_id: str):
+        uid = str(user_id)
+        with self._lock:
+            tot = self._totais.pop(uid, None)
+            if tot is not None:
+                del self._ranking[bisect_left(self._ranking, (-tot[1], uid))]
+            self._tema_sub.pop(uid, None)
+            self._status.pop(uid, None)
+            self._revisao.pop(uid, None)
+            self._perms.pop(uid, None)
+            for chave in [k for k in self._sent if k[0] == uid]:
+                del self._sent[chave]
+
+    def record_sent_question(self, user_id: str, qid: str, message_id: int, correta_exibida: str, perm: str):
+        uid = str(user_id)
+        q = str(qid).strip()
+        with self._lock:
+            self._sent[(uid, q, int(message_id))] = str(correta_exibida or "").strip().upper()
+            self._perms.setdefault(uid, {})[q] = str(perm or "").strip()
+
+    def get_sent_correct(self, user_id: str, qid: str, message_id: int) -> str:
+        with self._lock:
+            return self._sent.get((str(user_id), str(qid).strip(), int(message_id)), "")
+
+    def get_last_perm_for_user_question(self, user_id: str, qid: str) -> str:
+        with self._lock:
+            return self._perms.get(str(user_id), {}).get(str(qid).strip(), "")
+
+    def get_last_perms_for_user_questions(self, user_id: str, qids: list[str]) -> dict:
+        with self._lock:
+            perms = self._perms.get(str(user_id), {})
+            return {q: perms[q] for q in (str(x).strip() for x in qids) if q in perms}
+
+    def get_users_overall_scores(self, limit: int | None = None, offset: int = 0) -> list[dict]:
+        off = max(0, int(offset))
+        fim = None if limit is None else off + max(0, int(limit))
+        with self._lock:
+            pagina = [(uid, -neg, self._totais[uid][0]) for neg, uid in self._ranking[off:fim]]
+        return [
+            {"user_id": uid, "respondidas": n, "acertos": a, "erros": n - a, "pct": _pct(a, n)}
+            for uid, n, a in pagina
+        ]
+
+    def get_user_rank(self, user_id: str) -> int | None:
+        uid = str(user_id).strip()
+        with self._lock:
+            tot = self._totais.get(uid)
+            if tot is None:
+                return None
+            return bisect_left(self._ranking, (-tot[1], uid)) + 1
+
+    def count_ranked_users(self) -> int:
+        with self._lock:
+            return len(self._ranking)
+
+    def load_sessions(self) -> dict[int, str]:
+        with self._lock:
+            return dict(self._sessoes)
+
+    def get_session(self, chat_id: int) -> str | None:
+        with self._lock:
+            return self._sessoes.get(int(chat_id))
+
+    def save_sessions(self, rows: list[tuple[int, str | None]]):
+        with self._lock:
+            for cid, dados in rows:
+                if dados is None:
+                    self._sessoes.pop(int(cid), None)
+                else:
+                    self._sessoes[int(cid)] = dados
+
+
+# ==========================================================
+# SQL (Turso remoto/réplica ou SQLite local), via db_turso
+# ==========================================================
+class SqlStorage(Storage):
+    """
+    Encaminha para as funções de db_turso (pool, cache, write-behind).
+    """
+
+    bloqueante = True
+
+    def __init__(self, nome: str):
+        if nome == "sqlite":
+            # SQLite local: o modo precisa estar definido antes do import de db_turso
+            os.environ.setdefault("DB_MODE", "local")
+        import db_turso
+
+        if nome == "sqlite" and db_turso.DB_MODE != "local":
+            raise RuntimeError(f"STORAGE_BACKEND=sqlite exige DB_MODE=local (atual: {db_turso.DB_MODE}).")
+        if nome == "turso" and db_turso.DB_MODE == "local":
+            raise RuntimeError("STORAGE_BACKEND=turso não combina com DB_MODE=local (use STORAGE_BACKEND=sqlite).")
+        self.nome = nome
+        self._db = db_turso
+
+    def init_db(self):
+        return self._db.init_db()
+
+    def record_answer(self, user_id: str, qid: str, acertou: bool, marcada: str, tema: str, subtema: str):
+        return self._db.record_answer(user_id, qid, acertou, marcada, tema, subtema)
+
+    def get_overall_progress(self, user_id: str) -> dict:
+        return self._db.get_overall_progress(user_id)
+
+    def get_topic_breakdown(self, user_id: str, limit: int = 20) -> list[dict]:
+        return self._db.get_topic_breakdown(user_id, limit)
+
+    def get_user_topic_breakdown_full(self, user_id: str) -> dict:
+        return self._db.get_user_topic_breakdown_full(user_id)
+
+    def get_question_status_map(self, user_id: str) -> dict:
+        return self._db.get_question_status_map(user_id)
+
+    def get_review_queue(self, user_id: str, limit: int = 20) -> list[tuple[str, int]]:
+        return self._db.get_review_queue(user_id, limit)
+
+    def reset_user_stats(self, user_id: str):
+        return self._db.reset_user_stats(user_id)
+
+    def record_sent_question(self, user_id: str, qid: str, message_id: int, correta_exibida: str, perm: str):
+        return self._db.record_sent_question(user_id, qid, message_id, correta_exibida, perm)
+
+    def get_sent_correct(self, user_id: str, qid: str, message_id: int) -> str:
+        return self._db.get_sent_correct(user_id, qid, message_id)
+
+    def get_last_perm_for_user_question(self, user_id: str, qid: str) -> str:
+        return self._db.get_last_perm_for_user_question(user_id, qid)
+
+    def get_last_perms_for_user_questions(self, user_id: str, qids: list[str]) -> dict:
+        return self._db.get_last_perms_for_user_questions(user_id, qids)
+
+    def get_users_overall_scores(self, limit: int | None = None, offset: int = 0) -> list[dict]:
+        return self._db.get_users_overall_scores(limit, offset)
+
+    def get_user_rank(self, user_id: str) -> int | None:
+        return self._db.get_user_rank(user_id)
+
+    def count_ranked_users(self) -> int:
+        return self._db.count_ranked_users()
+
+    def load_sessions(self) -> dict[int, str]:
+        return self._db.load_sessions()
+
+    def get_session(self, chat_id: int) -> str | None:
+        return self._db.get_session(chat_id)
+
+    def save_sessions(self, rows: list[tuple[int, str | None]]):
+        return self._db.save_sessions(rows)
+
+    def compactar_respostas(self, lote: int) -> tuple[int, int]:
+        return self._db.compactar_respostas(lote)
+
+    def podar_sent(self, lote: int) -> tuple[int, int]:
+        return self._db.podar_sent(lote)
+
+    def podar_sessoes(self, lote: int) -> tuple[int, int]:
+        return self._db.podar_sessoes(lote)
+
+    def flush_writes(self):
+        return self._db.flush_writes()
+
+    def sync_now(self):
+        return self._db.sync_now()
+
+    def close(self):
+        return self._db.close()
+
+
+_BACKENDS = {
+    "memory": MemoryStorage,
+    "sqlite": lambda: SqlStorage("sqlite"),
+    "turso": lambda: SqlStorage("turso"),
+}
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    Backend do processo (criado na primeira chamada, conforme STORAGE_BACKEND).
+    """
+    global _STORAGE
+    if _STORAGE is not None:
+        return _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is None:
+            if STORAGE_BACKEND not in _BACKENDS:
+                raise RuntimeError(
+                    f"STORAGE_BACKEND inválido: {STORAGE_BACKEND!r} (use {', '.join(_BACKENDS)})."
+                )
+            _STORAGE = _BACKENDS[STORAGE_BACKEND]()
+        return _STORAGE
+
+
+def set_storage(storage: Storage) -> Storage:
+    """
+    Troca o backend do processo (testes e benchmarks). Retorna o anterior.
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        anterior, _STORAGE = _STORAGE, storage
+        return anterior
@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# antes de qualquer import do projeto: SQLite local descartável e backend em memória
+os.environ["DB_MODE"] = "local"
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="chobot-testes-"), "testes.db")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("DB_SLOW_QUERY_MS", "100000")
+os.environ.setdefault("CALLBACK_SECRET", "segredo-de-teste")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """
+    db_turso apontado para um arquivo novo, já migrado e com os caches zerados.
+    """
+    import db_turso
+
+    monkeypatch.setattr(db_turso, "DB_PATH", str(tmp_path / "chobot.db"))
+    db_turso.configure_pool()
+    db_turso._STATUS_CACHE.clear()
+    db_turso._LEADERBOARD.invalidate()
+    db_turso.init_db()
+    yield db_turso
+    db_turso.configure_write_behind(False)
+    db_turso._STATUS_CACHE.clear()
+    db_turso._LEADERBOARD.invalidate()
+    db_turso._POOL.close()
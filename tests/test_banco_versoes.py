@@ -0,0 +1,127 @@
+import asyncio
+import json
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import banco
+import quiz
+
+
+def _artefato(path, sha: str, questoes: dict) -> str:
+    """
+    Artefato mínimo no formato de banco.compilar: {qid: (pergunta, correta)}, tudo em T/S.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("CREATE TABLE meta (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        conn.execute("CREATE TABLE questoes (pos INTEGER PRIMARY KEY, qid TEXT NOT NULL, dados TEXT NOT NULL)")
+        linhas = [
+            {
+                "Tema": "T", "Subtema": "S", "Pergunta": pergunta, "Resposta Correta": correta,
+                "Opção A": "a", "Opção B": "b", "Opção C": "c", "Opção D": "d", "Explicação": f"exp {qid}",
+            }
+            for qid, (pergunta, correta) in questoes.items()
+        ]
+        conn.executemany(
+            "INSERT INTO questoes (pos, qid, dados) VALUES (?, ?, ?)",
+            [(i, qid, json.dumps(r)) for i, (qid, r) in enumerate(zip(questoes, linhas))],
+        )
+        indices = {
+            "temas": ["T"],
+            "tema_to_qids": {"T": list(questoes)},
+            "tema_to_subtemas": {"T": ["S"]},
+            "subtema_to_qids": [["T", "S", list(questoes)]],
+        }
+        conn.executemany(
+            "INSERT INTO meta (chave, valor) VALUES (?, ?)",
+            [("formato", banco.FORMATO), ("fonte_sha256", sha), ("indices", json.dumps(indices))],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return str(path)
+
+
+class _Chat:
+    def __init__(self):
+        self.mensagens = []
+
+    async def send_message(self, texto, **kwargs):
+        self.mensagens.append(texto)
+        return SimpleNamespace(message_id=len(self.mensagens))
+
+
+@pytest.fixture
+def versoes(tmp_path, monkeypatch):
+    """
+    quiz carregado na versão A; a próxima recarga troca para B. A tem q1 e q2,
+    B muda o gabarito de q1, tira q2 e põe q3.
+    """
+    a = _artefato(tmp_path / "a.sqlite", "a" * 64, {"q1": ("Pergunta A1", "A"), "q2": ("Pergunta A2", "B")})
+    b = _artefato(tmp_path / "b.sqlite", "b" * 64, {"q1": ("Pergunta B1", "C"), "q3": ("Pergunta B3", "D")})
+    atual = {"path": a}
+    sem_planilha = str(tmp_path / "nao-existe.xlsx")
+    atualizar = banco.atualizar
+    monkeypatch.setattr(banco, "atualizar", lambda: atualizar(sem_planilha, atual["path"]))
+    inicial = banco._ler_artefato(a)
+    monkeypatch.setattr(quiz, "_BANCO", inicial)
+    monkeypatch.setattr(quiz, "_VERSOES", quiz.OrderedDict([(inicial.versao, inicial)]))
+    monkeypatch.setattr(quiz, "_FONTES", quiz._FONTES)
+    monkeypatch.setattr(quiz, "SIGNED_CALLBACKS", False)
+
+    def trocar():
+        atual["path"] = b
+        return asyncio.run(quiz.recarregar_banco())
+
+    return inicial.versao, trocar
+
+
+def test_troca_de_versao(versoes):
+    versao_a, trocar = versoes
+    mudou, novo = trocar()
+
+    assert mudou and novo.versao == "b" * 12 != versao_a
+    assert quiz.banco_atual() is novo
+    assert list(quiz._VERSOES) == [versao_a, novo.versao]
+    # sem versão (sessão nova) vale a atual
+    assert quiz.get_question_by_id("q2") is None
+    assert quiz.get_question_by_id("q3").pergunta == "Pergunta B3"
+
+
+def test_sessao_da_versao_antiga_segue_nela(versoes, monkeypatch):
+    versao_a, trocar = versoes
+    enviadas = []
+
+    async def gravar(**kwargs):
+        enviadas.append((kwargs["qid"], kwargs["correta_exibida"], kwargs["perm"]))
+
+    async def sem_perm(*args):
+        return ""
+
+    monkeypatch.setattr(quiz, "record_sent_question", gravar)
+    monkeypatch.setattr(quiz, "get_last_perm_for_user_question", sem_perm)
+    update = SimpleNamespace(effective_chat=_Chat())
+    context = SimpleNamespace(chat_data={"quiz": {
+        "user_id": "42", "tema": "T", "subtema": "S", "qids": ["q2", "q1"], "index": 0,
+        "versao": versao_a, "last_perms": {},
+    }})
+
+    trocar()
+
+    async def cenario():
+        await quiz.enviar_proxima(update, context)
+        await quiz.enviar_proxima(update, context)
+
+    asyncio.run(cenario())
+
+    # q2 não existe em B e q1 mudou de texto e gabarito: a sessão enxerga A
+    assert quiz.get_question_by_id("q2", versao_a).pergunta == "Pergunta A2"
+    assert quiz.get_correct_and_explanation("q1", versao_a) == ("A", "exp q1")
+    assert quiz.get_correct_and_explanation("q1") == ("C", "exp q1")
+    assert [qid for qid, _c, _p in enviadas] == ["q2", "q1"]
+    assert "Pergunta A2" in update.effective_chat.mensagens[0]
+    assert "Pergunta A1" in update.effective_chat.mensagens[1]
+    for (qid, correta_exibida, perm), correta in zip(enviadas, ("B", "A")):
+        assert correta_exibida == quiz.LETRAS[perm.split(",").index(correta)]
@@ -0,0 +1,93 @@
+import pytest
+
+import quiz
+
+
+@pytest.fixture
+def questao():
+    banco = quiz.banco_atual()
+    q = next(q for q in banco.questions_by_id.values() if q.correta)
+    return q, banco.versao
+
+
+def _trocar(data: str, campo: int, valor: str) -> str:
+    partes = data.split("|")
+    partes[campo] = valor
+    return "|".join(partes)
+
+
+def test_ida_e_volta(questao):
+    q, versao = questao
+    perm = ["C", "A", "D", "B"]
+    botoes = quiz._callbacks_assinados("42", q.qid, perm, versao)
+
+    assert len(botoes) == len(quiz.LETRAS)
+    assert all(len(d.encode()) <= quiz.CALLBACK_DATA_MAX for d in botoes)
+    correta_exibida = quiz.LETRAS[perm.index(q.correta)]
+    for letra, data in zip(quiz.LETRAS, botoes):
+        assert quiz.verificar_resposta_assinada(data, "42") == (q.qid, letra, correta_exibida, versao)
+
+
+def test_adulterado_e_recusado(questao):
+    q, versao = questao
+    data = quiz._callbacks_assinados("42", q.qid, ["A", "B", "C", "D"], versao)[0]
+    outra_perm = quiz._PERM_CODES[1]
+
+    # trocar a perm muda a correta exibida: a assinatura tem de cobrir isso
+    assert quiz.verificar_resposta_assinada(_trocar(data, 3, outra_perm), "42") is None
+    assert quiz.verificar_resposta_assinada(_trocar(data, 1, q.qid + "x"), "42") is None
+    assert quiz.verificar_resposta_assinada(_trocar(data, 5, "A" * 12), "42") is None
+    assert quiz.verificar_resposta_assinada(_trocar(data, 2, "Z"), "42") is None
+    assert quiz.verificar_resposta_assinada(_trocar(data, 4, "0" * len(versao)), "42") is None
+    assert quiz.verificar_resposta_assinada(data + "|extra", "42") is None
+    assert quiz.verificar_resposta_assinada("R|lixo", "42") is None
+
+
+def test_letra_marcada_fica_fora_da_assinatura(questao):
+    q, versao = questao
+    botoes = quiz._callbacks_assinados("42", q.qid, ["A", "B", "C", "D"], versao)
+    # a mesma assinatura vale para os quatro botões da mensagem
+    assert len({d.rsplit("|", 1)[1] for d in botoes}) == 1
+    assert quiz.verificar_resposta_assinada(_trocar(botoes[0], 2, "D"), "42")[1] == "D"
+
+
+def test_botao_de_outro_usuario(questao):
+    q, versao = questao
+    data = quiz._callbacks_assinados("42", q.qid, ["A", "B", "C", "D"], versao)[0]
+    assert quiz.verificar_resposta_assinada(data, "43") is None
+
+
+def test_segredo_trocado_invalida(questao, monkeypatch):
+    q, versao = questao
+    data = quiz._callbacks_assinados("42", q.qid, ["A", "B", "C", "D"], versao)[0]
+    monkeypatch.setenv("CALLBACK_SECRET", "outro-segredo")
+    monkeypatch.setattr(quiz, "_HMAC_KEY", None)
+    assert quiz.verificar_resposta_assinada(data, "42") is None
+
+
+def test_confere_na_versao_em_que_foi_mostrado(questao, monkeypatch):
+    q, versao = questao
+    # versão nova (já a atual) em que a questão mudou de gabarito
+    outra = next(letra for letra in quiz.LETRAS if letra != q.correta)
+    q_nova = quiz.banco.Question(q.qid, q.tema, q.subtema, q.pergunta, q.opcoes, outra, q.explicacao)
+    antigo = quiz.banco_atual()
+    novo = quiz.banco.Banco(
+        {**antigo.questions_by_id, q.qid: q_nova}, antigo.temas, antigo.tema_to_qids,
+        antigo.tema_to_subtemas, antigo.subtema_to_qids, "teste", "versao-nova1",
+    )
+    monkeypatch.setattr(quiz, "_VERSOES", quiz.OrderedDict([(versao, antigo), (novo.versao, novo)]))
+    monkeypatch.setattr(quiz, "_BANCO", novo)
+    perm = ["D", "C", "B", "A"]
+
+    data = quiz._callbacks_assinados("42", q.qid, perm, versao)[0]
+    assert quiz.verificar_resposta_assinada(data, "42") == (q.qid, "A", quiz.LETRAS[perm.index(q.correta)], versao)
+
+    data = quiz._callbacks_assinados("42", q.qid, perm, novo.versao)[0]
+    assert quiz.verificar_resposta_assinada(data, "42") == (q.qid, "A", quiz.LETRAS[perm.index(outra)], novo.versao)
+
+
+def test_versao_que_saiu_do_cache_expira(questao, monkeypatch):
+    q, versao = questao
+    data = quiz._callbacks_assinados("42", q.qid, ["A", "B", "C", "D"], versao)[0]
+    monkeypatch.setattr(quiz, "_VERSOES", quiz.OrderedDict())
+    assert quiz.verificar_resposta_assinada(data, "42") is None
@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+import envio
+
+
+def test_429_pausa_tambem_os_outros_chats():
+    agendador = envio.AgendadorEnvio(global_por_seg=1000, chat_por_seg=1000, chat_rajada=10)
+    enviados = []
+    falhou = []
+
+    async def send(chat_id):
+        if chat_id == 1 and not falhou:
+            falhou.append(time.monotonic())
+            raise RetryAfter(0.3)
+        enviados.append((chat_id, time.monotonic()))
+
+    async def enviar(chat_id):
+        await agendador.process_request(send, (chat_id,), {}, "sendMessage", {"chat_id": chat_id}, None)
+
+    async def cenario():
+        primeiro = asyncio.create_task(enviar(1))
+        await asyncio.sleep(0.05)
+        await enviar(2)
+        await primeiro
+        await agendador.shutdown()
+
+    asyncio.run(cenario())
+
+    assert sorted(chat for chat, _ in enviados) == [1, 2]
+    for _chat, quando in enviados:
+        assert quando - falhou[0] >= 0.25
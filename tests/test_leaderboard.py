@@ -0,0 +1,152 @@
+import threading
+import time
+
+
+def _responder(db, uid: str, n: int):
+    for i in range(n):
+        db.record_answer(uid, str(i), i % 2 == 0, "A", "T", "S")
+
+
+def _recarga_com(db, monkeypatch, durante, primeira: bool = False):
+    """
+    Força uma recarga do ranking rodando `durante(antes_do_select)` em volta do
+    SELECT; primeira=True parte do índice vazio (primeira carga / invalidate).
+    """
+    original = db._fetchall
+
+    def fetchall(sql, params=()):
+        if "FROM user_totais WHERE total > 0" not in sql:
+            return original(sql, params)
+        durante(True)
+        rows = original(sql, params)
+        durante(False)
+        return rows
+
+    monkeypatch.setattr(db, "_fetchall", fetchall)
+    if primeira:
+        db._LEADERBOARD.invalidate()
+    else:
+        monkeypatch.setattr(db._LEADERBOARD, "_carregado_em", time.monotonic() - db._LEADERBOARD.ttl - 1)
+    db.get_users_overall_scores()
+    monkeypatch.setattr(db, "_fetchall", original)
+
+
+def _respondidas(db) -> dict:
+    return {r["user_id"]: r["respondidas"] for r in db.get_users_overall_scores()}
+
+
+def test_resposta_depois_do_select_nao_se_perde(db, monkeypatch):
+    _responder(db, "u1", 3)
+    assert _respondidas(db) == {"u1": 3}
+
+    def durante(antes):
+        if not antes:
+            _responder(db, "u1", 1)  # grava e chega ao ranking depois da leitura
+            _responder(db, "u2", 2)
+
+    _recarga_com(db, monkeypatch, durante)
+    assert _respondidas(db) == {"u1": 4, "u2": 2}
+    assert db.get_user_rank("u1") == 1
+
+    db._LEADERBOARD.invalidate()
+    assert _respondidas(db) == {"u1": 4, "u2": 2}
+
+
+def test_resposta_gravada_antes_do_select_nao_conta_duas_vezes(db, monkeypatch):
+    _responder(db, "u1", 3)
+    _respondidas(db)
+    linha = ("u1", "9", 1, "A", "T", "S", db._utc_now_iso())
+
+    def durante(antes):
+        if antes:
+            db._exec_many(db._answer_statements([linha]))  # já commitada quando o SELECT roda
+        else:
+            db._LEADERBOARD.record("u1", True)               # ...mas só avisa o ranking depois
+
+    _recarga_com(db, monkeypatch, durante)
+    assert _respondidas(db) == {"u1": 4}
+
+
+def test_zerado_durante_a_recarga_fica_zerado(db, monkeypatch):
+    _responder(db, "u1", 3)
+    _responder(db, "u2", 1)
+    _respondidas(db)
+
+    def durante(antes):
+        if not antes:
+            db.reset_user_stats("u1")
+
+    _recarga_com(db, monkeypatch, durante)
+    assert _respondidas(db) == {"u2": 1}
+    assert db.get_user_rank("u1") is None
+
+
+def test_recarga_unica_entre_threads(db, monkeypatch):
+    _responder(db, "u1", 2)
+    _respondidas(db)
+
+    selects = []
+    original = db._fetchall
+
+    def fetchall(sql, params=()):
+        if "FROM user_totais WHERE total > 0" in sql:
+            selects.append(sql)
+            time.sleep(0.05)
+        return original(sql, params)
+
+    monkeypatch.setattr(db, "_fetchall", fetchall)
+    monkeypatch.setattr(db._LEADERBOARD, "_carregado_em", time.monotonic() - db._LEADERBOARD.ttl - 1)
+    threads = [threading.Thread(target=db.count_ranked_users) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(selects) == 1
+    assert db.count_ranked_users() == 1
+
+
+def test_resposta_durante_a_primeira_carga_nao_se_perde(db, monkeypatch):
+    _responder(db, "u1", 100)
+    _responder(db, "u2", 50)
+
+    def durante(antes):
+        if not antes:
+            _responder(db, "u1", 1)
+            _responder(db, "u3", 60)
+
+    _recarga_com(db, monkeypatch, durante, primeira=True)
+    assert _respondidas(db) == {"u1": 101, "u2": 50, "u3": 60}
+    assert db.get_user_rank("u3") == 2
+    assert db.get_user_rank("u2") == 3
+
+
+def test_resposta_durante_carga_apos_invalidate(db, monkeypatch):
+    _responder(db, "u1", 10)
+    _responder(db, "u2", 11)
+    assert db.get_user_rank("u1") == 2
+
+    def durante(antes):
+        if antes:
+            _responder(db, "u2", 1)  # commitada antes do SELECT: não conta duas vezes
+        else:
+            _responder(db, "u1", 3)
+
+    _recarga_com(db, monkeypatch, durante, primeira=True)
+    assert _respondidas(db) == {"u1": 13, "u2": 12}
+    assert db.get_user_rank("u1") == 1
+
+
+def test_respostas_em_todas_as_rodadas_forcam_nova_carga(db, monkeypatch):
+    _responder(db, "u1", 5)
+    original = db._totais_de
+
+    def totais_de(uids):
+        _responder(db, "u1", 1)  # nunca sossega
+        return original(uids)
+
+    monkeypatch.setattr(db, "_totais_de", totais_de)
+    _recarga_com(db, monkeypatch, lambda antes: antes or _responder(db, "u1", 1), primeira=True)
+    assert db._LEADERBOARD._carregado_em is None
+
+    monkeypatch.setattr(db, "_totais_de", original)
+    assert _respondidas(db) == {"u1": 5 + 1 + db.LEADERBOARD_RODADAS}
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+import quiz
+
+
+@pytest.fixture
+def status(monkeypatch):
+    """
+    Mapa de status falso; `durante` roda no meio da leitura (outra resposta chegando).
+    """
+    estado = {"leituras": 0, "durante": None}
+
+    async def get_question_status_map(user_id):
+        estado["leituras"] += 1
+        await asyncio.sleep(0)
+        if estado["durante"]:
+            estado["durante"]()
+        return {}
+
+    monkeypatch.setattr(quiz, "get_question_status_map", get_question_status_map)
+    monkeypatch.setattr(quiz, "_PROGRESSO", quiz.OrderedDict())
+    monkeypatch.setattr(quiz, "_GERACOES", {})
+    return estado
+
+
+def _menu(user_id: str):
+    return asyncio.run(quiz._progresso_menu(user_id, quiz.banco_atual()))
+
+
+def test_resposta_de_outro_usuario_nao_impede_memorizar(status):
+    status["durante"] = lambda: quiz.invalidar_progresso("outro")
+    _menu("u1")
+    _menu("u1")
+    assert status["leituras"] == 1
+    assert quiz._GERACOES == {}
+
+
+def test_resposta_do_proprio_usuario_durante_a_leitura_nao_memoriza(status):
+    status["durante"] = lambda: quiz.invalidar_progresso("u1")
+    _menu("u1")
+    assert "u1" not in quiz._PROGRESSO
+    status["durante"] = None
+    _menu("u1")
+    _menu("u1")
+    assert status["leituras"] == 2
+
+
+def test_memo_expira(status):
+    _menu("u1")
+    _menu("u1")
+    assert status["leituras"] == 1
+    memo = quiz._PROGRESSO["u1"]
+    quiz._PROGRESSO["u1"] = memo[:4] + (0.0,)  # passou de MENU_CACHE_TTL
+    _menu("u1")
+    _menu("u1")
+    assert status["leituras"] == 2
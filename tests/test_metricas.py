@@ -0,0 +1,49 @@
+import logging
+
+import pytest
+import telegram
+from telegram.ext import _updater
+from tornado.httputil import HTTPServerRequest
+
+import metricas
+
+
+@pytest.fixture
+def updater(monkeypatch):
+    # o que instalar_no_webhook troca volta ao original no fim
+    monkeypatch.setattr(_updater, "WebhookAppClass", _updater.WebhookAppClass)
+    return _updater
+
+
+def _rota(app, uri: str):
+    return app.find_handler(HTTPServerRequest(method="GET", uri=uri)).handler_class
+
+
+def test_instala_o_path_no_app_do_webhook(updater):
+    original = updater.WebhookAppClass
+    assert metricas.instalar_no_webhook("/metrics")
+    assert metricas.instalar_no_webhook("/metrics")  # de novo: nada muda
+    assert updater.WebhookAppClass.__mro__[1] is original
+
+    app = updater.WebhookAppClass("/tg", None, None)
+    assert _rota(app, "/metrics").__name__ == "MetricasHandler"
+    assert _rota(app, "/tg").__name__ == "TelegramHandler"
+
+
+def test_versao_nao_conferida_so_avisa(updater, monkeypatch, caplog):
+    original = updater.WebhookAppClass
+    monkeypatch.setattr(metricas, "_PTB_WEBHOOK_TESTADO", ((telegram.__version_info__[0] + 1,),))
+
+    with caplog.at_level(logging.WARNING, logger="metricas"):
+        assert not metricas.instalar_no_webhook("/metrics")
+    assert updater.WebhookAppClass is original
+    assert "METRICS_PORT" in caplog.text
+
+
+def test_ponto_de_troca_ausente_so_avisa(updater, monkeypatch, caplog):
+    monkeypatch.delattr(updater, "WebhookAppClass")
+
+    with caplog.at_level(logging.WARNING, logger="metricas"):
+        assert not metricas.instalar_no_webhook("/metrics")
+    assert not hasattr(updater, "WebhookAppClass")
+    assert "WebhookAppClass" in caplog.text
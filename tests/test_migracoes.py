@@ -0,0 +1,66 @@
+import pytest
+
+
+@pytest.fixture
+def base_v1(tmp_path, monkeypatch):
+    """
+    Arquivo novo parado no esquema de antes do versionamento (migração 1).
+    """
+    import db_turso
+
+    monkeypatch.setattr(db_turso, "DB_PATH", str(tmp_path / "antiga.db"))
+    db_turso.configure_pool()
+    db_turso.migrar(ate=1)
+    yield db_turso
+    db_turso._POOL.close()
+
+
+def _indices(db, tabela: str) -> set[str]:
+    rows = db._fetchall(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name NOT LIKE 'sqlite_%'",
+        (tabela,),
+    )
+    return {str(r[0]) for r in rows}
+
+
+def test_init_db_chega_na_ultima_versao(db):
+    assert db.schema_version() == db._MIGRACOES[-1][0]
+    assert db.migrar() == []
+
+
+def test_versoes_em_ordem_e_sem_repeticao(db):
+    versoes = [v for v, _descricao, _comandos in db._MIGRACOES]
+    assert versoes == list(range(1, len(versoes) + 1))
+
+
+def test_base_antiga_migra_com_os_dados(base_v1):
+    db = base_v1
+    db._exec_many([
+        (
+            "INSERT INTO respostas (user_id, qid, acertou, marcada, tema, subtema, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ("u1", " q1 ", 1, "A", None, None, "2026-01-01T00:00:00+00:00"),
+        ),
+        (
+            "INSERT INTO sent (user_id, qid, message_id, correta_exibida, perm, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+            ("u1", "q1", 10, "B", "B,A,C,D", "2026-01-01T00:00:00+00:00"),
+        ),
+    ])
+    assert db.schema_version() == 1
+
+    aplicadas = db.migrar()
+
+    assert aplicadas == [v for v, _descricao, _comandos in db._MIGRACOES[1:]]
+    assert db._fetchall("SELECT qid, tema, subtema FROM respostas") == [("q1", "", "")]
+    assert db.get_sent_correct("u1", "q1", 10) == "B"
+    assert _indices(db, "sent") == {"idx_sent_cobertura", "idx_sent_user_qid_mid"}
+    assert "idx_respostas_user" not in _indices(db, "respostas")
+
+
+def test_get_sent_correct_busca_pelo_message_id(db):
+    plano = db._fetchall(
+        "EXPLAIN QUERY PLAN SELECT correta_exibida FROM sent "
+        "WHERE user_id = ? AND qid = ? AND message_id = ? ORDER BY id DESC LIMIT 1",
+        ("u1", "q1", 10),
+    )
+    detalhe = " ".join(str(r[-1]) for r in plano)
+    assert "idx_sent_user_qid_mid (user_id=? AND qid=? AND message_id=?)" in detalhe
@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import quiz
+
+
+def test_consulta_em_lote_igual_a_uma_por_vez(db):
+    envios = [
+        ("q1", "A,B,C,D"), ("q2", "B,A,C,D"), ("q1", "C,A,B,D"),
+        ("q3", "D,C,B,A"), ("q1", "D,A,B,C"), ("q2", "A,C,B,D"),
+    ]
+    for mid, (qid, perm) in enumerate(envios):
+        db.record_sent_question("u1", qid, mid, "A", perm)
+    db.record_sent_question("u2", "q1", 99, "A", "B,C,D,A")  # outro usuário não entra
+
+    qids = ["q1", "q2", "q3", "q4", " q1 "]
+    lote = db.get_last_perms_for_user_questions("u1", qids)
+
+    assert lote == {"q1": "D,A,B,C", "q2": "A,C,B,D", "q3": "D,C,B,A"}
+    for qid in ("q1", "q2", "q3", "q4"):
+        assert lote.get(qid, "") == db.get_last_perm_for_user_question("u1", qid)
+
+
+class _Chat:
+    def __init__(self):
+        self.mensagens = []
+        self._mid = itertools.count(100)
+
+    async def send_message(self, texto, **kwargs):
+        self.mensagens.append(texto)
+        return SimpleNamespace(message_id=next(self._mid))
+
+
+@pytest.fixture
+def envio(monkeypatch):
+    """
+    update/context falsos e o banco de dados trocado por contadores.
+    """
+    chamadas = {"lote": 0, "uma": 0, "enviadas": []}
+
+    async def lote(user_id, qids):
+        chamadas["lote"] += 1
+        return {}
+
+    async def uma(user_id, qid):
+        chamadas["uma"] += 1
+        return ""
+
+    async def gravar(**kwargs):
+        chamadas["enviadas"].append((kwargs["qid"], kwargs["perm"]))
+
+    monkeypatch.setattr(quiz, "SIGNED_CALLBACKS", False)
+    monkeypatch.setattr(quiz, "get_last_perms_for_user_questions", lote)
+    monkeypatch.setattr(quiz, "get_last_perm_for_user_question", uma)
+    monkeypatch.setattr(quiz, "record_sent_question", gravar)
+    update = SimpleNamespace(effective_chat=_Chat())
+    context = SimpleNamespace(chat_data={})
+    return update, context, chamadas
+
+
+def _qids(n: int) -> list[str]:
+    return list(quiz.banco_atual().questions_by_id)[:n]
+
+
+def test_sessao_busca_as_perms_uma_vez_so(envio):
+    update, context, chamadas = envio
+    fila = _qids(3)
+
+    async def cenario():
+        await quiz._comecar_sessao(update, context, "42", "T", "S", fila, quiz.banco_atual(), "início")
+        await quiz.enviar_proxima(update, context)
+        await quiz.enviar_proxima(update, context)
+
+    asyncio.run(cenario())
+
+    assert chamadas["lote"] == 1
+    assert chamadas["uma"] == 0
+    assert [qid for qid, _perm in chamadas["enviadas"]] == fila
+    assert context.chat_data["quiz"]["last_perms"] == dict(chamadas["enviadas"])
+
+
+def test_qid_repetido_na_fila_nao_repete_a_perm(envio):
+    update, context, chamadas = envio
+    qid = _qids(1)[0]
+    context.chat_data["quiz"] = {
+        "user_id": "42", "tema": "T", "subtema": "S", "qids": [qid] * 6, "index": 0,
+        "versao": quiz.banco_atual().versao, "last_perms": {qid: "A,B,C,D"},
+    }
+
+    async def cenario():
+        for _ in range(6):
+            await quiz.enviar_proxima(update, context)
+
+    asyncio.run(cenario())
+
+    perms = ["A,B,C,D"] + [perm for _qid, perm in chamadas["enviadas"]]
+    assert len(perms) == 7
+    assert all(a != b for a, b in zip(perms, perms[1:]))
+    assert context.chat_data["quiz"]["last_perms"] == {qid: perms[-1]}
+    assert chamadas["uma"] == 0
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from processador import PorChatUpdateProcessor
+
+
+def _update(i: int, chat_id: int) -> Update:
+    return Update(i, message=Message(i, datetime.now(), Chat(chat_id, Chat.PRIVATE)))
+
+
+def test_mesmo_chat_em_ordem_e_um_por_vez():
+    async def cenario():
+        proc = PorChatUpdateProcessor(8)
+        ordem, em_voo = [], []
+
+        async def handler(nome):
+            em_voo.append(nome)
+            assert len(em_voo) == 1
+            await asyncio.sleep(0.01)
+            em_voo.remove(nome)
+            ordem.append(nome)
+
+        await asyncio.gather(*(proc.process_update(_update(i, 1), handler(f"a{i}")) for i in range(5)))
+        assert proc.chats_ativos() == 0
+        return ordem
+
+    assert asyncio.run(cenario()) == ["a0", "a1", "a2", "a3", "a4"]
+
+
+def test_chat_ocupado_nao_segura_vaga_de_outro_chat():
+    async def cenario():
+        proc = PorChatUpdateProcessor(1)
+        ordem = []
+        liberar = asyncio.Event()
+
+        async def handler(nome, esperar=False):
+            ordem.append(nome)
+            if esperar:
+                await liberar.wait()
+
+        tarefas = [asyncio.create_task(proc.process_update(_update(1, 1), handler("a1", True)))]
+        await asyncio.sleep(0)
+        tarefas += [
+            asyncio.create_task(proc.process_update(_update(2, 1), handler("a2"))),
+            asyncio.create_task(proc.process_update(_update(3, 1), handler("a3"))),
+            asyncio.create_task(proc.process_update(_update(4, 2), handler("b1"))),
+        ]
+        await asyncio.sleep(0.01)
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return ordem
+
+    # a2/a3 esperam no lock do chat 1, fora do limite: b1 entra logo depois de a1
+    assert asyncio.run(cenario()) == ["a1", "b1", "a2", "a3"]
@@ -0,0 +1,80 @@
+import pytest
+
+import quiz
+
+_ESPECIAIS = r"_*[]()~`>#+-=|{}.!\ "
+
+
+@pytest.fixture
+def render(monkeypatch):
+    monkeypatch.setattr(quiz, "_RENDER", quiz.OrderedDict())
+    return quiz._RENDER
+
+
+def _questao(pergunta: str, correta: str = "A", explicacao: str = "Veja 1.2 (p. 3)!") -> quiz.banco.Question:
+    return quiz.banco.Question(
+        "q1", "Tema_1", "Sub-tema", pergunta, ("a*", "b_", "c.", "d!"), correta, explicacao
+    )
+
+
+def _versao(q: quiz.banco.Question, versao: str) -> quiz.banco.Banco:
+    return quiz.banco.Banco({q.qid: q}, ["Tema_1"], {}, {}, {}, "teste", versao)
+
+
+def test_texto_em_cache_sai_escapado(render):
+    q = _questao(f"Quanto é 2*3 {_ESPECIAIS}?")
+    texto, _teclado, correta = quiz._renderizar_questao(q, "B,A,D,C", "v1")
+
+    assert f"*{quiz.md(q.pergunta)}*" in texto
+    assert r"2\*3 \_\*\[\]\(\)\~\`\>\#\+\-\=\|\{\}\.\!\\ ?" in texto
+    assert r"📘 *Tema:* Tema\_1" in texto
+    assert r"📂 *Subtema:* Sub\-tema" in texto
+    assert "A\\) b\\_\nB\\) a\\*\nC\\) d\\!\nD\\) c\\." in texto
+    assert correta == "B"
+
+    # o acerto devolve o mesmo texto, sem escapar de novo
+    assert quiz._renderizar_questao(q, "B,A,D,C", "v1")[0] is texto
+    assert len(render) == 1
+
+
+def test_explicacao_em_cache_sai_escapada(render, monkeypatch):
+    q = _questao("p")
+    b = _versao(q, "v1")
+    monkeypatch.setattr(quiz, "_VERSOES", quiz.OrderedDict([("v1", b)]))
+
+    texto = quiz.explicacao_renderizada("q1", "v1")
+    assert texto == r"Veja 1\.2 \(p\. 3\)\!"
+    assert quiz.explicacao_renderizada(" q1 ", "v1") is texto
+    assert list(render) == [("q1", None, "v1")]
+
+
+def test_chave_muda_com_a_versao(render, monkeypatch):
+    antiga = _questao("Pergunta antiga", correta="A", explicacao="velha")
+    nova = _questao("Pergunta nova", correta="C", explicacao="nova")
+    monkeypatch.setattr(quiz, "_VERSOES", quiz.OrderedDict([("v1", _versao(antiga, "v1")), ("v2", _versao(nova, "v2"))]))
+
+    texto1, _t, correta1 = quiz._renderizar_questao(antiga, "A,B,C,D", "v1")
+    texto2, _t, correta2 = quiz._renderizar_questao(nova, "A,B,C,D", "v2")
+
+    assert "antiga" in texto1 and "nova" in texto2
+    assert (correta1, correta2) == ("A", "C")
+    assert quiz.explicacao_renderizada("q1", "v1") == "velha"
+    assert quiz.explicacao_renderizada("q1", "v2") == "nova"
+    assert set(render) == {
+        ("q1", "A,B,C,D", "v1"), ("q1", "A,B,C,D", "v2"), ("q1", None, "v1"), ("q1", None, "v2"),
+    }
+    # a versão antiga continua servindo do cache depois da nova
+    assert quiz._renderizar_questao(antiga, "A,B,C,D", "v1")[0] is texto1
+
+
+def test_lru_e_desligado(render, monkeypatch):
+    q = _questao("p")
+    monkeypatch.setattr(quiz, "RENDER_CACHE_MAX", 2)
+    for perm in ("A,B,C,D", "B,A,C,D", "A,B,C,D", "C,A,B,D"):
+        quiz._renderizar_questao(q, perm, "v1")
+    assert list(render) == [("q1", "A,B,C,D", "v1"), ("q1", "C,A,B,D", "v1")]
+
+    render.clear()
+    monkeypatch.setattr(quiz, "RENDER_CACHE_MAX", 0)
+    quiz._renderizar_questao(q, "A,B,C,D", "v1")
+    assert not render
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+_AGREGADOS = (
+    "SELECT user_id, acertos, total FROM user_totais ORDER BY user_id",
+    "SELECT user_id, tema, subtema, acertos, total FROM user_tema_sub ORDER BY user_id, tema, subtema",
+    "SELECT user_id, qid, ok FROM user_qid_status ORDER BY user_id, qid",
+)
+
+
+def _agregados(db) -> list:
+    return [db._fetchall(sql) for sql in _AGREGADOS]
+
+
+@pytest.fixture
+def historico(db):
+    """
+    400 respostas e envios aleatórios; as 300 primeiras de cada tabela com 1 ano de idade.
+    """
+    rnd = random.Random(7)
+    for i in range(400):
+        uid, qid = f"u{rnd.randrange(5)}", f"q{rnd.randrange(12)}"
+        tema = f"T{int(qid[1:]) % 3}"
+        db.record_answer(uid, qid, rnd.random() < 0.6, "A", tema, "S")
+        db.record_sent_question(uid, qid, i, "A", "A,B,C,D")
+    antigo = db._corte(365)
+    db._exec_many([
+        ("UPDATE respostas SET timestamp = ? WHERE id <= 300", (antigo,)),
+        ("UPDATE sent SET timestamp = ? WHERE id <= 300", (antigo,)),
+    ])
+    return db
+
+
+def test_compactar_nao_muda_agregados(historico):
+    db = historico
+    antes = _agregados(db)
+
+    # lotes pequenos: o cursor em manutencao tem de emendar um no outro
+    while db.compactar_respostas(lote=7)[0]:
+        pass
+
+    assert db._fetchone("SELECT COUNT(*) FROM respostas")[0] == 100
+    assert db._fetchone("SELECT SUM(total) FROM respostas_resumo")[0] == 300
+    assert _agregados(db) == antes
+
+    # reconstruir de respostas + respostas_resumo dá exatamente o mesmo
+    db.backfill_aggregates()
+    assert _agregados(db) == antes
+
+
+def test_compactar_e_retomavel(historico):
+    db = historico
+    antes = _agregados(db)
+    db.compactar_respostas(lote=50)
+    db.compactar_respostas(lote=50)
+
+    # como se o processo tivesse caído: o resto continua do cursor gravado
+    assert db._cursor("respostas") == 100
+    db.compactar()
+    db.backfill_aggregates()
+    assert _agregados(db) == antes
+    assert db._cursor("respostas") == 0
+
+
+def test_poda_sent_guarda_o_ultimo_envio(historico):
+    db = historico
+    ultimos = {
+        (uid, qid): perm
+        for uid, qid, perm in db._fetchall("SELECT user_id, qid, perm FROM sent ORDER BY id")
+    }
+    mensagens_novas = db._fetchall("SELECT user_id, qid, message_id, correta_exibida FROM sent WHERE id > 300")
+
+    removidas = db.compactar(lote=13)["sent"]
+
+    assert removidas > 0
+    assert db._fetchone("SELECT COUNT(*) FROM sent")[0] == 400 - removidas
+    for (uid, qid), perm in ultimos.items():
+        assert db.get_last_perm_for_user_question(uid, qid) == perm
+    for uid, qid, mid, correta in mensagens_novas:
+        assert db.get_sent_correct(uid, qid, mid) == correta
+    # nenhuma linha velha sobra se já existe uma mais nova do mesmo usuário/qid
+    assert db._fetchone(
+        """
+        SELECT COUNT(*) FROM sent AS s
+        WHERE id <= 300 AND EXISTS (
+            SELECT 1 FROM sent AS n WHERE n.user_id = s.user_id AND n.qid = s.qid AND n.id > s.id
+        )
+        """
+    )[0] == 0
@@ -0,0 +1,125 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import revisao
+import storage
+
+_INICIO = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _respostas(n: int, seed: int = 3) -> list[tuple]:
+    """
+    Linhas no formato de _answer_statements, de hora em hora, com poucas
+    questões para cada uma ser respondida muitas vezes.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        ts = (_INICIO + timedelta(hours=i, microseconds=rnd.randrange(10**6))).isoformat()
+        uid, qid = f"u{rnd.randrange(3)}", f"q{rnd.randrange(6)}"
+        rows.append((uid, qid, int(rnd.random() < 0.75), "A", "T", "S", ts))
+    return rows
+
+
+def _esperado(rows: list[tuple]) -> dict:
+    estados = {}
+    for uid, qid, ok, _marcada, _tema, _subtema, ts in rows:
+        t = int(datetime.fromisoformat(ts).timestamp())
+        anterior = estados.get((uid, qid))
+        estados[(uid, qid)] = revisao.proximo(anterior and anterior[:3], bool(ok), t)
+    return estados
+
+
+def _agenda(db) -> dict:
+    rows = db._fetchall("SELECT user_id, qid, ease, intervalo, repeticoes, vence_em FROM revisao")
+    return {(uid, qid): (ease, intervalo, repeticoes, vence_em) for uid, qid, ease, intervalo, repeticoes, vence_em in rows}
+
+
+def test_proximo():
+    ease, intervalo, repeticoes, vence_em = revisao.proximo(None, True, 1000)
+    assert (ease, intervalo, repeticoes, vence_em) == (2.6, 1.0, 1, 1000 + revisao.DIA)
+    estado = revisao.proximo((ease, intervalo, repeticoes), True, 0)
+    assert estado[1:3] == (6.0, 2)
+    estado = revisao.proximo(estado[:3], True, 0)
+    assert estado[1:3] == (float(int(6.0 * 2.7 + 0.5)), 3)
+    # errou: volta para 1 dia e zera as repetições
+    estado = revisao.proximo(estado[:3], False, 0)
+    assert estado[1:3] == (1.0, 0)
+    assert revisao.proximo((revisao.EASE_MIN, 1.0, 0), False, 0)[0] == revisao.EASE_MIN
+    assert revisao.proximo((2.5, 300.0, 9), True, 0)[1] == revisao.INTERVALO_MAX
+
+
+def test_sql_igual_ao_python_uma_por_vez(db):
+    rows = _respostas(300)
+    for row in rows:
+        db._exec_many(db._answer_statements([row]))
+    assert _agenda(db) == _esperado(rows)
+
+
+@pytest.mark.parametrize("lote", [17, 300])
+def test_sql_igual_ao_python_em_lote(db, lote):
+    # no write-behind várias respostas da mesma questão caem num INSERT só
+    rows = _respostas(300)
+    for i in range(0, len(rows), lote):
+        db._exec_many(db._answer_statements(rows[i:i + lote]))
+    assert _agenda(db) == _esperado(rows)
+
+
+def test_memoria_igual_ao_python(monkeypatch):
+    rows = _respostas(200)
+    momentos = iter(int(datetime.fromisoformat(r[-1]).timestamp()) for r in rows)
+    monkeypatch.setattr(revisao, "agora", lambda: next(momentos))
+    mem = storage.MemoryStorage()
+    for uid, qid, ok, marcada, tema, subtema, _ts in rows:
+        mem.record_answer(uid, qid, bool(ok), marcada, tema, subtema)
+
+    esperado = _esperado(rows)
+    for uid in {r[0] for r in rows}:
+        fila = sorted((v[3], qid) for (u, qid), v in esperado.items() if u == uid)
+        assert [(qid, vence) for vence, qid in fila] == mem.get_review_queue(uid, 100)
+
+
+def test_fila_em_ordem_de_vencimento_e_reset(db):
+    rows = _respostas(300)
+    db._exec_many(db._answer_statements(rows))
+
+    fila = db.get_review_queue("u1", 3)
+    todas = sorted((v[3], qid) for (uid, qid), v in _esperado(rows).items() if uid == "u1")
+    assert fila == [(qid, vence) for vence, qid in todas[:3]]
+
+    db.reset_user_stats("u1")
+    assert db.get_review_queue("u1") == []
+    assert db.get_review_queue("u0")
+
+
+def test_migracao_semeia_a_partir_do_historico(tmp_path, monkeypatch):
+    import db_turso as db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "antiga.db"))
+    db.configure_pool()
+    try:
+        db.migrar(ate=4)
+        ts = "2026-03-01T12:00:00.123456+00:00"
+        db._exec_many([
+            (
+                "INSERT INTO respostas (user_id, qid, acertou, marcada, tema, subtema, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ("u1", "q1", 0, "A", "T", "S", ts),
+            ),
+            (
+                "INSERT INTO respostas_resumo (user_id, qid, tema, subtema, acertos, total, ok, ultimo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ("u1", "q2", "T", "S", 1, 2, 1, "2026-02-01T00:00:00+00:00"),
+            ),
+        ])
+
+        assert db.migrar(ate=5) == [5]
+
+        t1 = int(datetime.fromisoformat(ts).timestamp())
+        t2 = int(datetime(2026, 2, 1, tzinfo=timezone.utc).timestamp())
+        assert _agenda(db) == {
+            ("u1", "q1"): (2.5, 1.0, 0, t1 + revisao.DIA),
+            ("u1", "q2"): (2.5, 1.0, 1, t2 + revisao.DIA),
+        }
+    finally:
+        db._POOL.close()
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import pytest
+
+import sessoes
+import storage
+
+
+def _chat_data(index: int, aberta: bool = True) -> dict:
+    chat_data = {
+        "quiz": {
+            "user_id": "42",
+            "tema": "Anatomia",
+            "subtema": "Joelho",
+            "qids": ["q1", "q2", "q3"],
+            "index": index,
+            "versao": "v1",
+            "last_perms": {"q1": "B,A,D,C"},
+        },
+        "tema": "Anatomia",
+        "mid_tratado": 7,
+    }
+    if aberta:
+        chat_data.update(correta_exibida="C", qid_atual="q1", perm_atual="B,A,D,C")
+    return chat_data
+
+
+@pytest.fixture
+def memoria():
+    anterior = storage.set_storage(storage.MemoryStorage())
+    yield storage.get_storage()
+    storage.set_storage(anterior)
+
+
+def test_ida_e_volta():
+    chat_data = _chat_data(1)
+    assert sessoes.decodificar(sessoes.codificar(chat_data)) == chat_data
+
+
+def test_ultima_questao_em_aberto_ainda_e_guardada():
+    chat_data = _chat_data(3)
+    assert sessoes.decodificar(sessoes.codificar(chat_data)) == chat_data
+
+
+def test_sessao_terminada_nao_e_guardada():
+    assert sessoes.codificar(_chat_data(3, aberta=False)) is None
+    assert sessoes.codificar({"mid_tratado": 9}) is None
+    # antes do primeiro quiz, só o tema escolhido no menu
+    assert sessoes.decodificar(sessoes.codificar({"tema": "Anatomia", "mid_tratado": 9})) == {"tema": "Anatomia"}
+
+
+def test_carga_apaga_terminadas_e_ilegiveis(memoria):
+    memoria.save_sessions([
+        (1, sessoes.codificar(_chat_data(1))),
+        # gravada antes de codificar descartar as terminadas
+        (2, '{"q":["42","A","B","v1",3,["q1","q2","q3"]],"u":7}'),
+        (3, "{quebrado"),
+    ])
+    persistencia = sessoes.SessaoPersistence()
+
+    carregadas = asyncio.run(persistencia.get_chat_data())
+
+    assert set(carregadas) == {1}
+    assert set(memoria.load_sessions()) == {1}
+
+
+def test_poda_sessoes_largadas(db):
+    db.save_sessions([(1, '{"t":"A"}'), (2, '{"t":"B"}')])
+    db._exec_many([("UPDATE sessoes SET atualizado_em = ? WHERE chat_id = 1", (db._corte(30),))])
+
+    assert db.podar_sessoes(lote=10, dias=14) == (1, 1)
+    assert db.podar_sessoes(lote=10, dias=14) == (0, 0)
+    assert set(db.load_sessions()) == {2}
+
+
+def test_memoria_de_gravados_nao_cresce(memoria, monkeypatch):
+    persistencia = sessoes.SessaoPersistence()
+    aberta, terminada = _chat_data(1), _chat_data(3, aberta=False)
+
+    async def cenario():
+        await persistencia.update_chat_data(1, aberta)
+        await persistencia.update_chat_data(2, aberta)
+        await persistencia.update_chat_data(3, aberta)
+        await persistencia.update_chat_data(4, aberta)
+        assert list(persistencia._gravado) == [1, 2, 3, 4]
+
+        # terminada: a linha sai e o chat também sai da memória
+        await persistencia.update_chat_data(1, terminada)
+        await persistencia.drop_chat_data(2)
+        assert list(persistencia._gravado) == [3, 4]
+        assert set(memoria.load_sessions()) == {3, 4}
+
+        # 3 sem gravar além do prazo da retenção (podar_sessoes apagaria a
+        # linha): some no próximo lote, que regravou o 4
+        persistencia._gravado[3] = (persistencia._gravado[3][0], time.monotonic() - 3600)
+        monkeypatch.setattr(persistencia, "esquecer_apos", 60.0)
+        await persistencia.update_chat_data(4, _chat_data(2))
+        assert list(persistencia._gravado) == [4]
+
+        # esquecido, mas a mesma sessão volta a ser gravada normalmente
+        await persistencia.update_chat_data(3, aberta)
+        assert list(persistencia._gravado) == [4, 3]
+
+    asyncio.run(cenario())
+    assert persistencia.ignoradas == 0
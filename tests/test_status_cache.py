@@ -0,0 +1,114 @@
+import pytest
+
+import rastreio
+
+
+def _idas(fn, *args):
+    """
+    (resultado, idas ao banco) de uma chamada, contadas pelo rastro do rastreio.
+    """
+    rastro = rastreio.Rastro("teste")
+    token = rastreio._ATUAL.set(rastro)
+    try:
+        return fn(*args), rastro.idas
+    finally:
+        rastreio._ATUAL.reset(token)
+
+
+@pytest.fixture
+def cache(db):
+    db._STATUS_CACHE.clear()
+    db._STATUS_CACHE.hits = db._STATUS_CACHE.misses = db._STATUS_CACHE.evictions = 0
+    return db
+
+
+def test_falta_le_do_banco_e_acerto_nao(cache):
+    db = cache
+    db.record_answer("u1", "q1", False, "A", "T", "S")
+
+    status, idas = _idas(db.get_question_status_map, "u1")
+    assert status == {"q1": False}
+    assert idas == 1
+
+    status, idas = _idas(db.get_question_status_map, "u1")
+    assert status == {"q1": False}
+    assert idas == 0
+    assert db.get_status_cache_stats()["hits"] == 1
+    assert db.get_status_cache_stats()["misses"] == 1
+
+
+def test_record_answer_atualiza_o_cache(cache):
+    db = cache
+    db.record_answer("u1", "q1", False, "A", "T", "S")
+    db.get_question_status_map("u1")
+
+    db.record_answer("u1", "q1", True, "A", "T", "S")   # errou e depois acertou: fica True
+    db.record_answer("u1", "q2", False, "B", "T", "S")
+    db.record_answer("u1", "q3", True, "C", "T", "S")
+    db.record_answer("u1", "q3", False, "C", "T", "S")  # acertou antes: continua True
+
+    status, idas = _idas(db.get_question_status_map, "u1")
+    assert idas == 0
+    assert status == {"q1": True, "q2": False, "q3": True}
+    # o mesmo que o banco diz
+    db._STATUS_CACHE.clear()
+    assert db.get_question_status_map("u1") == status
+
+
+def test_copia_devolvida_nao_mexe_no_cache(cache):
+    db = cache
+    db.record_answer("u1", "q1", True, "A", "T", "S")
+    db.get_question_status_map("u1")["q1"] = False
+    assert db.get_question_status_map("u1") == {"q1": True}
+
+
+def test_reset_invalida(cache):
+    db = cache
+    db.record_answer("u1", "q1", True, "A", "T", "S")
+    db.get_question_status_map("u1")
+
+    db.reset_user_stats("u1")
+
+    status, idas = _idas(db.get_question_status_map, "u1")
+    assert status == {}
+    assert idas == 1
+
+
+def test_lru_respeita_o_teto_de_usuarios(cache, monkeypatch):
+    db = cache
+    monkeypatch.setattr(db._STATUS_CACHE, "max_users", 2)
+    for uid in ("u1", "u2", "u3"):
+        db.record_answer(uid, "q1", True, "A", "T", "S")
+        db.get_question_status_map(uid)
+
+    assert db.get_status_cache_stats()["evictions"] == 1
+    assert _idas(db.get_question_status_map, "u3")[1] == 0
+    assert _idas(db.get_question_status_map, "u1")[1] == 1  # o mais antigo saiu
+
+
+def test_expira_pelo_ttl(cache, monkeypatch):
+    db = cache
+    monkeypatch.setattr(db._STATUS_CACHE, "ttl", -1)
+    db.record_answer("u1", "q1", True, "A", "T", "S")
+    db.get_question_status_map("u1")
+    assert _idas(db.get_question_status_map, "u1")[1] == 1
+
+
+def test_escrita_durante_a_carga_descarta_o_mapa_lido(cache, monkeypatch):
+    db = cache
+    db.record_answer("u1", "q1", False, "A", "T", "S")
+    original = db._fetchall
+
+    def fetchall(sql, params=()):
+        rows = original(sql, params)
+        if "FROM user_qid_status" in sql:
+            db.record_answer("u1", "q1", True, "A", "T", "S")  # chega depois da leitura
+        return rows
+
+    monkeypatch.setattr(db, "_fetchall", fetchall)
+    assert db.get_question_status_map("u1") == {"q1": False}
+    monkeypatch.setattr(db, "_fetchall", original)
+
+    status, idas = _idas(db.get_question_status_map, "u1")
+    assert status == {"q1": True}
+    assert idas == 1
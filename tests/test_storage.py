@@ -0,0 +1,30 @@
+import pytest
+
+import storage
+
+
+def test_backend_incompleto_falha_ao_instanciar():
+    class SoUmPouco(storage.Storage):
+        def init_db(self):
+            pass
+
+    with pytest.raises(TypeError, match="abstract"):
+        SoUmPouco()
+
+
+def test_qid_vazio_igual_nos_dois_backends(db):
+    sql = storage.SqlStorage("sqlite")
+    mem = storage.MemoryStorage()
+    sql.get_question_status_map("u1")  # já em cache: as respostas passam pelo write-through
+    for backend in (sql, mem):
+        backend.record_answer("u1", "q1", True, "A", "T", "S")
+        backend.record_answer("u1", "  ", False, "B", "T", "S")
+        backend.record_answer("u1", "", True, "C", "T", "S")
+
+    assert mem.get_question_status_map("u1") == sql.get_question_status_map("u1") == {"q1": True}
+    db._STATUS_CACHE.clear()
+    assert sql.get_question_status_map("u1") == {"q1": True}
+    assert db._fetchall("SELECT qid FROM user_qid_status") == [("q1",)]
+    # os totais contam as três respostas
+    assert mem.get_overall_progress("u1") == sql.get_overall_progress("u1")
+    assert mem.get_overall_progress("u1")["acertos"] == 2
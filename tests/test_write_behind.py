@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def wb(db):
+    # lote e intervalo grandes: nada sai da fila sozinho durante o teste
+    db.configure_write_behind(True, batch_size=10_000, interval=60)
+    return db
+
+
+def test_envio_na_fila_ja_e_lido(wb):
+    wb.record_sent_question("u1", "q1", 10, "b", "B,A,C,D")
+    wb.record_sent_question("u1", "q1", 11, "C", "C,A,B,D")
+
+    assert wb._WB.pending() == 2
+    assert wb.get_sent_correct("u1", "q1", 10) == "B"
+    assert wb.get_sent_correct("u1", "q1", 11) == "C"
+    assert wb.get_last_perm_for_user_question("u1", "q1") == "C,A,B,D"
+    assert wb.get_last_perms_for_user_questions("u1", ["q1", "q2"]) == {"q1": "C,A,B,D"}
+    # leituras de sent não precisam gravar a fila
+    assert wb._WB.pending() == 2
+
+
+def test_fila_mais_nova_que_o_banco(wb):
+    wb.record_sent_question("u1", "q1", 10, "B", "B,A,C,D")
+    wb.flush_writes()
+    wb.record_sent_question("u1", "q1", 11, "D", "D,C,B,A")
+
+    assert wb.get_last_perm_for_user_question("u1", "q1") == "D,C,B,A"
+    assert wb.get_last_perms_for_user_questions("u1", ["q1"]) == {"q1": "D,C,B,A"}
+    assert wb.get_sent_correct("u1", "q1", 10) == "B"
+
+
+def test_agregados_gravam_a_fila_do_usuario_antes_de_ler(wb):
+    wb.record_answer("u1", "q1", True, "A", "T", "S")
+    wb.record_answer("u1", "q2", False, "B", "T", "S")
+    wb.record_answer("u2", "q1", True, "A", "T", "S")
+    wb._STATUS_CACHE.clear()
+
+    assert wb.get_overall_progress("u1") == {"acertos": 1, "erros": 1, "pct": 50.0}
+    assert wb._WB.pending() == 0
+    assert wb.get_question_status_map("u1") == {"q1": True, "q2": False}
+    assert {qid for qid, _vence in wb.get_review_queue("u1")} == {"q1", "q2"}
+    assert [(t["tema"], t["subtema"], t["total"]) for t in wb.get_topic_breakdown("u1")] == [("T", "S", 2)]
+
+
+def test_desligar_drena_a_fila(wb):
+    wb.record_answer("u1", "q1", True, "A", "T", "S")
+    wb.record_sent_question("u1", "q1", 10, "A", "A,B,C,D")
+
+    wb.configure_write_behind(False)
+
+    assert wb._fetchone("SELECT COUNT(*) FROM respostas")[0] == 1
+    assert wb._fetchone("SELECT COUNT(*) FROM sent")[0] == 1